@@ -0,0 +1,248 @@
+"""Benchmarks of the plugin code paths that run on every heartbeat and key press.
+
+The plugin is loaded through fakeDomoticz and its HTTP connections are replaced
+by an in-memory loopback to a SimulatedTV, so the numbers are plugin CPU cost
+without network latency. Reports ops/sec and p50/p99 latency per case:
+
+    python bench.py --save baseline.json
+    python bench.py --compare baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import bravia_decode
+import bravia_ip
+import fakeDomoticz
+import tvstate
+from bravia import SimpleIPTransport
+from bravia_sim import SimulatedTV
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+XML_HEADERS = {"Content-Type": 'text/xml; charset="utf-8"'}
+
+class LoopbackConnection:
+    """Takes the place of the HTTP connection of a TV, requests are answered by a SimulatedTV when pumped."""
+
+    def __init__(self, name, address, port, sim):
+        self.Name = name
+        self.Address = address
+        self.Port = port
+        self.sim = sim
+        self.queue = []
+
+    def Connect(self):
+        pass
+
+    def Connecting(self):
+        return False
+
+    def Connected(self):
+        return True
+
+    def Disconnect(self):
+        pass
+
+    def Send(self, Message, Delay=0):
+        self.queue.append(Message)
+
+    def clear(self):
+        del self.queue[:]
+
+    def pump(self, plugin):
+        """Answer queued requests and feed the replies to the plugin until nothing is outstanding."""
+        while self.queue:
+            message = self.queue.pop(0)
+            headers = dict((name.lower(), value) for name, value in message["Headers"].items())
+            data = message["Data"]
+            status, content_type, body = self.sim.handle(message["URL"], headers,
+                                                         data.encode("utf-8") if isinstance(data, str) else data)
+            plugin.onMessage(self, {"Status": str(status), "Headers": {"Content-Type": content_type}, "Data": body})
+
+def load_plugin(volume=True):
+    """Load plugin.py headless with one TV wired to a loopback SimulatedTV."""
+    runtime = fakeDomoticz.Runtime(os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugin.py"),
+                                   {"Address": "127.0.0.1:1", "Mode1": "sony", "Mode2": "Android",
+                                    "Mode3": "Volume" if volume else "Fixed", "Mode4": "", "Mode5": "10",
+                                    "Mode6": "Normal", "HomeFolder": ""}, quiet=True)
+    module = runtime.load()
+    sim = SimulatedTV()
+    with silenced():
+        runtime.start()
+    plugin = module._plugin
+    tv = plugin.tvs[0]
+    # Swap the real connection for the loopback
+    real = tv.HttpConn
+    if real.Connecting() or real.Connected():
+        real._close()
+    loopback = LoopbackConnection(real.Name, real.Address, real.Port, sim)
+    tv.HttpConn = loopback
+    tv.rc.httpConn = loopback
+    plugin.tvsByConnection[loopback.Name] = tv
+    return runtime, plugin, tv, loopback
+
+@contextlib.contextmanager
+def silenced():
+    """Swallow stdout while measuring, writing to a terminal would be timed with the code."""
+    saved = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        yield
+    finally:
+        sys.stdout = saved
+
+def measure(function, setup=None, iterations=2000, warmup=100):
+    """Time function() per call, setup() runs untimed before every call and its result is passed in."""
+    samples = []
+    with silenced():
+        for index in range(warmup + iterations):
+            args = setup() if setup is not None else ()
+            started = time.perf_counter()
+            function(*args)
+            elapsed = time.perf_counter() - started
+            if index >= warmup:
+                samples.append(elapsed)
+    samples.sort()
+    total = sum(samples)
+    return {"ops": len(samples) / total if total else 0.0,
+            "p50": samples[len(samples) // 2] * 1e6,
+            "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6}
+
+def reply(data, rid):
+    return {"Status": "200", "Headers": JSON_HEADERS, "Data": json.dumps(dict(data, id=rid)).encode()}
+
+def pending_reply(tv, loopback, request, data):
+    """Setup for onMessage cases: issue the request so its id is pending, return the reply to parse."""
+    def setup():
+        request()
+        loopback.clear()
+        return (loopback, reply(data, tv.rc._request_id))
+    return setup
+
+def cases(module, plugin, tv, loopback):
+    sim = loopback.sim
+    power = {"result": sim._system_getPowerStatus({})[0]}
+    playing = {"result": sim._avContent_getPlayingContentInfo({})[0]}
+    volume = {"result": sim._audio_getVolumeInformation({})[0]}
+    commands = {"result": sim._system_getRemoteControllerInfo({})[0]}
+    ircc = {"Status": "200", "Headers": XML_HEADERS, "Data": sim._ircc("<IRCCCode>AAAAAQAAAAEAAAASAw==</IRCCCode>")[2]}
+
+    def on_message(loopback, data):
+        plugin.onMessage(loopback, data)
+        loopback.clear()
+
+    yield "onMessage power status", on_message, pending_reply(tv, loopback, lambda: tv.rc.get_power_status(tv.onPowerStatus), power)
+    yield "onMessage playing content", on_message, pending_reply(tv, loopback, lambda: tv.rc.get_playing_info(tv.onPlayingContent), playing)
+    yield "onMessage volume", on_message, pending_reply(tv, loopback, lambda: tv.rc.get_volume_info(tv.onVolumeInfo), volume)
+    yield "onMessage remote controller info", on_message, pending_reply(tv, loopback, tv.rc.refresh_commands, commands)
+    yield "onMessage IRCC XML", on_message, lambda: (loopback, ircc)
+
+    # Decoding on its own, without routing and device updates
+    yield "decode power status", bravia_decode.decode, lambda: ("getPowerStatus", power["result"])
+    yield "decode playing content", bravia_decode.decode, lambda: ("getPlayingContentInfo", playing["result"])
+    yield "decode volume", bravia_decode.decode, lambda: ("getVolumeInformation", volume["result"])
+
+    commandList = [(tv.Unit(module.UNIT_STATUS), key, 0) for key in module.REMOTE_KEYS]
+    commandList += [(tv.Unit(module.UNIT_SOURCE), "Set Level", 10 * (index + 1)) for index in range(len(tv.sources))]
+    commandList += [(tv.Unit(module.UNIT_CONTROL), "Set Level", level) for level in sorted(module.CONTROL_KEYS)]
+    commandList += [(tv.Unit(module.UNIT_CHANNEL), "Set Level", level) for level in sorted(module.CHANNEL_KEYS)]
+    commandList += [(tv.Unit(module.UNIT_VOLUME), "Set Level", 25)]
+    position = [0]
+    def next_command():
+        tv.state.power = tvstate.ACTIVE
+        loopback.clear()
+        tv.rc.clear_pending()
+        unit, command, level = commandList[position[0] % len(commandList)]
+        position[0] += 1
+        return (unit, command, level, "")
+    yield "onCommand (all keys and levels)", plugin.onCommand, next_command
+
+    yield "_jdata_build", tv.rc._jdata_build, lambda: ("getPlayingContentInfo", None, 42)
+    def send_ircc(code):
+        tv.rc.send_req_ircc(code)
+        loopback.clear()
+    yield "send_req_ircc", send_ircc, lambda: ("AAAAAQAAAAEAAAASAw==",)
+    def send_command(command):
+        tv.rc.send_command(command)
+        loopback.clear()
+    yield "send_command (HTTP IRCC)", send_command, lambda: ("VolumeUp",)
+    ipConn = LoopbackConnection("IpConn0", loopback.Address, "20060", sim)
+    transport = SimpleIPTransport(ipConn)
+    answer = bravia_ip.encode_frame(bravia_ip.ANSWER, bravia_ip.IRCC, bravia_ip.SUCCESS)
+    def send_command_ip(command):
+        tv.rc.set_ip_transport(transport)
+        tv.rc.send_command(command)
+        transport.feed(answer)
+        tv.rc.set_ip_transport(None)
+        ipConn.clear()
+    yield "send_command (Simple IP)", send_command_ip, lambda: ("VolumeUp",)
+    startDateTime = playing["result"][0]["startDateTime"]
+    yield "playing_time", tv.rc.playing_time, lambda: (startDateTime, 1800)
+    yield "calc_time", tv.rc.calc_time, lambda: ("21:45:00", "01:30:00")
+
+    def refresh_setup():
+        tv.scheduler._next_poll = 0
+        loopback.clear()
+        tv.rc.clear_pending()
+        return ()
+    def refresh():
+        plugin.onHeartbeat()
+        loopback.pump(plugin)
+    yield "refresh cycle (heartbeat..volume)", refresh, refresh_setup
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the plugin hot paths")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--filter", default="", help="only run cases containing this text")
+    parser.add_argument("--save", help="write the results as baseline JSON")
+    parser.add_argument("--compare", help="baseline JSON to compare with")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percentage slower that counts as regression")
+    args = parser.parse_args()
+
+    runtime, plugin, tv, loopback = load_plugin()
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+
+    results = {}
+    regressions = 0
+    print("%-36s %12s %10s %10s %s" % ("case", "ops/sec", "p50 us", "p99 us", "vs baseline" if baseline else ""))
+    for name, function, setup in cases(runtime.module, plugin, tv, loopback):
+        if args.filter and args.filter not in name:
+            continue
+        result = measure(function, setup, args.iterations)
+        results[name] = result
+        delta = ""
+        if name in baseline and baseline[name]["p50"]:
+            change = 100.0 * (result["p50"] - baseline[name]["p50"]) / baseline[name]["p50"]
+            delta = "%+.1f%%" % change
+            if change > args.threshold:
+                delta += " REGRESSION"
+                regressions += 1
+        print("%-36s %12.0f %10.1f %10.1f %s" % (name, result["ops"], result["p50"], result["p99"], delta))
+
+    if args.save:
+        with open(args.save, "w") as baseline_file:
+            json.dump({"revision": git_revision(), "python": platform.python_version(), "time": time.time(),
+                       "iterations": args.iterations, "results": results}, baseline_file, indent=2)
+        print("Baseline written to " + args.save)
+    runtime.stop()
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,3 @@
-try:
-    import Domoticz
-except ImportError:
-    import fakeDomoticz as Domoticz
-
 import logging
 import base64
 import collections
@@ -10,10 +5,154 @@ import json
 import socket
 import struct
 
-from datetime import datetime
 import time
 import sys
 
+import bravia_ip
+import log
+from bravia_decode import decode
+from metrics import Metrics
+from programme import ProgrammeCache
+from bravia_protocol import FALLBACK_COMMANDS, RequestCache, build_command_index, lookup_command, magic_packet
+
+# Seconds to wait for a JSON-RPC reply before the request is dropped from the pending table
+REQUEST_TIMEOUT = 10
+# Error code handed to callbacks of requests that got no reply in time (Sony uses positive codes)
+TIMEOUT_ERROR = -1
+# Error code handed to callbacks of replies whose result doesn't have the layout of the method
+INVALID_REPLY_ERROR = -2
+
+# Items requested per getContentList page
+CONTENT_PAGE_SIZE = 50
+# Seconds the source list is trusted before it is loaded again
+SOURCE_TTL = 3600
+# Seconds the channel list is trusted, channels rarely change unless the TV is retuned
+CHANNEL_TTL = 86400
+# Seconds the application list is trusted before it is loaded again
+APP_TTL = 86400
+# getPlayingContentInfo error while an app or the home screen is shown
+ERROR_ILLEGAL_STATE = 7
+
+# Magic packets per Wake-on-LAN burst, each goes out by broadcast and to the address of the TV
+WOL_BURST = 3
+WOL_PORT = 9
+WOL_BROADCAST = "255.255.255.255"
+
+# Seconds to wait for the answer to a Simple IP Control frame
+IP_ANSWER_TIMEOUT = 2
+# Seconds a control that timed out may still be answered, its answer is dropped instead of taken as the state
+IP_LATE_ANSWER = 30
+
+PendingRequest = collections.namedtuple('PendingRequest', 'method callback log_errors sent deadline')
+IPRequest = collections.namedtuple('IPRequest', 'kind function callback sent deadline')
+# Error codes recorded in the metrics for refused Simple IP Control frames
+IP_ERRORS = {bravia_ip.FAILURE: "IP failure", bravia_ip.NOT_FOUND: "IP not found"}
+
+class SimpleIPTransport:
+    """Simple IP Control over a persistent TCP connection (Domoticz Protocol "None").
+
+    Frames are 24 bytes with a fixed layout, so they are packed once per distinct
+    command and answers need no JSON or XML parsing. The TV answers in order, the
+    answer to a control goes to the callback of its request (the answer parameter,
+    None after a timeout), enquiry answers and notifications are returned by feed().
+    Answers that arrive after their request timed out are dropped, a late control
+    answer like *SAINPT0000000000000000 would otherwise read as a state change."""
+
+    def __init__(self, connection, metrics=None):
+        self.connection = connection
+        self.metrics = metrics
+        self.capture = None
+        self.unsupported = set()
+        self._frames = {}
+        self._waiting = collections.deque()
+        self._expired = collections.deque()     # (function, time) of controls that timed out
+        self._reader = bravia_ip.FrameReader()
+
+    def available(self):
+        return self.connection is not None and self.connection.Connected()
+
+    def send(self, kind, function, parameter=bravia_ip.EMPTY, callback=None):
+        key = (kind, function, parameter)
+        frame = self._frames.get(key)
+        if frame is None:
+            frame = self._frames[key] = bravia_ip.encode_frame(kind, function, parameter)
+        self.connection.Send(frame)
+        log.exchange(self.connection.Name, log.SENT, frame)
+        if self.capture is not None:
+            self.capture.sent(self.connection.Name, frame)
+        now = time.time()
+        self._waiting.append(IPRequest(kind, function, callback, now, now + IP_ANSWER_TIMEOUT))
+        if self.metrics is not None:
+            self.metrics.request("IP " + function)
+        return True
+
+    def control(self, function, parameter, callback=None):
+        return self.send(bravia_ip.CONTROL, function, parameter, callback)
+
+    def enquire(self, function):
+        return self.send(bravia_ip.ENQUIRY, function)
+
+    def feed(self, data):
+        """Received bytes, returns the notifications and enquiry answers as (type, function, parameter)."""
+        frames = []
+        for frame in self._reader.feed(data):
+            kind, function, parameter = frame
+            if kind == bravia_ip.ANSWER:
+                # The TV answers in order, the answer to a control that timed out comes before later ones
+                if self._late(function):
+                    log.debug("Late Simple IP answer dropped: %s%s%s", kind, function, parameter)
+                    continue
+                request = self._answered(function)
+                if request is None:
+                    log.debug("Simple IP answer without request dropped: %s%s%s", kind, function, parameter)
+                    continue
+                if self.metrics is not None:
+                    self.metrics.reply("IP " + function, time.time() - request.sent, IP_ERRORS.get(parameter))
+                if request.kind == bravia_ip.CONTROL:
+                    if request.callback is not None:
+                        request.callback(parameter)
+                    continue
+            frames.append(frame)
+        return frames
+
+    def _late(self, function):
+        for entry in self._expired:
+            if entry[0] == function:
+                self._expired.remove(entry)
+                return True
+        return False
+
+    def _answered(self, function):
+        for request in self._waiting:
+            if request.function == function:
+                self._waiting.remove(request)
+                return request
+        return None
+
+    def expire(self, now=None):
+        """Give up on requests the TV didn't answer in time, their callbacks get None."""
+        if now is None:
+            now = time.time()
+        while self._expired and self._expired[0][1] + IP_LATE_ANSWER <= now:
+            self._expired.popleft()
+        while self._waiting and self._waiting[0].deadline <= now:
+            request = self._waiting.popleft()
+            if request.kind == bravia_ip.CONTROL:
+                self._expired.append((request.function, now))
+            if self.metrics is not None:
+                self.metrics.timeout("IP " + request.function)
+            if request.callback is not None:
+                request.callback(None)
+
+    def reset(self):
+        """The connection was lost: fail what is outstanding and start a fresh frame stream."""
+        waiting, self._waiting = self._waiting, collections.deque()
+        self._expired.clear()
+        self._reader = bravia_ip.FrameReader()
+        for request in waiting:
+            if request.callback is not None:
+                request.callback(None)
+
 class BraviaRC:
     httpConn = None
 
@@ -24,117 +163,418 @@ class BraviaRC:
         self._mac = mac
         self._cookies = None
         self._commands = []
+        self._command_index = {}
+        self._content_mapping = collections.OrderedDict()
+        self._sources_loaded = 0
+        self._sources_loading = False
+        self._channels = []
+        self._channel_index = {}
+        self._channels_loaded = 0
+        self._channels_loading = False
+        self._apps = collections.OrderedDict()
+        self._app_by_uri = {}
+        self._apps_loaded = 0
+        self._apps_loading = False
+        self._ip = None
+        self._programmes = ProgrammeCache()
+        self._request_id = 0
+        self._pending = {}
+        # Send times of IRCC requests, the SOAP replies carry no id and come back in order
+        self._ircc_sent = collections.deque()
+        self.metrics = Metrics()
+        # CaptureWriter that records every request sent (capture option of the plugin)
+        self.capture = None
+        # Headers and request bodies are encoded once, only values and the request id change per call
+        self._requests = RequestCache(host, psk)
 
-    def _jdata_build(self, method, params):
-        if params:
-            ret = json.dumps({"method": method, "params": [params], "id": 1, "version": "1.0"})
-        else:
-            ret = json.dumps({"method": method, "params": [], "id": 1, "version": "1.0"})
-        print(ret)
-        return ret
+    def _jdata_build(self, method, params, request_id=1):
+        return self._requests.json(method, params, request_id)
+
+    def _send_json(self, url, method, params, callback=None, log_errors=True, timeout=REQUEST_TIMEOUT):
+        """Send a JSON-RPC call with a unique id and remember it until the reply arrives."""
+        self._request_id += 1
+        request_id = self._request_id
+        if (self.bravia_req_json(url, self._jdata_build(method, params, request_id), log_errors)):
+            now = time.time()
+            self._pending[request_id] = PendingRequest(method, callback, log_errors, now, now + timeout)
+            self.metrics.request(method)
+            return True
+        return False
+
+    def handle_response(self, resp):
+        """Route a JSON-RPC reply to the callback of the request with the same id.
+        Returns False when the id does not belong to an outstanding request."""
+        request = self._pending.pop(resp.get('id'), None)
+        if request is None:
+            return False
+        error = resp.get('error')
+        self.metrics.reply(request.method, time.time() - request.sent, error[0] if error else None)
+        if error is not None and request.log_errors:
+            log.debug("[%s] Error code %s: %s", request.method, error[0], error[1])
+        if request.callback is not None:
+            result = None
+            if error is None:
+                # Known methods arrive as records (bravia_decode), the others as the plain result list
+                try:
+                    result = decode(request.method, resp.get('result'))
+                except ValueError as exception_instance:
+                    log.debug("[%s] %s", request.method, exception_instance)
+                    log.dump("[" + request.method + "] Unexpected result", getattr(self.httpConn, "Name", None))
+                    error = [INVALID_REPLY_ERROR, "Invalid reply"]
+            request.callback(result, error)
+        return True
+
+    def expire_requests(self, now=None):
+        """Drop requests that were not answered in time, their callbacks get a timeout error.
+        Returns the number of requests, IRCC included, that timed out."""
+        if now is None:
+            now = time.time()
+        expired = [request_id for request_id, request in self._pending.items() if request.deadline <= now]
+        for request_id in expired:
+            request = self._pending.pop(request_id)
+            self.metrics.timeout(request.method)
+            log.debug("[%s] No reply on request %s within timeout", request.method, request_id)
+            if request.callback is not None:
+                request.callback(None, [TIMEOUT_ERROR, "Timeout"])
+        count = len(expired)
+        while self._ircc_sent and self._ircc_sent[0] + REQUEST_TIMEOUT <= now:
+            self._ircc_sent.popleft()
+            self.metrics.timeout("IRCC")
+            count += 1
+        return count
+
+    def handle_ircc_reply(self):
+        """The reply to the oldest outstanding IRCC request arrived."""
+        if self._ircc_sent:
+            self.metrics.reply("IRCC", time.time() - self._ircc_sent.popleft())
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def is_pending(self, method):
+        """True while a request of this method waits for its reply."""
+        for request in self._pending.values():
+            if request.method == method:
+                return True
+        return False
+
+    def clear_pending(self):
+        """Forget outstanding requests, replies will never arrive after a disconnect."""
+        self._pending.clear()
+        self._ircc_sent.clear()
+        self._sources_loading = False
+        self._channels_loading = False
+        self._apps_loading = False
 
     def printconf(self):
-        Domoticz.Debug("Host: "+str(self._host)+" PSK: "+self._psk);
+        log.debug("Host: %s", self._host)
         if (self.httpConn):
             if (self.httpConn.Connected()):
-                Domoticz.Log("Connected, IP"+self.httpConn.Address+":"+self.httpConn.Port)
+                log.info("Connected, IP%s:%s", self.httpConn.Address, self.httpConn.Port)
             else:
-                Domoticz.Debug("No connection!")
+                log.debug("No connection!")
         else:
-            Domoticz.Debug("No instance!")
+            log.debug("No instance!")
 
     def send_req_ircc(self, code):
         """Send an IRCC command via HTTP to Sony Bravia."""
         if (self.httpConn.Connected()):
-            headers = { 'X-Auth-PSK': self._psk, 'Soapaction': '"urn:schemas-sony-com:service:IRCC:1#X_SendIRCC"', \
-                        'Host': self._host, 'Connection': 'keep-alive', 'Content-Type': 'application/x-www-form-urlencoded' }
-            data = ("<?xml version=\"1.0\"?><s:Envelope xmlns:s=\"http://schemas.xmlsoap.org" +
-                "/soap/envelope/\" " +
-                "s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\"><s:Body>" +
-                "<u:X_SendIRCC " +
-                "xmlns:u=\"urn:schemas-sony-com:service:IRCC:1\"><IRCCCode>" +
-                code+"</IRCCCode></u:X_SendIRCC></s:Body></s:Envelope>")
             try:
-                self.httpConn.Send({"Verb":"POST", "URL":"/sony/IRCC", "Headers": headers, "Data": data})
+                message = {"Verb":"POST", "URL":"/sony/IRCC", "Headers": self._requests.ircc_headers, "Data": self._requests.ircc(code)}
+                self.httpConn.Send(message)
+                log.exchange(self.httpConn.Name, log.SENT, message)
+                if self.capture is not None:
+                    self.capture.sent(self.httpConn.Name, message)
+                self._ircc_sent.append(time.time())
+                self.metrics.request("IRCC")
                 return True
             except Exception as exception_instance:
-                Domoticz.Debug("[bravia_send_req_ircc] Exception: " + str(exception_instance))
+                log.debug("[bravia_send_req_ircc] Exception: %s", exception_instance)
                 return False
         else:
-            Domoticz.Debug("No connection...")
+            log.debug("No connection...")
         return False
         
     def bravia_req_json(self, url, params, log_errors=True):
         """Send request command via HTTP json to Sony Bravia."""
         if (self.httpConn.Connected()):
-            headers = { 'X-Auth-PSK': self._psk, 'Host': self._host, 'Connection': 'keep-alive', 'Content-Type': 'application/x-www-form-urlencoded' }
             try:
-                self.httpConn.Send({"Verb": "POST", "URL": "/"+url, "Headers": headers, "Data": params})
+                message = {"Verb": "POST", "URL": "/"+url, "Headers": self._requests.json_headers, "Data": params}
+                self.httpConn.Send(message)
+                log.exchange(self.httpConn.Name, log.SENT, message)
+                if self.capture is not None:
+                    self.capture.sent(self.httpConn.Name, message)
                 return True
             except Exception as exception_instance:
-                Domoticz.Debug("[bravia_send_req_ircc] Exception: " + str(exception_instance))
+                log.debug("[bravia_send_req_ircc] Exception: %s", exception_instance)
                 return False
         else:
-            Domoticz.Debug("No connection...")
+            log.debug("No connection...")
         return False
     
+    def set_ip_transport(self, transport):
+        """Send remote commands and volume over Simple IP Control when it is connected, None for HTTP only."""
+        self._ip = transport
+
+    def _ip_usable(self, name):
+        return self._ip is not None and name not in self._ip.unsupported and self._ip.available()
+
+    def _send_ip(self, name, function, parameter, fallback, callback=None):
+        # A refused frame is sent again over HTTP and that command keeps using HTTP. After a timeout
+        # the TV may still have executed it, so it isn't repeated
+        def answered(parameter):
+            if parameter in (bravia_ip.FAILURE, bravia_ip.NOT_FOUND):
+                log.debug("Simple IP Control refused %s, using HTTP", name)
+                self._ip.unsupported.add(name)
+                fallback()
+            elif parameter is None:
+                log.debug("No Simple IP Control answer for %s", name)
+                if callback is not None:
+                    callback(None, [TIMEOUT_ERROR, "Timeout"])
+            elif callback is not None:
+                callback([], None)
+        return self._ip.control(function, parameter, answered)
+
     def send_command(self, command):
-        """Sends a command to the TV."""
-        self.send_req_ircc(self.get_command_code(command))
+        """Sends a command to the TV, over Simple IP Control when that is available."""
+        if self._ip_usable(command):
+            frame = bravia_ip.command_frame(command)
+            if frame is not None:
+                return self._send_ip(command, frame[0], frame[1], lambda: self._send_http_command(command))
+        return self._send_http_command(command)
+
+    def _send_http_command(self, command):
+        code = self.get_command_code(command)
+        if code is None:
+            log.debug("Unknown remote command: %s", command)
+            return False
+        return self.send_req_ircc(code)
         
-    def get_source(self, source):
-        return True
-    #    """Returns list of Sources."""
-    #    original_content_list = []
-    #    content_index = 0
-    #    while True:
-    #        resp = self.bravia_req_json("sony/avContent",
-    #                                    self._jdata_build("getContentList", {"source": source, "stIdx": content_index}))
-    #        if not resp.get('error'):
-    #            if len(resp.get('result')[0]) == 0:
-    #                break
-    #            else:
-    #                content_index = resp.get('result')[0][-1]['index']+1
-    #            original_content_list.extend(resp.get('result')[0])
-    #        else:
-    #            break
-    #    return original_content_list
-
-    def load_source_list(self):
-        return True
-    #    """Load source list from Sony Bravia."""
-    #    original_content_list = []
-    #    resp = self.bravia_req_json("sony/avContent",
-    #                                self._jdata_build("getSourceList", {"scheme": "tv"}))
-    #    if not resp.get('error'):
-    #        results = resp.get('result')[0]
-    #        for result in results:
-    #            if result['source'] in ['tv:dvbc', 'tv:dvbt']:  # tv:dvbc = via cable, tv:dvbt = via DTT
-    #                original_content_list.extend(self.get_source(result['source']))
-
-    #    resp = self.bravia_req_json("sony/avContent",
-    #                                self._jdata_build("getSourceList", {"scheme": "extInput"}))
-    #    if not resp.get('error'):
-    #        results = resp.get('result')[0]
-    #        for result in results:
-    #            if result['source'] == 'extInput:hdmi':  # hdmi input
-    #            ###if result['source'] in ('extInput:hdmi', 'extInput:composite', 'extInput:component'):  # physical inputs
-    #            ###new version, see https://github.com/aparraga/braviarc/commit/d9d26b802ffd669bae40f26160689173b0ce77c8
-    #                resp = self.bravia_req_json("sony/avContent",
-    #                                            self._jdata_build("getContentList", {"source": "extInput:hdmi"}))
-    #                                            ###self._jdata_build("getContentList", result))
-    #                if not resp.get('error'):
-    #                    original_content_list.extend(resp.get('result')[0])
-
-    #    return_value = collections.OrderedDict()
-    #    for content_item in original_content_list:
-    #        return_value[content_item['title']] = content_item['uri']
-    #    return return_value
+    def get_source(self, source, callback, start=0, items=None):
+        """Page through getContentList of a source, callback gets the complete list once the last page is in."""
+        if items is None:
+            items = []
+        def on_page(result, error):
+            if error is not None:
+                # A page past the end is refused by some models, what was collected so far is the list.
+                # A page that got no (valid) reply leaves the list incomplete
+                if items and error[0] not in (TIMEOUT_ERROR, INVALID_REPLY_ERROR):
+                    error = None
+                callback(items, error)
+                return
+            page = result[0] if result else []
+            items.extend(page)
+            if len(page) < CONTENT_PAGE_SIZE:
+                callback(items, None)
+            else:
+                self.get_source(source, callback, page[-1].get('index', start + len(page) - 1) + 1, items)
+        return self._send_json("sony/avContent", "getContentList", {"source": source, "stIdx": start, "cnt": CONTENT_PAGE_SIZE}, on_page)
+
+    def load_source_list(self, callback=None):
+        """Load the external inputs (title -> uri) from Sony Bravia, page by page.
+        The result is cached for SOURCE_TTL seconds, callback gets the mapping when complete."""
+        if self._sources_loading:
+            return False
+        mapping = collections.OrderedDict()
+        outstanding = []
+        failed = []
+        def finish():
+            self._sources_loading = False
+            self._content_mapping = mapping
+            self._sources_loaded = time.time()
+            log.debug("Source list loaded: %s", ", ".join(mapping.keys()))
+            if callback is not None:
+                callback(mapping)
+        def on_content(items, error):
+            # An input that couldn't be read fails the whole load, the cached list stays and the next poll tries again
+            if failed:
+                return
+            if error is not None:
+                failed.append(error)
+                self._sources_loading = False
+                log.debug("Source list not loaded: %s", error)
+                return
+            for content_item in items:
+                if content_item.get('title') and content_item.get('uri'):
+                    mapping[content_item['title']] = content_item['uri']
+            outstanding.pop()
+            if not outstanding:
+                finish()
+        def on_sources(result, error):
+            if error is not None:
+                self._sources_loading = False
+                return
+            for result in result[0]:
+                if result['source'].startswith('extInput:'):    # physical inputs: hdmi, composite, component, ...
+                    outstanding.append(result['source'])
+            if not outstanding:
+                finish()
+            for source in list(outstanding):
+                self.get_source(source, on_content)
+        self._sources_loading = self._send_json("sony/avContent", "getSourceList", {"scheme": "extInput"}, on_sources)
+        return self._sources_loading
+
+    def sources_stale(self, now=None):
+        """True when the source list was never loaded, invalidated or is older than SOURCE_TTL."""
+        if now is None:
+            now = time.time()
+        return not self._sources_loading and now - self._sources_loaded >= SOURCE_TTL
+
+    def invalidate_sources(self):
+        """Forget the cached source list, e.g. after the TV reported an input that isn't in it."""
+        self._sources_loaded = 0
 
-    def get_playing_info(self):
+    def source_uri(self, title):
+        return self._content_mapping.get(title)
+
+    def set_sources(self, mapping, loaded=None):
+        """Use a source list (title -> uri), e.g. read from disk."""
+        self._content_mapping = collections.OrderedDict(mapping)
+        self._sources_loaded = time.time() if loaded is None else loaded
+
+    def source_mapping(self):
+        return self._content_mapping
+
+    def sources_loaded(self):
+        return self._sources_loaded
+
+    def load_channel_list(self, callback=None):
+        """Load the tuner channels (tv:dvbt, tv:dvbc, ...) from Sony Bravia, page by page.
+        The result is cached for CHANNEL_TTL seconds, callback gets the channel list when complete."""
+        if self._channels_loading:
+            return False
+        channels = []
+        outstanding = []
+        failed = []
+        def on_content(items, error):
+            # A partial channel list would be cached for CHANNEL_TTL and on disk, the load is tried again instead
+            if failed:
+                return
+            if error is not None:
+                failed.append(error)
+                self._channels_loading = False
+                log.debug("Channel list not loaded: %s", error)
+                return
+            for content_item in items:
+                if content_item.get('uri') and content_item.get('dispNum'):
+                    channels.append({'dispNum': content_item['dispNum'], 'title': content_item.get('title', ''),
+                                     'uri': content_item['uri']})
+            outstanding.pop()
+            if not outstanding:
+                self._channels_loading = False
+                self.set_channels(channels)
+                log.debug("Channel list loaded: %s channels", len(channels))
+                if callback is not None:
+                    callback(self._channels)
+        def on_sources(result, error):
+            if error is not None:
+                self._channels_loading = False
+                return
+            for result in result[0]:
+                if result['source'].startswith('tv:'):
+                    outstanding.append(result['source'])
+            if not outstanding:
+                self._channels_loading = False
+                self.set_channels(channels)
+                if callback is not None:
+                    callback(self._channels)
+            for source in list(outstanding):
+                self.get_source(source, on_content)
+        self._channels_loading = self._send_json("sony/avContent", "getSourceList", {"scheme": "tv"}, on_sources)
+        return self._channels_loading
+
+    def set_channels(self, channels, loaded=None):
+        """Use a channel list, e.g. read from disk. The first channel with a number wins the dispNum index."""
+        self._channels = channels
+        self._channel_index = {}
+        for channel in channels:
+            try:
+                self._channel_index.setdefault(int(channel['dispNum']), channel)
+            except (KeyError, ValueError):
+                pass
+        self._channels_loaded = time.time() if loaded is None else loaded
+
+    def channel_list(self):
+        return self._channels
+
+    def channels_loaded(self):
+        return self._channels_loaded
+
+    def channels_stale(self, now=None):
+        """True when the channel list was never loaded or is older than CHANNEL_TTL."""
+        if now is None:
+            now = time.time()
+        return not self._channels_loading and now - self._channels_loaded >= CHANNEL_TTL
+
+    def channel_uri(self, dispNum):
+        """URI of a channel number ("001" or 1), None when the channel is unknown."""
+        try:
+            channel = self._channel_index.get(int(dispNum))
+        except (TypeError, ValueError):
+            return None
+        return channel['uri'] if channel is not None else None
+
+    def tune_channel(self, dispNum, callback=None):
+        """Switch to a channel number with a single setPlayContent call."""
+        uri = self.channel_uri(dispNum)
+        if uri is None:
+            return False
+        return self.play_content(uri, callback)
+
+    def load_app_list(self, callback=None):
+        """Load the installed applications (title -> uri and icon) from Sony Bravia.
+        The result is cached for APP_TTL seconds, callback gets the app list when complete."""
+        if self._apps_loading:
+            return False
+        def on_apps(result, error):
+            self._apps_loading = False
+            if error is not None:
+                return
+            apps = []
+            for app in result[0]:
+                if app.get('title') and app.get('uri'):
+                    apps.append({'title': app['title'], 'uri': app['uri'], 'icon': app.get('icon', '')})
+            self.set_apps(apps)
+            log.debug("Application list loaded: %s", ", ".join(self._apps.keys()))
+            if callback is not None:
+                callback(self.app_list())
+        self._apps_loading = self._send_json("sony/appControl", "getApplicationList", None, on_apps)
+        return self._apps_loading
+
+    def set_apps(self, apps, loaded=None):
+        """Use an application list, e.g. read from disk."""
+        self._apps = collections.OrderedDict((app['title'], app) for app in apps)
+        self._app_by_uri = dict((app['uri'], app) for app in apps)
+        self._apps_loaded = time.time() if loaded is None else loaded
+
+    def app_list(self):
+        return list(self._apps.values())
+
+    def apps_loaded(self):
+        return self._apps_loaded
+
+    def apps_stale(self, now=None):
+        """True when the application list was never loaded or is older than APP_TTL."""
+        if now is None:
+            now = time.time()
+        return not self._apps_loading and now - self._apps_loaded >= APP_TTL
+
+    def app_uri(self, title):
+        app = self._apps.get(title)
+        return app['uri'] if app is not None else None
+
+    def app_by_uri(self, uri):
+        """Application entry of a uri, None when the uri isn't an installed app."""
+        return self._app_by_uri.get(uri)
+
+    def set_active_app(self, uri, callback=None):
+        """Launch an application by uri with a single request."""
+        return self._send_json("sony/appControl", "setActiveApp", {"uri": uri}, callback)
+
+    def get_playing_info(self, callback=None):
         """Get information on program that is shown on TV."""
         if (self.httpConn.Connected()):
-            if (self.bravia_req_json("sony/avContent", self._jdata_build("getPlayingContentInfo", None))):
+            if (self._send_json("sony/avContent", "getPlayingContentInfo", None, callback)):
                 return True
         return False
     #    return_value = {}
@@ -152,10 +592,10 @@ class BraviaRC:
     #        return_value['startDateTime'] = playing_content_data.get('startDateTime')
     #    return return_value
 
-    def get_power_status(self):
+    def get_power_status(self, callback=None):
         """Get power status: off, active, standby."""
         if (self.httpConn.Connected()):
-            if(self.bravia_req_json("sony/system", self._jdata_build("getPowerStatus", None), False)):
+            if(self._send_json("sony/system", "getPowerStatus", None, callback, False)):
                 return True
         return False
     #    return_value = 'off' # by default the TV is turned off
@@ -170,30 +610,44 @@ class BraviaRC:
 
     def _refresh_commands(self):
         if (self.httpConn.Connected()):
-            if (self.bravia_req_json("sony/system", self._jdata_build("getRemoteControllerInfo", None))):
+            if (self._send_json("sony/system", "getRemoteControllerInfo", None, self._on_commands)):
                 return True
         return False
+
+    def _on_commands(self, result, error):
+        if error is None and result is not None:
+            self.set_commands(result.commands)
+            log.debug("Commands set")
         #resp = 
         """if not resp.get('error'):
             self._commands = resp.get('result')[1]
         else:
             Domoticz.Debug("[bravia_refresh_commands] JSON request error: " + json.dumps(resp, indent=4))"""
 
+    def refresh_commands(self):
+        """Ask the TV for its remote controller codes, the reply replaces the command index."""
+        return self._refresh_commands()
+
+    def has_commands(self):
+        return len(self._command_index) > 0
+
+    def command_list(self):
+        """Commands as reported by getRemoteControllerInfo, empty until they were read or set."""
+        return self._commands
+
     def set_commands(self, commands):
         self._commands = commands
-            
+        self._command_index = build_command_index(commands)
+        self._requests.prime_ircc(self._command_index.values())
+
     def get_command_code(self, command_name):
-        if len(self._commands) == 0:
-            self._refresh_commands()
-        for command_data in self._commands:
-            if command_data.get('name') == command_name:
-                return command_data.get('value')
-        return None
+        """Code reported by the TV for this command, or the hardcoded code for models that don't answer."""
+        return lookup_command(self._command_index, command_name)
 
-    def get_volume_info(self):
+    def get_volume_info(self, callback=None):
         """Get volume info."""
         #resp = 
-        return self.bravia_req_json("sony/audio", self._jdata_build("getVolumeInformation", None))
+        return self._send_json("sony/audio", "getVolumeInformation", None, callback)
         """if not resp.get('error'):
             results = resp.get('result')[0]
             for result in results:
@@ -203,10 +657,10 @@ class BraviaRC:
             Domoticz.Debug("[get_volume_info] JSON request error:" + json.dumps(resp, indent=4))
         return None"""
         
-    def get_system_info(self):
+    def get_system_info(self, callback=None):
         #return_value = {}
         #resp = 
-        return self.bravia_req_json("sony/system", self._jdata_build("getSystemInformation", None))
+        return self._send_json("sony/system", "getSystemInformation", None, callback)
         """if resp is not None and not resp.get('error'):
             #print('=>', resp, '<=')
             system_content_data = resp.get('result')[0]
@@ -222,11 +676,11 @@ class BraviaRC:
             return_value['cid'] = system_content_data.get('cid')
         return return_value"""
 
-    def get_network_info(self):
+    def get_network_info(self, callback=None):
         """Not available in newer sony Bravia TVs, get_system_info will return MAC"""
         #return_value = {}
         #resp = 
-        return self.bravia_req_json("sony/system", self._jdata_build("getNetworkSettings", None))
+        return self._send_json("sony/system", "getNetworkSettings", None, callback)
         """if resp is not None and not resp.get('error'):
             #print('=>', resp, '<=')
             network_content_data = resp.get('result')[0]
@@ -236,83 +690,113 @@ class BraviaRC:
             return_value['gateway'] = network_content_data[0]['gateway']
         return return_value"""
         
-    def set_volume_level(self, volume):
+    def set_volume_level(self, volume, callback=None):
         """Set volume level, range 0..100."""
-        self.bravia_req_json("sony/audio", self._jdata_build("setAudioVolume", {"target": "speaker",
-                                                                                "volume": volume}))    
+        send_json = lambda: self._send_json("sony/audio", "setAudioVolume", {"target": "speaker", "volume": volume}, callback)
+        if self._ip_usable("setAudioVolume") and str(volume).isdigit():
+            return self._send_ip("setAudioVolume", bravia_ip.VOLUME, bravia_ip.encode_number(volume), send_json, callback)
+        return send_json()
+
+    def has_wol(self):
+        """True when a MAC address is configured, so the TV can be woken over the network."""
+        return magic_packet(self._mac) is not None
+
+    def set_mac(self, mac):
+        """MAC address for Wake-on-LAN, e.g. the one the TV reported in getSystemInformation."""
+        self._mac = mac
+
+    def _wakeonlan(self, burst=WOL_BURST):
+        packet = magic_packet(self._mac)
+        if packet is None:
+            return False
+        sent = 0
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            for attempt in range(burst):
+                # Broadcast reaches a TV whose ARP entry expired, unicast passes routers that drop broadcasts
+                for target in (WOL_BROADCAST, self._host):
+                    try:
+                        sock.sendto(packet, (target, WOL_PORT))
+                        sent += 1
+                    except OSError as err:
+                        log.debug("WOL to %s failed: %s", target, err)
+        finally:
+            sock.close()
+        return sent > 0
+
     def turn_on_WOL(self):
         """Turn the media player on using WOL."""
-        self._wakeonlan()
-        
+        return self._wakeonlan()
+
+    def set_power_status(self, status, callback=None):
+        """Switch the TV on (True) or to standby (False) with setPowerStatus."""
+        if (self.httpConn.Connected()):
+            return self._send_json("sony/system", "setPowerStatus", {"status": bool(status)}, callback, False)
+        return False
+
     def turn_on_command(self):
         """Turn the media player on using command. Only confirmed working on Android, can be used when WOL is not available."""
-        #if self.get_power_status() != 'active':
-        #self.send_req_ircc(self.get_command_code('TvPower'))
-        self.send_req_ircc("AAAAAQAAAAEAAAAVAw==")
-        #self.bravia_req_json("sony/system", self._jdata_build("setPowerStatus", {"status": "True"}))
+        if self._ip_usable("setPowerStatus"):
+            self._ip.control(bravia_ip.POWER, bravia_ip.encode_number(1))
+        return self.set_power_status(True)
             
     def turn_on(self):
-        """Normal turn on"""
-        self.turn_on_command()
+        """Normal turn on: a WOL burst when a MAC address is known and setPowerStatus alongside it."""
+        woken = self.turn_on_WOL()
+        return self.turn_on_command() or woken
         
     def turn_off(self):
         """Turn off media player."""
-        #self.send_req_ircc(self.get_command_code('PowerOff'))
-        self.send_req_ircc("AAAAAQAAAAEAAAAvAw==")
+        self.send_command('PowerOff')
+
     def volume_up(self):
         """Volume up the media player."""
-        #self.send_req_ircc(self.get_command_code('VolumeUp'))
-        self.send_req_ircc("AAAAAQAAAAEAAAASAw==")
+        self.send_command('VolumeUp')
 
     def volume_down(self):
         """Volume down media player."""
-        #self.send_req_ircc(self.get_command_code('VolumeDown'))
-        self.send_req_ircc("AAAAAQAAAAEAAAATAw==")
+        self.send_command('VolumeDown')
 
     def mute_volume(self): #--> def mute_volume(self, mute):
         """Send mute command."""
-        #self.send_req_ircc(self.get_command_code('Mute'))
-        self.send_req_ircc("AAAAAQAAAAEAAAAUAw==")
+        self.send_command('Mute')
 
-    def select_source(self, source):
-        """Set the input source."""
+    def select_source(self, source, callback=None):
+        """Set the input source with a single setPlayContent call."""
         if source in self._content_mapping:
             uri = self._content_mapping[source]
-            self.play_content(uri)
+            self.play_content(uri, callback)
+            return True
+        return False
 
-    def play_content(self, uri):
+    def play_content(self, uri, callback=None):
         """Play content by URI."""
-        self.bravia_req_json("sony/avContent", self._jdata_build("setPlayContent", {"uri": uri}))
+        return self._send_json("sony/avContent", "setPlayContent", {"uri": uri}, callback)
 
     def media_play(self):
         """Send play command."""
-        #self.send_req_ircc(self.get_command_code('Play'))
-        self.send_req_ircc("AAAAAgAAAJcAAAAaAw==")
+        self.send_command('Play')
 
     def media_pause(self):
         """Send media pause command to media player."""
-        #self.send_req_ircc(self.get_command_code('Pause'))
-        self.send_req_ircc("AAAAAgAAAJcAAAAZAw==")
+        self.send_command('Pause')
         
     def media_tv_pause(self):
         """Send media pause command to TV."""
-        #self.send_req_ircc(self.get_command_code('TvPause'))
-        # Non existent
+        self.send_command('TvPause')
         
     def media_stop(self):
         """Send stopcommand to media player."""
-        #self.send_req_ircc(self.get_command_code('Stop'))
-        self.send_req_ircc("AAAAAgAAAJcAAAAYAw==")
+        self.send_command('Stop')
 
     def media_next_track(self):
         """Send next track command."""
-        #self.send_req_ircc(self.get_command_code('Next'))
-        self.send_req_ircc("AAAAAgAAAJcAAAA9Aw==")
+        self.send_command('Next')
 
     def media_previous_track(self):
         """Send the previous track command."""
-        #self.send_req_ircc(self.get_command_code('Prev'))
-        self.send_req_ircc("AAAAAgAAAJcAAAA8Aw==")
+        self.send_command('Prev')
         
     def calc_time(self, *times):
         """Calculate the sum of times, value is returned in HH:MM."""
@@ -326,28 +810,15 @@ class BraviaRC:
             hr -= 24
         return ("%02d:%02d" % (hr, min))
     
-    def playing_time(self, startDateTime, durationSec):
+    def programme(self, uri, startDateTime, durationSec):
+        """Timing of the programme from a playing info reply, parsed once per programme."""
+        return self._programmes.get(uri, startDateTime, durationSec)
+
+    def playing_time(self, startDateTime, durationSec, uri=None):
         """Give starttime, endtime and percentage played."""
-        #get starttime (2017-03-24T00:00:00+0100) and calculate endtime with duration (secs)
-        date_format = "%Y-%m-%dT%H:%M:%S"
-        try:
-            playingtime = datetime.now() - datetime.strptime(startDateTime[:-5], date_format)
-        except TypeError:
-            #https://docs.python.org/3/library/datetime.html#strftime-strptime-behavior
-            #playingtime = datetime.now() - datetime.fromtimestamp(time.mktime(time.strptime(startDateTime[:-5], date_format)))
-            playingtime = datetime.now() - datetime(*(time.strptime(startDateTime[:-5], date_format)[0:6]))
-        try:
-            starttime = datetime.time(datetime.strptime(startDateTime[:-5], date_format))
-        except TypeError:
-            #starttime = datetime.time(datetime.fromtimestamp(time.mktime(time.strptime(startDateTime[:-5], date_format))))
-            starttime = datetime.time(datetime(*(time.strptime(startDateTime[:-5], date_format)[0:6])))
-        
-        duration = time.strftime('%H:%M:%S', time.gmtime(durationSec))
-        endtime = self.calc_time(str(starttime), str(duration))
-        starttime = starttime.strftime('%H:%M')
-        #print(playingtime.seconds, tvplaying['durationSec'])
-        perc_playingtime = int(round(((playingtime.seconds / durationSec) * 100),0))
-        return str(starttime), str(endtime), str(perc_playingtime)
+        #starttime (2017-03-24T00:00:00+0100) is converted with its time zone, endtime is starttime plus duration (secs)
+        programme = self._programmes.get(uri, startDateTime, durationSec)
+        return programme.start_text, programme.end_text, str(programme.progress())
         
     def send_testpacket(self):
         """Sends a test packet to verify functionality of Domoticz Connection / Send"""
@@ -361,6 +832,6 @@ class BraviaRC:
             try:
                 self.httpConn.Send({"Verb": "POST", "URL": "/sony/system", "Headers": headers, "Data": content})
             except Exception as exception_instance:
-                Domoticz.Debug("[bravia_send_req_ircc] Exception: " + str(exception_instance))
+                log.debug("[bravia_send_req_ircc] Exception: %s", exception_instance)
         else:
-            Domoticz.Debug("No connection...");
\ No newline at end of file
+            log.debug("No connection...")
\ No newline at end of file
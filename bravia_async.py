@@ -0,0 +1,222 @@
+"""Standalone asyncio client for Sony Bravia TVs.
+
+Uses the same protocol helpers as the Domoticz plugin but returns the parsed
+result of every call, so it can be used from scripts, benchmarks or a bridge:
+
+    async def main():
+        tv = AsyncBraviaRC("192.168.1.191", "sony")
+        print(await tv.get_power_status())
+        await tv.close()
+"""
+
+import asyncio
+import json
+
+from bravia_protocol import BraviaError, RequestCache, build_command_index, lookup_command
+
+# Default seconds a single call may take, including connecting
+DEFAULT_TIMEOUT = 5
+# Idle keep-alive connections kept per host
+POOL_SIZE = 4
+
+class HttpPool:
+    """Keep-alive HTTP/1.1 connections, pooled per (host, port).
+
+    One pool can be shared by several clients, a connection is only used by one
+    request at a time."""
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self._idle = {}
+        self.connects = 0
+        self.reuses = 0
+
+    async def request(self, host, port, url, headers, body):
+        """POST body to url, returns (status, headers, body bytes)."""
+        key = (host, port)
+        payload = body.encode("utf-8") if isinstance(body, str) else body
+        request = self._build(url, headers, payload)
+        while True:
+            idle = self._idle.get(key)
+            reused = bool(idle)
+            if reused:
+                reader, writer = idle.pop()
+                self.reuses += 1
+            else:
+                reader, writer = await asyncio.open_connection(host, port)
+                self.connects += 1
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, response_headers, data = await self._read_response(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    # The TV closed the idle connection, try again on a fresh one
+                    continue
+                raise
+            except BaseException:
+                # Timeout or cancellation half way a response, the connection can't be reused
+                writer.close()
+                raise
+            if response_headers.get("connection", "").lower() == "close":
+                writer.close()
+            else:
+                self._release(key, reader, writer)
+            return status, response_headers, data
+
+    def _release(self, key, reader, writer):
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self.size and not reader.at_eof():
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    def _build(self, url, headers, payload):
+        lines = ["POST " + url + " HTTP/1.1"]
+        for name, value in headers.items():
+            lines.append(name + ": " + value)
+        lines.append("Content-Length: " + str(len(payload)))
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by TV")
+        status = int(status_line.split(None, 2)[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, sep, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            data = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                data += await reader.readexactly(size)
+                await reader.readline()
+        elif "content-length" in headers:
+            data = await reader.readexactly(int(headers["content-length"]))
+        else:
+            data = await reader.read()
+            headers["connection"] = "close"
+        return status, headers, data
+
+    async def close(self):
+        for idle in self._idle.values():
+            for reader, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+class AsyncBraviaRC:
+    """asyncio counterpart of BraviaRC, every call returns the parsed result."""
+
+    def __init__(self, host, psk, port=80, mac=None, timeout=DEFAULT_TIMEOUT, pool=None):
+        self._host = host
+        self._port = port
+        self._psk = psk
+        self._mac = mac
+        self.timeout = timeout
+        self._pool = pool or HttpPool()
+        self._own_pool = pool is None
+        self._request_id = 0
+        self._command_index = {}
+        self._requests = RequestCache(host, psk)
+
+    async def call(self, service, method, params=None, timeout=None):
+        """Call a JSON-RPC method on sony/<service>, returns the 'result' list or raises BraviaError."""
+        self._request_id += 1
+        body = self._requests.json(method, params, self._request_id)
+        status, headers, data = await asyncio.wait_for(
+            self._pool.request(self._host, self._port, "/sony/" + service, self._requests.json_headers, body),
+            timeout or self.timeout)
+        try:
+            resp = json.loads(data.decode("utf-8", "ignore"))
+        except ValueError:
+            raise BraviaError(status, "Invalid JSON reply")
+        error = resp.get("error")
+        if error is not None:
+            raise BraviaError(error[0], error[1])
+        return resp.get("result")
+
+    async def send_req_ircc(self, code, timeout=None):
+        """Send an IRCC command, True when the TV accepted it."""
+        status, headers, data = await asyncio.wait_for(
+            self._pool.request(self._host, self._port, "/sony/IRCC", self._requests.ircc_headers, self._requests.ircc(code)),
+            timeout or self.timeout)
+        return status == 200
+
+    async def send_command(self, command, timeout=None):
+        code = lookup_command(self._command_index, command)
+        if code is None:
+            raise KeyError("Unknown remote command: " + str(command))
+        return await self.send_req_ircc(code, timeout)
+
+    async def get_power_status(self, timeout=None):
+        """Get power status: off, active, standby."""
+        return (await self.call("system", "getPowerStatus", None, timeout))[0].get("status")
+
+    async def get_playing_info(self, timeout=None):
+        """Get information on program that is shown on TV, empty when the TV has no content info (apps)."""
+        try:
+            return (await self.call("avContent", "getPlayingContentInfo", None, timeout))[0]
+        except BraviaError as err:
+            if err.code == 7:   # Illegal State: an app or the home screen is shown
+                return {}
+            raise
+
+    async def get_volume_info(self, timeout=None):
+        """Volume information of all targets (speaker, headphone)."""
+        return (await self.call("audio", "getVolumeInformation", None, timeout))[0]
+
+    async def get_system_info(self, timeout=None):
+        return (await self.call("system", "getSystemInformation", None, timeout))[0]
+
+    async def get_remote_controller_info(self, timeout=None):
+        """Command list of the TV, also used for send_command from then on."""
+        commands = (await self.call("system", "getRemoteControllerInfo", None, timeout))[1]
+        self._command_index = build_command_index(commands)
+        self._requests.prime_ircc(self._command_index.values())
+        return commands
+
+    async def set_volume_level(self, volume, timeout=None):
+        """Set volume level, range 0..100, or a relative "+N"/"-N"."""
+        return await self.call("audio", "setAudioVolume", {"target": "speaker", "volume": str(volume)}, timeout)
+
+    async def play_content(self, uri, timeout=None):
+        return await self.call("avContent", "setPlayContent", {"uri": uri}, timeout)
+
+    async def get_application_list(self, timeout=None):
+        """Installed applications: title, uri and icon of each."""
+        return (await self.call("appControl", "getApplicationList", None, timeout))[0]
+
+    async def set_active_app(self, uri, timeout=None):
+        return await self.call("appControl", "setActiveApp", {"uri": uri}, timeout)
+
+    async def set_power_status(self, status, timeout=None):
+        return await self.call("system", "setPowerStatus", {"status": bool(status)}, timeout)
+
+    async def turn_on(self, timeout=None):
+        return await self.send_command("TvPower", timeout)
+
+    async def turn_off(self, timeout=None):
+        return await self.send_command("PowerOff", timeout)
+
+    async def volume_up(self, timeout=None):
+        return await self.send_command("VolumeUp", timeout)
+
+    async def volume_down(self, timeout=None):
+        return await self.send_command("VolumeDown", timeout)
+
+    async def mute_volume(self, timeout=None):
+        return await self.send_command("Mute", timeout)
+
+    async def close(self):
+        """Close the pooled connections, unless the pool was handed in by the caller."""
+        if self._own_pool:
+            await self._pool.close()
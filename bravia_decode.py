@@ -0,0 +1,132 @@
+"""Decoders of Sony Bravia JSON-RPC results into compact records.
+
+The reply of a method is turned into a __slots__ record once, when it arrives, so
+the plugin reads attributes instead of probing nested lists and dicts. Methods
+without a decoder keep their plain result. No Domoticz dependency.
+"""
+
+# Media types of the HTTP replies, the part of Content-Type before any ';'
+JSON = "application/json"
+XML = "text/xml"
+
+def media_type(content_type):
+    """'text/xml; charset="utf-8"' -> 'text/xml'"""
+    return content_type.split(";", 1)[0].strip().lower() if content_type else ""
+
+class PowerStatus:
+    __slots__ = ("status",)
+
+    def __init__(self, status):
+        self.status = status
+
+class PlayingContent:
+    """getPlayingContentInfo, every field is None when the TV didn't report it (apps, home screen)."""
+
+    __slots__ = ("uri", "source", "title", "programTitle", "programMediaType", "dispNum", "startDateTime", "durationSec")
+
+    def __init__(self, uri=None, source=None, title=None, programTitle=None, programMediaType=None,
+                 dispNum=None, startDateTime=None, durationSec=None):
+        self.uri = uri
+        self.source = source
+        self.title = title
+        self.programTitle = programTitle
+        self.programMediaType = programMediaType
+        self.dispNum = dispNum
+        self.startDateTime = startDateTime
+        self.durationSec = durationSec
+
+# Content of an app or the home screen, the TV answers getPlayingContentInfo with Illegal State
+NO_CONTENT = PlayingContent()
+
+class VolumeTarget:
+    __slots__ = ("target", "volume", "mute", "minVolume", "maxVolume")
+
+    def __init__(self, target, volume, mute, minVolume, maxVolume):
+        self.target = target
+        self.volume = volume
+        self.mute = mute
+        self.minVolume = minVolume
+        self.maxVolume = maxVolume
+
+class VolumeInfo:
+    """getVolumeInformation, one VolumeTarget per output (speaker, headphone)."""
+
+    __slots__ = ("targets",)
+
+    def __init__(self, targets):
+        self.targets = targets
+
+    def target(self, name):
+        for target in self.targets:
+            if target.target == name:
+                return target
+        return None
+
+class RemoteCommands:
+    """getRemoteControllerInfo: the bundled/type info and the list of {name, value} commands."""
+
+    __slots__ = ("info", "commands")
+
+    def __init__(self, info, commands):
+        self.info = info
+        self.commands = commands
+
+class SystemInfo:
+    __slots__ = ("product", "model", "name", "generation", "serial", "macAddr", "region", "area", "language", "cid")
+
+    def __init__(self, data):
+        self.product = data.get("product")
+        self.model = data.get("model")
+        self.name = data.get("name")
+        self.generation = data.get("generation")
+        self.serial = data.get("serial")
+        self.macAddr = data.get("macAddr")
+        self.region = data.get("region")
+        self.area = data.get("area")
+        self.language = data.get("language")
+        self.cid = data.get("cid")
+
+def _first(result):
+    if not result or not isinstance(result[0], dict):
+        raise ValueError("Unexpected result: " + str(result)[:80])
+    return result[0]
+
+def decode_power_status(result):
+    return PowerStatus(_first(result).get("status"))
+
+def decode_playing_content(result):
+    data = _first(result)
+    get = data.get
+    return PlayingContent(get("uri"), get("source"), get("title"), get("programTitle"), get("programMediaType"),
+                          get("dispNum"), get("startDateTime"), get("durationSec"))
+
+def decode_volume_info(result):
+    if not result or not isinstance(result[0], list):
+        raise ValueError("Unexpected result: " + str(result)[:80])
+    return VolumeInfo(tuple(VolumeTarget(data.get("target"), data.get("volume"), data.get("mute"),
+                                         data.get("minVolume"), data.get("maxVolume"))
+                            for data in result[0] if isinstance(data, dict)))
+
+def decode_remote_commands(result):
+    if not result or len(result) < 2 or not isinstance(result[1], list):
+        raise ValueError("Unexpected result: " + str(result)[:80])
+    return RemoteCommands(result[0], result[1])
+
+def decode_system_info(result):
+    return SystemInfo(_first(result))
+
+# Decoder per JSON-RPC method, the callback of a request gets the record instead of the result list
+DECODERS = {
+    "getPowerStatus": decode_power_status,
+    "getPlayingContentInfo": decode_playing_content,
+    "getVolumeInformation": decode_volume_info,
+    "getRemoteControllerInfo": decode_remote_commands,
+    "getSystemInformation": decode_system_info,
+}
+
+def decode(method, result):
+    """Record of a result, the result itself for methods without decoder. Raises ValueError on a malformed result."""
+    decoder = DECODERS.get(method)
+    if decoder is None or result is None:
+        return result
+    return decoder(result)
@@ -0,0 +1,119 @@
+"""Sony Bravia Simple IP Control frames, shared by the plugin and the simulator.
+
+Pro Bravia models listen on TCP port 20060 and exchange fixed 24 byte frames:
+
+    *S  type  function  parameter         LF
+    2   1     4         16                1
+
+Types are C (control), E (enquiry), A (answer) and N (notify). The TV sends
+notify frames by itself when power, input, volume, mute or channel change.
+No Domoticz dependency.
+"""
+
+PORT = 20060
+FRAME_SIZE = 24
+HEADER = b"*S"
+
+CONTROL = "C"
+ENQUIRY = "E"
+ANSWER = "A"
+NOTIFY = "N"
+
+# Parameter of an enquiry and of a control without argument
+EMPTY = "#" * 16
+# Answer parameters
+SUCCESS = "0" * 16
+FAILURE = "F" * 16
+NOT_FOUND = "N" * 16
+
+POWER = "POWR"
+INPUT = "INPT"
+VOLUME = "VOLU"
+MUTE = "AMUT"
+CHANNEL = "CHNN"
+IRCC = "IRCC"
+TOGGLE_POWER = "TPOW"
+
+# Input kinds of an INPT parameter: 8 digits kind followed by 8 digits port
+INPUT_TV = 0
+INPUT_KINDS = {1: "hdmi", 2: "scart", 3: "composite", 4: "component", 5: "widi", 6: "pc"}
+
+# IRCC function codes of Simple IP Control, by the Sony command names of getRemoteControllerInfo
+IRCC_CODES = {
+    "PowerOff": 0, "Input": 1, "GGuide": 2, "EPG": 3, "Favorites": 4, "Display": 5, "Home": 6, "Options": 7,
+    "Return": 8, "Up": 9, "Down": 10, "Right": 11, "Left": 12, "Confirm": 13, "Red": 14, "Green": 15,
+    "Yellow": 16, "Blue": 17, "Num1": 18, "Num2": 19, "Num3": 20, "Num4": 21, "Num5": 22, "Num6": 23,
+    "Num7": 24, "Num8": 25, "Num9": 26, "Num0": 27, "VolumeUp": 30, "VolumeDown": 31, "Mute": 32,
+    "ChannelUp": 33, "ChannelDown": 34, "SubTitle": 35, "ClosedCaption": 36, "Enter": 37, "DOT": 38,
+    "Teletext": 40, "Exit": 41, "PicOff": 49, "Netflix": 55, "Audio": 59, "Wide": 60, "Jump": 61,
+    "TvPause": 72, "Forward": 76, "Play": 77, "Rewind": 78, "Prev": 79, "Stop": 80, "Next": 81,
+    "Rec": 82, "Pause": 83,
+}
+
+def command_frame(name):
+    """(function, parameter) that performs a remote command, None when Simple IP Control has no equivalent."""
+    if name == "TvPower":
+        return TOGGLE_POWER, EMPTY
+    if name == "Tv":
+        return INPUT, encode_input(INPUT_TV, 0)
+    if name.startswith("Hdmi") and name[4:].isdigit():
+        return INPUT, encode_input(1, int(name[4:]))
+    if name in IRCC_CODES:
+        return IRCC, encode_number(IRCC_CODES[name])
+    return None
+
+def encode_frame(kind, function, parameter=EMPTY):
+    """One 24 byte frame, the parameter is padded with '#' to 16 characters."""
+    parameter = str(parameter)
+    if len(function) != 4 or len(parameter) > 16:
+        raise ValueError("Invalid Simple IP frame: " + function + " " + parameter)
+    return HEADER + (kind + function + parameter.ljust(16, "#")).encode("ascii") + b"\n"
+
+def encode_number(value):
+    """Numeric parameter, zero padded to 16 digits."""
+    return "%016d" % int(value)
+
+def decode_number(parameter):
+    return int(parameter.rstrip("#") or "0")
+
+def encode_input(kind, port):
+    return "%08d%08d" % (kind, port)
+
+def input_uri(parameter):
+    """avContent uri of an INPT parameter, None for the tuner or an unknown input."""
+    kind, port = int(parameter[:8]), int(parameter[8:])
+    if kind in INPUT_KINDS:
+        return "extInput:" + INPUT_KINDS[kind] + "?port=" + str(port)
+    return None
+
+def decode_channel(parameter):
+    """Channel number of a CHNN parameter ('00000000012.0000' or '0000000000000012')."""
+    return int(parameter.rstrip("#").split(".")[0] or "0")
+
+class FrameReader:
+    """Splits a TCP byte stream into frames, garbage before a '*S' header is skipped."""
+
+    def __init__(self):
+        self._buffer = b""
+
+    def feed(self, data):
+        """Add received bytes, returns the complete frames as (type, function, parameter) tuples."""
+        self._buffer += data
+        frames = []
+        while True:
+            start = self._buffer.find(HEADER)
+            if start < 0:
+                # Keep a trailing '*' that may be the start of the next header
+                self._buffer = self._buffer[-1:] if self._buffer.endswith(b"*") else b""
+                return frames
+            if len(self._buffer) - start < FRAME_SIZE:
+                self._buffer = self._buffer[start:]
+                return frames
+            frame = self._buffer[start:start + FRAME_SIZE]
+            if frame[-1:] != b"\n":
+                # Not a frame boundary, look for the next header
+                self._buffer = self._buffer[start + 2:]
+                continue
+            self._buffer = self._buffer[start + FRAME_SIZE:]
+            text = frame[2:-1].decode("ascii", "replace")
+            frames.append((text[0], text[1:5], text[5:]))
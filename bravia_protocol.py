@@ -0,0 +1,170 @@
+"""Sony Bravia IP control protocol: request bodies and command tables.
+
+Plain Python without Domoticz, shared by the plugin (bravia.py) and the asyncio client (bravia_async.py)."""
+
+import json
+
+IRCC_SOAPACTION = '"urn:schemas-sony-com:service:IRCC:1#X_SendIRCC"'
+
+# IRCC codes used when the TV does not answer getRemoteControllerInfo, keyed on the Sony command name
+FALLBACK_COMMANDS = {
+    "Num1": "AAAAAQAAAAEAAAAAAw==",
+    "Num2": "AAAAAQAAAAEAAAABAw==",
+    "Num3": "AAAAAQAAAAEAAAACAw==",
+    "Num4": "AAAAAQAAAAEAAAADAw==",
+    "Num5": "AAAAAQAAAAEAAAAEAw==",
+    "Num6": "AAAAAQAAAAEAAAAFAw==",
+    "Num7": "AAAAAQAAAAEAAAAGAw==",
+    "Num8": "AAAAAQAAAAEAAAAHAw==",
+    "Num9": "AAAAAQAAAAEAAAAIAw==",
+    "Num0": "AAAAAQAAAAEAAAAJAw==",
+    "ChannelUp": "AAAAAQAAAAEAAAAQAw==",
+    "ChannelDown": "AAAAAQAAAAEAAAARAw==",
+    "VolumeUp": "AAAAAQAAAAEAAAASAw==",
+    "VolumeDown": "AAAAAQAAAAEAAAATAw==",
+    "Mute": "AAAAAQAAAAEAAAAUAw==",
+    "TvPower": "AAAAAQAAAAEAAAAVAw==",
+    "Tv": "AAAAAQAAAAEAAAAkAw==",
+    "Input": "AAAAAQAAAAEAAAAlAw==",
+    "PowerOff": "AAAAAQAAAAEAAAAvAw==",
+    "Right": "AAAAAQAAAAEAAAAzAw==",
+    "Left": "AAAAAQAAAAEAAAA0Aw==",
+    "Display": "AAAAAQAAAAEAAAA6Aw==",
+    "Home": "AAAAAQAAAAEAAABgAw==",
+    "Exit": "AAAAAQAAAAEAAABjAw==",
+    "Confirm": "AAAAAQAAAAEAAABlAw==",
+    "Up": "AAAAAQAAAAEAAAB0Aw==",
+    "Down": "AAAAAQAAAAEAAAB1Aw==",
+    "Hdmi1": "AAAAAgAAABoAAABaAw==",
+    "Hdmi2": "AAAAAgAAABoAAABbAw==",
+    "Hdmi3": "AAAAAgAAABoAAABcAw==",
+    "Hdmi4": "AAAAAgAAABoAAABdAw==",
+    "TvPause": "AAAAAgAAABoAAABnAw==",
+    "Netflix": "AAAAAgAAABoAAAB8Aw==",
+    "Stop": "AAAAAgAAAJcAAAAYAw==",
+    "Pause": "AAAAAgAAAJcAAAAZAw==",
+    "Play": "AAAAAgAAAJcAAAAaAw==",
+    "Rewind": "AAAAAgAAAJcAAAAbAw==",
+    "Forward": "AAAAAgAAAJcAAAAcAw==",
+    "Return": "AAAAAgAAAJcAAAAjAw==",
+    "Options": "AAAAAgAAAJcAAAA2Aw==",
+    "Prev": "AAAAAgAAAJcAAAA8Aw==",
+    "Next": "AAAAAgAAAJcAAAA9Aw==",
+    "EPG": "AAAAAgAAAKQAAABbAw==",
+}
+
+class BraviaError(Exception):
+    """JSON-RPC error returned by the TV, code and message as sent in the 'error' member."""
+
+    def __init__(self, code, message):
+        Exception.__init__(self, "Error code " + str(code) + ": " + str(message))
+        self.code = code
+        self.message = message
+
+def jdata_build(method, params, request_id=1):
+    """JSON-RPC body for a call, params is a single dict or None."""
+    if params:
+        return json.dumps({"method": method, "params": [params], "id": request_id, "version": "1.0"})
+    return json.dumps({"method": method, "params": [], "id": request_id, "version": "1.0"})
+
+def ircc_envelope(code):
+    """SOAP body of an IRCC key press."""
+    return ("<?xml version=\"1.0\"?><s:Envelope xmlns:s=\"http://schemas.xmlsoap.org" +
+        "/soap/envelope/\" " +
+        "s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\"><s:Body>" +
+        "<u:X_SendIRCC " +
+        "xmlns:u=\"urn:schemas-sony-com:service:IRCC:1\"><IRCCCode>" +
+        code+"</IRCCCode></u:X_SendIRCC></s:Body></s:Envelope>")
+
+def json_headers(host, psk):
+    return { 'X-Auth-PSK': psk, 'Host': host, 'Connection': 'keep-alive', 'Content-Type': 'application/x-www-form-urlencoded' }
+
+def ircc_headers(host, psk):
+    return { 'X-Auth-PSK': psk, 'Soapaction': IRCC_SOAPACTION, \
+             'Host': host, 'Connection': 'keep-alive', 'Content-Type': 'application/x-www-form-urlencoded' }
+
+class RequestCache:
+    """Pre-encoded request headers and bodies for one TV.
+
+    IRCC envelopes are built once per code. JSON-RPC bodies are split into
+    constant parts once per method (and parameter names), at send time only the
+    parameter values and the request id are filled in."""
+
+    def __init__(self, host, psk):
+        self.json_headers = json_headers(host, psk)
+        self.ircc_headers = ircc_headers(host, psk)
+        self._ircc = {}
+        self._json = {}
+        self.prime_ircc(FALLBACK_COMMANDS.values())
+
+    def prime_ircc(self, codes):
+        for code in codes:
+            if code not in self._ircc:
+                self._ircc[code] = ircc_envelope(code)
+
+    def ircc(self, code):
+        envelope = self._ircc.get(code)
+        if envelope is None:
+            envelope = self._ircc[code] = ircc_envelope(code)
+        return envelope
+
+    def json(self, method, params, request_id):
+        """Same body as jdata_build, from the cached template of the method."""
+        if params:
+            keys = tuple(params)
+            template = self._json.get((method, keys))
+            if template is None:
+                template = self._json[(method, keys)] = _json_template(method, keys)
+            parts = [template[0]]
+            for index, key in enumerate(keys):
+                parts.append(json.dumps(params[key]))
+                parts.append(template[index + 1])
+            parts.append(str(request_id))
+            parts.append(template[-1])
+            return "".join(parts)
+        template = self._json.get(method)
+        if template is None:
+            template = self._json[method] = _json_template(method, ())
+        return template[0] + str(request_id) + template[1]
+
+def _json_template(method, keys):
+    """Constant parts of a JSON-RPC body, the values of keys and the id go in between."""
+    marker = "\u0000%d\u0000"
+    params = dict((key, marker % index) for index, key in enumerate(keys))
+    body = jdata_build(method, params or None, marker % len(keys))
+    parts = []
+    for index in range(len(keys) + 1):
+        head, sep, body = body.partition(json.dumps(marker % index))
+        parts.append(head)
+    parts.append(body)
+    return parts
+
+def build_command_index(commands):
+    """Name to IRCC code dict from the command list of a getRemoteControllerInfo reply."""
+    index = {}
+    for command_data in commands:
+        name = command_data.get('name')
+        value = command_data.get('value')
+        if name and value:
+            index[name] = value
+    return index
+
+def lookup_command(index, command_name):
+    """Code reported by the TV for this command, or the hardcoded code for models that don't answer."""
+    code = index.get(command_name)
+    if code is None:
+        code = FALLBACK_COMMANDS.get(command_name)
+    return code
+
+def magic_packet(mac):
+    """Wake-on-LAN magic packet for a MAC address (':' or '-' separated or plain hex), None when it isn't one."""
+    if not mac:
+        return None
+    digits = mac.replace(":", "").replace("-", "").replace(".", "")
+    if len(digits) != 12:
+        return None
+    try:
+        address = bytes.fromhex(digits)
+    except ValueError:
+        return None
+    return b"\xff" * 6 + address * 16
@@ -0,0 +1,550 @@
+"""Simulated Sony Bravia TVs for load and latency testing without a physical TV.
+
+Implements the endpoints bravia.py uses (sony/system, sony/avContent, sony/audio,
+sony/appControl and sony/IRCC) on a local HTTP/1.1 keep-alive server, checks the X-Auth-PSK
+header and keeps power, input, volume and programme state. Optionally a Simple IP
+Control server pushes notify frames for power, input, volume, mute and channel. Latency, dropped
+connections, 'Connection: close' replies and error replies can be injected.
+Any number of TVs run on one asyncio loop:
+
+    python bravia_sim.py --count 20 --port 8080 --latency 0.05 --drop 0.01
+    python bravia_sim.py --port 8080 --ip-offset 1000   # Simple IP Control on 9080
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+
+from datetime import datetime
+
+import bravia_ip
+from bravia_protocol import FALLBACK_COMMANDS
+
+JSON_TYPE = "application/json"
+XML_TYPE = 'text/xml; charset="utf-8"'
+
+IRCC_REPLY = ('<?xml version="1.0"?><s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+              's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>'
+              '<u:X_SendIRCCResponse xmlns:u="urn:schemas-sony-com:service:IRCC:1"></u:X_SendIRCCResponse>'
+              '</s:Body></s:Envelope>')
+IRCC_FAULT = ('<?xml version="1.0"?><s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+              's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><s:Fault>'
+              '<faultcode>s:Client</faultcode><faultstring>UPnPError</faultstring><detail>'
+              '<UPnPError xmlns="urn:schemas-upnp-org:control-1-0"><errorCode>800</errorCode></UPnPError>'
+              '</detail></s:Fault></s:Body></s:Envelope>')
+
+# Sony JSON-RPC error codes the simulator answers with
+ERROR_ILLEGAL_ARGUMENT = [3, "Illegal Argument"]
+ERROR_ILLEGAL_STATE = [7, "Illegal State"]
+ERROR_NO_SUCH_METHOD = [12, "No Such Method"]
+ERROR_FORBIDDEN = [403, "Forbidden"]
+ERROR_DISPLAY_OFF = [40005, "Display Is Turned off"]
+
+CHANNEL_NAMES = ["NPO 1", "NPO 2", "NPO 3", "RTL 4", "RTL 5", "SBS 6", "RTL 7", "Veronica", "Net 5",
+                 "RTL 8", "BBC One", "BBC Two", "Das Erste", "ZDF", "Eurosport", "Discovery"]
+PROGRAMME_NAMES = ["News", "Weather", "Documentary", "Quiz", "Movie", "Series", "Sports", "Talk show"]
+HDMI_PORTS = 4
+APP_NAMES = ["Netflix", "YouTube", "Prime Video", "Spotify", "Kodi"]
+# Length of a simulated programme
+PROGRAMME_LENGTH = 1800
+
+class Faults:
+    """Fault injection settings of a simulated TV, rates are probabilities per request."""
+
+    def __init__(self, latency=0.0, jitter=0.0, drop_rate=0.0, close_rate=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.close_rate = close_rate
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+
+    def delay(self):
+        if self.latency <= 0 and self.jitter <= 0:
+            return 0
+        return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+    def hit(self, rate):
+        return rate > 0 and self.rng.random() < rate
+
+class SimulatedTV:
+    """One simulated TV listening on host:port."""
+
+    def __init__(self, host="127.0.0.1", port=0, psk="sony", faults=None, boot_time=0.0, name=None, ip_port=None):
+        self.host = host
+        self.port = port
+        self.ip_port = ip_port      # Simple IP Control port, None disables it
+        self.psk = psk
+        self.faults = faults or Faults()
+        self.boot_time = boot_time
+        self.name = name or "BRAVIA-SIM"
+        self.power = "active"
+        self.booting_until = 0
+        self.volume = {"speaker": 20, "headphone": 15}
+        self.muted = False
+        self.channels = [{"title": title, "dispNum": "%03d" % (index + 1),
+                          "uri": "tv:dvbt?trip=8916.%d.%d&srvName=%s" % (index + 1, 1000 + index, title.replace(" ", "%20"))}
+                         for index, title in enumerate(CHANNEL_NAMES)]
+        self.inputs = [{"title": "HDMI %d" % port, "uri": "extInput:hdmi?port=%d" % port} for port in range(1, HDMI_PORTS + 1)]
+        self.apps = [{"title": title, "uri": "com.sony.dtv.%s.MainActivity" % title.lower().replace(" ", ""),
+                      "icon": "http://%s/DIAL/icon/%s.png" % (host, title.lower().replace(" ", ""))}
+                     for title in APP_NAMES]
+        self.channel = 0
+        self.input = None           # None while the tuner is shown, else the index of the HDMI input
+        self.app = None             # index of the application in front of the tuner or input
+        self.requests = {}
+        self.connections = 0
+        self._server = None
+        self._writers = set()
+        self._ip_server = None
+        self._ip_writers = set()
+        self._published = None
+
+    # Server lifecycle
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.ip_port is not None:
+            await self.start_ip(self.ip_port)
+        return self
+
+    async def start_ip(self, port=bravia_ip.PORT):
+        """Start the Simple IP Control server, port 0 picks a free port."""
+        self._ip_server = await asyncio.start_server(self._serve_ip, self.host, port)
+        self.ip_port = self._ip_server.sockets[0].getsockname()[1]
+        self._published = self._ip_state()
+        return self
+
+    async def stop(self):
+        for server, writers in ((self._server, self._writers), (self._ip_server, self._ip_writers)):
+            if server is not None:
+                server.close()
+                for writer in list(writers):
+                    writer.close()
+                await server.wait_closed()
+        self._server = None
+        self._ip_server = None
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                url, headers, body = request
+                delay = self.faults.delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                if self.faults.hit(self.faults.drop_rate):
+                    break
+                status, content_type, data = self.handle(url, headers, body)
+                close = self.faults.hit(self.faults.close_rate) or headers.get("connection", "").lower() == "close"
+                writer.write(self._response(status, content_type, data, close))
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Server shutting down while the client keeps the connection open
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        parts = request_line.decode("latin-1").split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, sep, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        return parts[1], headers, body
+
+    def _response(self, status, content_type, data, close):
+        reasons = {200: "OK", 403: "Forbidden", 404: "Not Found", 500: "Internal Server Error"}
+        head = ("HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n"
+                % (status, reasons.get(status, "Error"), content_type, len(data), "close" if close else "keep-alive"))
+        return head.encode("latin-1") + data
+
+    # Simple IP Control
+
+    async def _serve_ip(self, reader, writer):
+        self._ip_writers.add(writer)
+        frames = bravia_ip.FrameReader()
+        try:
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    break
+                for kind, function, parameter in frames.feed(data):
+                    self._count("ip:" + kind + function)
+                    writer.write(self._ip_request(kind, function, parameter))
+                    self.publish()
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._ip_writers.discard(writer)
+            writer.close()
+
+    def _ip_request(self, kind, function, parameter):
+        """Answer a control or enquiry frame."""
+        self._settle()
+        state = self._ip_state()
+        if kind == bravia_ip.ENQUIRY and function in state:
+            return bravia_ip.encode_frame(bravia_ip.ANSWER, function, state[function])
+        if kind == bravia_ip.CONTROL:
+            try:
+                value = bravia_ip.decode_number(parameter) if function != bravia_ip.TOGGLE_POWER else 0
+            except ValueError:
+                return bravia_ip.encode_frame(bravia_ip.ANSWER, function, bravia_ip.FAILURE)
+            if function == bravia_ip.POWER:
+                self.set_power(value == 1)
+            elif function == bravia_ip.TOGGLE_POWER:
+                self.press("TvPower")
+            elif function == bravia_ip.IRCC and value in IP_COMMAND_NAMES:
+                self.press(IP_COMMAND_NAMES[value])
+            elif function == bravia_ip.INPUT and self.power == "active":
+                kind, port = int(parameter[:8]), int(parameter[8:])
+                if kind == bravia_ip.INPUT_TV:
+                    self.press("Tv")
+                elif kind == 1 and 1 <= port <= len(self.inputs):
+                    self.press("Hdmi" + str(port))
+                else:
+                    return bravia_ip.encode_frame(bravia_ip.ANSWER, function, bravia_ip.FAILURE)
+            elif function == bravia_ip.VOLUME and self.power == "active":
+                self.volume["speaker"] = max(0, min(100, value))
+            elif function == bravia_ip.MUTE and self.power == "active":
+                self.muted = value == 1
+            else:
+                return bravia_ip.encode_frame(bravia_ip.ANSWER, function, bravia_ip.FAILURE)
+            return bravia_ip.encode_frame(bravia_ip.ANSWER, function, bravia_ip.SUCCESS)
+        return bravia_ip.encode_frame(bravia_ip.ANSWER, function, bravia_ip.NOT_FOUND)
+
+    def _ip_state(self):
+        if self.input is None:
+            source = bravia_ip.encode_input(bravia_ip.INPUT_TV, 0)
+        else:
+            source = bravia_ip.encode_input(1, self.input + 1)
+        return {bravia_ip.POWER: bravia_ip.encode_number(1 if self.power == "active" else 0),
+                bravia_ip.INPUT: source,
+                bravia_ip.VOLUME: bravia_ip.encode_number(self.volume["speaker"]),
+                bravia_ip.MUTE: bravia_ip.encode_number(1 if self.muted else 0),
+                bravia_ip.CHANNEL: "%011d.0000" % int(self.channels[self.channel]["dispNum"])}
+
+    def publish(self):
+        """Send notify frames for everything that changed since the last call, call it after changing state directly."""
+        if self._ip_server is None:
+            return
+        state = self._ip_state()
+        for function, parameter in state.items():
+            if self._published.get(function) != parameter:
+                frame = bravia_ip.encode_frame(bravia_ip.NOTIFY, function, parameter)
+                for writer in list(self._ip_writers):
+                    writer.write(frame)
+        self._published = state
+
+    # Request handling, also usable without a socket
+
+    def handle(self, url, headers, body):
+        """Answer one request, returns (status, content type, body bytes)."""
+        reply = self._handle(url, headers, body)
+        self.publish()
+        return reply
+
+    def _handle(self, url, headers, body):
+        if headers.get("x-auth-psk") != self.psk:
+            return 403, JSON_TYPE, json.dumps({"error": ERROR_FORBIDDEN, "id": None}).encode()
+        self._settle()
+        if url == "/sony/IRCC":
+            self._count("X_SendIRCC")
+            return self._ircc(body.decode("utf-8", "ignore"))
+        try:
+            req = json.loads(body.decode("utf-8", "ignore"))
+        except ValueError:
+            return 500, JSON_TYPE, json.dumps({"error": ERROR_ILLEGAL_ARGUMENT, "id": None}).encode()
+        method = req.get("method")
+        self._count(method)
+        params = req.get("params") or [{}]
+        if self.faults.hit(self.faults.error_rate):
+            return 200, JSON_TYPE, json.dumps({"error": [500, "Internal Server Error"], "id": req.get("id")}).encode()
+        handler = getattr(self, "_" + url.rsplit("/", 1)[-1] + "_" + str(method), None)
+        if handler is None:
+            return 200, JSON_TYPE, json.dumps({"error": ERROR_NO_SUCH_METHOD, "id": req.get("id")}).encode()
+        result, error = handler(params[0] if params else {})
+        if error is not None:
+            return 200, JSON_TYPE, json.dumps({"error": error, "id": req.get("id")}).encode()
+        return 200, JSON_TYPE, json.dumps({"result": result, "id": req.get("id")}).encode()
+
+    def _count(self, method):
+        self.requests[method] = self.requests.get(method, 0) + 1
+
+    def _booted(self):
+        self._settle()
+        self.publish()
+
+    def _settle(self):
+        if self.booting_until and time.time() >= self.booting_until:
+            self.booting_until = 0
+            self.power = "active"
+
+    def set_power(self, on):
+        if on and self.power != "active":
+            if self.boot_time > 0:
+                self.booting_until = time.time() + self.boot_time
+                if self._ip_server is not None:
+                    # Notify the end of the boot without waiting for a request
+                    self._ip_server.get_loop().call_later(self.boot_time, self._booted)
+            else:
+                self.power = "active"
+        elif not on:
+            self.power = "standby"
+            self.booting_until = 0
+            self.app = None
+
+    # sony/system
+
+    def _system_getPowerStatus(self, params):
+        return [{"status": self.power}], None
+
+    def _system_setPowerStatus(self, params):
+        self.set_power(params.get("status") in (True, "true", "True"))
+        return [], None
+
+    def _system_getSystemInformation(self, params):
+        return [{"product": "TV", "region": "EU", "language": "dut", "model": "KD-55XF9005", "serial": "1234567",
+                 "macAddr": "fc:f1:52:00:00:%02x" % (self.port % 256), "name": self.name, "generation": "5.0.1",
+                 "area": "NLD", "cid": "0"}], None
+
+    def _system_getRemoteControllerInfo(self, params):
+        return [{"bundled": True, "type": "IR_REMOTE_BUNDLE_TYPE_AEP_N"},
+                [{"name": name, "value": value} for name, value in FALLBACK_COMMANDS.items()]], None
+
+    def _system_getNetworkSettings(self, params):
+        return [[{"netif": "eth0", "hwAddr": "fc:f1:52:00:00:%02x" % (self.port % 256), "ipAddrV4": self.host,
+                  "gateway": "192.168.1.1"}]], None
+
+    # sony/avContent
+
+    def _avContent_getPlayingContentInfo(self, params):
+        if self.power != "active":
+            return None, ERROR_DISPLAY_OFF
+        if self.app is not None:
+            # Android TVs have no content information while an app is shown
+            return None, ERROR_ILLEGAL_STATE
+        if self.input is not None:
+            hdmi = self.inputs[self.input]
+            return [{"source": "extInput:hdmi", "title": hdmi["title"], "uri": hdmi["uri"]}], None
+        channel = self.channels[self.channel]
+        now = time.time()
+        start = now - now % PROGRAMME_LENGTH
+        programme = PROGRAMME_NAMES[(int(start / PROGRAMME_LENGTH) + self.channel) % len(PROGRAMME_NAMES)]
+        return [{"source": "tv:dvbt", "dispNum": channel["dispNum"], "programMediaType": "tv",
+                 "title": channel["title"], "programTitle": programme, "uri": channel["uri"],
+                 "startDateTime": datetime.fromtimestamp(start).astimezone().strftime("%Y-%m-%dT%H:%M:%S%z"),
+                 "durationSec": PROGRAMME_LENGTH, "tripletStr": "8916.%d.0" % (self.channel + 1)}], None
+
+    def _avContent_setPlayContent(self, params):
+        uri = params.get("uri")
+        for index, channel in enumerate(self.channels):
+            if channel["uri"] == uri:
+                self.channel, self.input, self.app = index, None, None
+                return [], None
+        for index, hdmi in enumerate(self.inputs):
+            if hdmi["uri"] == uri:
+                self.input, self.app = index, None
+                return [], None
+        return None, ERROR_ILLEGAL_ARGUMENT
+
+    def _avContent_getSourceList(self, params):
+        if params.get("scheme") == "tv":
+            return [[{"source": "tv:dvbt"}]], None
+        if params.get("scheme") == "extInput":
+            return [[{"source": "extInput:hdmi"}]], None
+        return None, ERROR_ILLEGAL_ARGUMENT
+
+    def _avContent_getContentList(self, params):
+        source = params.get("source", "")
+        if source.startswith("tv:"):
+            items = self.channels
+        elif source.startswith("extInput:hdmi"):
+            items = self.inputs
+        else:
+            return None, ERROR_ILLEGAL_ARGUMENT
+        start = int(params.get("stIdx", 0))
+        count = min(int(params.get("cnt", 50)), 200)
+        page = [dict(item, index=start + offset) for offset, item in enumerate(items[start:start + count])]
+        return [page], None
+
+    # sony/appControl
+
+    def _appControl_getApplicationList(self, params):
+        return [list(self.apps)], None
+
+    def _appControl_setActiveApp(self, params):
+        for index, app in enumerate(self.apps):
+            if app["uri"] == params.get("uri"):
+                if self.power != "active":
+                    return None, ERROR_ILLEGAL_STATE
+                self.app = index
+                return [], None
+        return None, ERROR_ILLEGAL_ARGUMENT
+
+    # sony/audio
+
+    def _audio_getVolumeInformation(self, params):
+        return [[{"target": target, "volume": volume, "mute": self.muted, "maxVolume": 100, "minVolume": 0}
+                 for target, volume in self.volume.items()]], None
+
+    def _audio_setAudioVolume(self, params):
+        target = params.get("target") or "speaker"
+        value = str(params.get("volume", ""))
+        if target not in self.volume or not value:
+            return None, ERROR_ILLEGAL_ARGUMENT
+        try:
+            if value[0] in "+-":
+                level = self.volume[target] + int(value)
+            else:
+                level = int(value)
+        except ValueError:
+            return None, ERROR_ILLEGAL_ARGUMENT
+        self.volume[target] = max(0, min(100, level))
+        return [], None
+
+    def _audio_setAudioMute(self, params):
+        self.muted = bool(params.get("status"))
+        return [], None
+
+    # sony/IRCC
+
+    def _ircc(self, body):
+        start = body.find("<IRCCCode>")
+        end = body.find("</IRCCCode>")
+        code = body[start + 10:end] if start >= 0 and end > start else ""
+        name = COMMAND_NAMES.get(code)
+        if name is None:
+            return 500, XML_TYPE, IRCC_FAULT.encode()
+        self.press(name)
+        return 200, XML_TYPE, IRCC_REPLY.encode()
+
+    def press(self, name):
+        """Apply the effect of a remote key."""
+        if name == "TvPower":
+            self.set_power(self.power != "active")
+        elif name == "PowerOff":
+            self.set_power(False)
+        elif self.power != "active":
+            return
+        elif name == "VolumeUp":
+            self.volume["speaker"] = min(100, self.volume["speaker"] + 1)
+        elif name == "VolumeDown":
+            self.volume["speaker"] = max(0, self.volume["speaker"] - 1)
+        elif name == "Mute":
+            self.muted = not self.muted
+        elif name == "Netflix":
+            self.app = APP_NAMES.index("Netflix")
+        elif name in ("Home", "Exit", "Return"):
+            self.app = None
+        elif name in ("ChannelUp", "ChannelDown"):
+            self.input, self.app = None, None
+            self.channel = (self.channel + (1 if name == "ChannelUp" else -1)) % len(self.channels)
+        elif name == "Tv":
+            self.input, self.app = None, None
+        elif name.startswith("Hdmi"):
+            self.input, self.app = int(name[4:]) - 1, None
+        elif name.startswith("Num") and name[3:].isdigit():
+            number = int(name[3:]) or 10
+            if number <= len(self.channels):
+                self.channel, self.input, self.app = number - 1, None, None
+
+COMMAND_NAMES = dict((code, name) for name, code in FALLBACK_COMMANDS.items())
+IP_COMMAND_NAMES = dict((code, name) for name, code in bravia_ip.IRCC_CODES.items())
+
+async def start_fleet(count, host="127.0.0.1", port=0, ip_offset=None, **kwargs):
+    """Start count simulated TVs on consecutive ports (or free ports when port is 0).
+    With ip_offset every TV also serves Simple IP Control on its HTTP port + ip_offset."""
+    tvs = []
+    for index in range(count):
+        tv = SimulatedTV(host, port + index if port else 0, name="BRAVIA-SIM-%d" % (index + 1), **kwargs)
+        tvs.append(await tv.start())
+        if ip_offset is not None:
+            await tv.start_ip(tv.port + ip_offset)
+    return tvs
+
+class SimulatorThread:
+    """Runs simulated TVs on their own event loop in a background thread, for synchronous callers."""
+
+    def __init__(self, count=1, host="127.0.0.1", port=0, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self.tvs = []
+        self._args = (count, host, port)
+        self._kwargs = kwargs
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self.tvs = asyncio.run_coroutine_threadsafe(start_fleet(*self._args, **self._kwargs), self.loop).result()
+        return self
+
+    def call(self, function, *args):
+        """Run a function on the simulator loop, use it to change TV state from another thread."""
+        async def run():
+            return function(*args)
+        return asyncio.run_coroutine_threadsafe(run(), self.loop).result()
+
+    def stop(self):
+        async def stop_all():
+            for tv in self.tvs:
+                await tv.stop()
+        asyncio.run_coroutine_threadsafe(stop_all(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Sony Bravia TVs")
+    parser.add_argument("--count", type=int, default=1, help="number of TVs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="port of the first TV, the others follow")
+    parser.add_argument("--psk", default="sony")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every reply")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random spread on the latency")
+    parser.add_argument("--drop", type=float, default=0.0, help="probability to drop the connection")
+    parser.add_argument("--close", type=float, default=0.0, help="probability of a Connection: close reply")
+    parser.add_argument("--error", type=float, default=0.0, help="probability of a JSON-RPC error reply")
+    parser.add_argument("--boot-time", type=float, default=0.0, help="seconds from power on to active")
+    parser.add_argument("--ip-offset", type=int, help="serve Simple IP Control on the HTTP port + this offset")
+    args = parser.parse_args()
+
+    async def run():
+        tvs = []
+        for index in range(args.count):
+            faults = Faults(args.latency, args.jitter, args.drop, args.close, args.error)
+            tv = SimulatedTV(args.host, args.port + index, args.psk, faults, args.boot_time, "BRAVIA-SIM-%d" % (index + 1))
+            tvs.append(await tv.start())
+            if args.ip_offset is not None:
+                await tv.start_ip(tv.port + args.ip_offset)
+        print("Simulating %d TV(s) on %s:%d-%d" % (args.count, args.host, args.port, args.port + args.count - 1))
+        if args.ip_offset is not None:
+            print("Simple IP Control on %s:%d-%d" % (args.host, args.port + args.ip_offset, args.port + args.ip_offset + args.count - 1))
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
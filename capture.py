@@ -0,0 +1,109 @@
+"""Capture of the traffic between the plugin and its TVs, read back by replay.py.
+
+A capture is an append-only file of records, each a 4 byte big-endian length
+followed by a compact UTF-8 JSON object with the time "t" and the kind "k":
+
+    start       the hardware parameters (pre-shared keys left out) and the seed of the jitter
+    sent        an HTTP request of BraviaRC or a Simple IP frame, without headers
+    connect     onConnect with its status, disconnect onDisconnect
+    message     onMessage: HTTP status, headers and body, or the raw bytes of a Simple IP connection
+    command     onCommand, heartbeat onHeartbeat, stop onStop
+
+Bodies are kept as text when they are UTF-8, base64 otherwise. A file name
+ending in .gz is gzip compressed. No Domoticz dependency.
+"""
+
+import base64
+import gzip
+import json
+import struct
+import time
+
+FORMAT_VERSION = 1
+LENGTH = struct.Struct(">I")
+
+# Parameters not written to a capture
+SECRET_PARAMETERS = ("Mode1", "Password")
+
+def encode_data(data):
+    if isinstance(data, str):
+        return {"text": data}
+    data = bytes(data)
+    try:
+        return {"text": data.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"b64": base64.b64encode(data).decode("ascii")}
+
+def decode_data(record):
+    if "b64" in record:
+        return base64.b64decode(record["b64"])
+    return record.get("text", "").encode("utf-8")
+
+def open_capture(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+class CaptureWriter:
+    """Appends records to a capture file. Records are flushed on every heartbeat and when the capture is closed."""
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.records = 0
+        self._clock = clock
+        self._file = open_capture(path, "ab")
+
+    def write(self, kind, **fields):
+        fields["t"] = self._clock()
+        fields["k"] = kind
+        body = json.dumps(fields, separators=(",", ":")).encode("utf-8")
+        self._file.write(LENGTH.pack(len(body)) + body)
+        self.records += 1
+
+    def start(self, parameters, seed=None):
+        self.write("start", version=FORMAT_VERSION, seed=seed,
+                   parameters=dict((key, value) for key, value in parameters.items() if key not in SECRET_PARAMETERS))
+
+    def sent(self, connection, message):
+        # HTTP request dicts lose their headers, they carry the pre-shared key
+        if isinstance(message, dict):
+            self.write("sent", conn=connection, url=message.get("URL"), **encode_data(message.get("Data", "")))
+        else:
+            self.write("sent", conn=connection, **encode_data(message))
+
+    def connect(self, connection, status, description):
+        self.write("connect", conn=connection, status=status, description=description)
+
+    def disconnect(self, connection):
+        self.write("disconnect", conn=connection)
+
+    def message(self, connection, data):
+        if isinstance(data, dict):
+            self.write("message", conn=connection, status=str(data.get("Status")), headers=data.get("Headers", {}),
+                       **encode_data(data.get("Data", b"")))
+        else:
+            self.write("message", conn=connection, raw=True, **encode_data(data))
+
+    def command(self, unit, command, level, hue):
+        self.write("command", unit=unit, command=command, level=level, hue=str(hue))
+
+    def heartbeat(self):
+        self.write("heartbeat")
+        self._file.flush()
+
+    def close(self):
+        self.write("stop")
+        self._file.close()
+
+def read_records(path):
+    """Records of a capture in order, a record cut off by a crash ends the capture."""
+    with open_capture(path, "rb") as capture_file:
+        while True:
+            header = capture_file.read(LENGTH.size)
+            if len(header) < LENGTH.size:
+                return
+            size = LENGTH.unpack(header)[0]
+            body = capture_file.read(size)
+            if len(body) < size:
+                return
+            yield json.loads(body.decode("utf-8"))
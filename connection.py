@@ -0,0 +1,97 @@
+import random
+import time
+
+# Delay before the second connection attempt, doubled on every further attempt without a reply
+RECONNECT_BASE = 2
+# Consecutive attempts without a reply after which the circuit opens: the TV is taken to be unplugged
+BREAKER_ATTEMPTS = 5
+# Seconds between probes while the circuit is open
+PROBE_INTERVAL = 300
+# Requests in a row that time out without any reply before a connection counts as hung
+HUNG_TIMEOUTS = 2
+# Random spread on every delay (fraction), TVs behind one switch don't reconnect in lockstep
+JITTER = 0.2
+
+class ConnectionManager:
+    """Decides when to (re)connect to a TV and when an open connection is hung.
+
+    A connection attempt only counts as successful once the TV answered a request,
+    so a TV that accepts connections but never replies backs off like one that
+    refuses them. Attempts follow each other after RECONNECT_BASE, doubled per
+    attempt; after BREAKER_ATTEMPTS the circuit opens and the TV is only probed
+    with a single connect every PROBE_INTERVAL until it answers again. A clean
+    disconnect of a TV that was answering reconnects right away."""
+
+    def __init__(self, base=RECONNECT_BASE, breaker_attempts=BREAKER_ATTEMPTS, probe_interval=PROBE_INTERVAL,
+                 hung_timeouts=HUNG_TIMEOUTS, jitter=JITTER, rng=None):
+        self.base = base
+        self.breaker_attempts = breaker_attempts
+        self.probe_interval = probe_interval
+        self.hung_timeouts = hung_timeouts
+        self.jitter = jitter
+        self._rng = rng or random.Random()
+        self.attempts = 0           # connection attempts since the last reply
+        self.timeouts = 0           # request timeouts since the last reply
+        self.reachable = False      # the TV answered since the last failed attempt
+        self._last_attempt = 0
+        self._delay = 0
+
+    def _backoff(self):
+        if self.attempts == 0:
+            return 0
+        if self.circuit_open():
+            delay = self.probe_interval
+        else:
+            delay = min(self.probe_interval, self.base * 2 ** (self.attempts - 1))
+        return delay * (1 + self._rng.uniform(-self.jitter, self.jitter))
+
+    def circuit_open(self):
+        return self.attempts >= self.breaker_attempts
+
+    def due(self, now=None, max_delay=None):
+        """True when the next connection attempt may be made, max_delay caps the backoff (TV starting up)."""
+        if now is None:
+            now = time.time()
+        delay = self._delay if max_delay is None else min(self._delay, max_delay)
+        return now >= self._last_attempt + delay
+
+    def connecting(self, now=None):
+        """A connection attempt is made."""
+        self._last_attempt = time.time() if now is None else now
+        self.attempts += 1
+        self._delay = self._backoff()
+
+    def failed(self):
+        """The attempt failed. Returns True when the circuit opened with this failure."""
+        self.reachable = False
+        return self.attempts == self.breaker_attempts
+
+    def disconnected(self):
+        """The connection closed. A TV that was answering may be reconnected immediately."""
+        self.timeouts = 0
+        if self.reachable:
+            self.attempts = 0
+            self._delay = 0
+
+    def reply(self):
+        """The TV answered a request. Returns True when this closed an open circuit."""
+        reopened = self.circuit_open()
+        self.attempts = 0
+        self.timeouts = 0
+        self.reachable = True
+        self._delay = 0
+        return reopened
+
+    def timeout(self, count=1):
+        """Requests timed out, returns True when the connection should be dropped as hung."""
+        self.timeouts += count
+        if self.timeouts < self.hung_timeouts:
+            return False
+        # Reconnecting to a hung TV is backed off like a failed attempt
+        self.reachable = False
+        return True
+
+    def reset(self):
+        """Forget the backoff, e.g. when the user switches the TV on."""
+        self.attempts = 0
+        self._delay = 0
@@ -0,0 +1,467 @@
+"""Headless stand-in for the Domoticz Python plugin framework.
+
+Provides the parts of the Domoticz module the plugin uses (logging, Heartbeat,
+Connection with real TCP and HTTP I/O, Device with Create/Update/Delete) and a
+Runtime that loads plugin.py, injects Parameters/Devices/Settings/Images and
+runs the onStart/onConnect/onMessage/onHeartbeat/onCommand callback loop.
+Every device update is recorded, so runs can be asserted on and measured:
+
+    python fakeDomoticz.py --sim 3 --seconds 60 --profile plugin.prof
+"""
+
+import argparse
+import collections
+import errno
+import importlib.util
+import os
+import selectors
+import socket
+import sys
+import time
+
+Parameters = {}
+Devices = {}
+Settings = {}
+Images = {}
+
+DeviceUpdate = collections.namedtuple('DeviceUpdate', 'time unit nValue sValue')
+
+# Simulated TVs serve Simple IP Control on their HTTP port + this offset (--push)
+SIM_IP_OFFSET = 1000
+
+_runtime = None
+_debugging = 0
+_quiet = False
+
+def _write(level, message):
+    if _runtime is not None:
+        _runtime.log.append((time.time(), level, message))
+    if not _quiet:
+        print(time.strftime("%H:%M:%S") + " " + level + ": " + str(message))
+
+def Debug(message):
+    if _debugging:
+        _write("Debug", message)
+
+def Log(message):
+    _write("Log", message)
+
+def Status(message):
+    _write("Status", message)
+
+def Error(message):
+    _write("Error", message)
+
+def Debugging(level):
+    global _debugging
+    _debugging = int(level)
+
+def Heartbeat(seconds):
+    if _runtime is not None:
+        _runtime.set_heartbeat(seconds)
+
+class Device:
+    """Domoticz device, Create() adds it to Devices under its Unit."""
+
+    def __init__(self, Name="", Unit=0, TypeName="", Type=0, Subtype=0, Switchtype=0, Image=0, Options=None,
+                 Used=0, DeviceID="", Description=""):
+        self.Name = Name
+        self.Unit = Unit
+        self.TypeName = TypeName
+        self.Type = Type
+        self.SubType = Subtype
+        self.SwitchType = Switchtype
+        self.Image = Image
+        self.Options = dict(Options or {})
+        self.Used = Used
+        self.DeviceID = DeviceID or str(Unit)
+        self.Description = Description
+        self.ID = 0
+        self.nValue = 0
+        self.sValue = ""
+        self.LastLevel = 0
+        self.LastUpdate = ""
+        self.TimedOut = 0
+
+    def Create(self):
+        if self.Unit in Devices:
+            Error("Device creation failed, unit " + str(self.Unit) + " already exists")
+            return
+        self.ID = (max([device.ID for device in Devices.values()]) + 1) if Devices else 1
+        Devices[self.Unit] = self
+
+    def Update(self, nValue, sValue, Image=None, Options=None, Name=None, TimedOut=None, **kwargs):
+        self.nValue = nValue
+        self.sValue = sValue
+        if Image is not None: self.Image = Image
+        if Options is not None: self.Options = dict(Options)
+        if Name is not None: self.Name = Name
+        if TimedOut is not None: self.TimedOut = TimedOut
+        if self.SwitchType in (7, 18) and str(sValue).isdigit():
+            self.LastLevel = int(sValue)
+        self.LastUpdate = time.strftime("%Y-%m-%d %H:%M:%S")
+        if _runtime is not None:
+            _runtime.record_update(self)
+
+    def Delete(self):
+        Devices.pop(self.Unit, None)
+
+    def __str__(self):
+        return "Unit: " + str(self.Unit) + ", Name: '" + self.Name + "', nValue: " + str(self.nValue) + ", sValue: '" + str(self.sValue) + "'"
+
+class Connection:
+    """Outgoing TCP connection, Protocol 'HTTP' sends request dicts and delivers parsed responses,
+    any other protocol passes raw bytes."""
+
+    def __init__(self, Name="", Transport="TCP/IP", Protocol="None", Address="", Port=""):
+        self.Name = Name
+        self.Transport = Transport
+        self.Protocol = Protocol
+        self.Address = Address
+        self.Port = Port
+        self._socket = None
+        self._state = "disconnected"
+        self._outbuf = b""
+        self._inbuf = b""
+        self.bytesSent = 0
+        self.bytesReceived = 0
+
+    def Connect(self):
+        if self._state != "disconnected":
+            Error("Connect called on connection '" + self.Name + "' that is not disconnected")
+            return
+        runtime = _runtime
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            result = sock.connect_ex((self.Address, int(self.Port)))
+        except OSError as err:
+            runtime.post(self._fail, err.errno or errno.EHOSTUNREACH, str(err))
+            return
+        if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            runtime.post(self._fail, result, os.strerror(result))
+            return
+        self._socket = sock
+        self._state = "connecting"
+        runtime.selector.register(sock, selectors.EVENT_WRITE, self)
+
+    def Connecting(self):
+        return self._state == "connecting"
+
+    def Connected(self):
+        return self._state == "connected"
+
+    def Send(self, Message, Delay=0):
+        if self._state != "connected":
+            Error("Send called on connection '" + self.Name + "' that is not connected")
+            return
+        if self.Protocol == "HTTP" and isinstance(Message, dict):
+            data = self._http_request(Message)
+        elif isinstance(Message, str):
+            data = Message.encode("utf-8")
+        else:
+            data = bytes(Message)
+        self._outbuf += data
+        self.bytesSent += len(data)
+        _runtime.selector.modify(self._socket, selectors.EVENT_READ | selectors.EVENT_WRITE, self)
+
+    def Disconnect(self):
+        if self._socket is not None:
+            self._close()
+            _runtime.post(_runtime.callback, "onDisconnect", self)
+
+    def _fail(self, status, description):
+        self._state = "disconnected"
+        _runtime.callback("onConnect", self, status, description)
+
+    def _close(self):
+        try:
+            _runtime.selector.unregister(self._socket)
+        except (KeyError, ValueError):
+            pass
+        self._socket.close()
+        self._socket = None
+        self._state = "disconnected"
+        self._outbuf = b""
+        self._inbuf = b""
+
+    def _on_event(self, events):
+        if self._state == "connecting":
+            error = self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                self._close()
+                _runtime.callback("onConnect", self, error, os.strerror(error))
+                return
+            self._state = "connected"
+            _runtime.selector.modify(self._socket, selectors.EVENT_READ | (selectors.EVENT_WRITE if self._outbuf else 0), self)
+            _runtime.callback("onConnect", self, 0, "")
+            return
+        if events & selectors.EVENT_WRITE and self._outbuf:
+            try:
+                sent = self._socket.send(self._outbuf)
+                self._outbuf = self._outbuf[sent:]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self._lost()
+                return
+            if not self._outbuf:
+                _runtime.selector.modify(self._socket, selectors.EVENT_READ, self)
+        if events & selectors.EVENT_READ:
+            try:
+                data = self._socket.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                data = b""
+            if not data:
+                if self.Protocol == "HTTP" and self._inbuf:
+                    self._deliver_http(final=True)
+                self._lost()
+                return
+            self.bytesReceived += len(data)
+            if self.Protocol == "HTTP":
+                self._inbuf += data
+                self._deliver_http()
+            else:
+                _runtime.callback("onMessage", self, data)
+
+    def _lost(self):
+        if self._socket is not None:
+            self._close()
+            _runtime.callback("onDisconnect", self)
+
+    def _http_request(self, message):
+        data = message.get("Data", "")
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        lines = [message.get("Verb", "GET") + " " + message.get("URL", "/") + " HTTP/1.1"]
+        headers = dict(message.get("Headers", {}))
+        headers.setdefault("Host", self.Address + ":" + str(self.Port))
+        headers["Content-Length"] = str(len(data))
+        for name, value in headers.items():
+            lines.append(name + ": " + str(value))
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data
+
+    def _deliver_http(self, final=False):
+        while self._inbuf:
+            end = self._inbuf.find(b"\r\n\r\n")
+            if end < 0:
+                return
+            head = self._inbuf[:end].decode("latin-1").split("\r\n")
+            headers = {}
+            for line in head[1:]:
+                name, sep, value = line.partition(":")
+                headers[name.strip()] = value.strip()
+            lower = dict((name.lower(), value) for name, value in headers.items())
+            body_start = end + 4
+            if lower.get("transfer-encoding", "").lower() == "chunked":
+                body, consumed = self._dechunk(self._inbuf[body_start:])
+                if body is None:
+                    return
+                body_end = body_start + consumed
+            elif "content-length" in lower:
+                body_end = body_start + int(lower["content-length"])
+                if len(self._inbuf) < body_end:
+                    return
+                body = self._inbuf[body_start:body_end]
+            elif final:
+                body_end = len(self._inbuf)
+                body = self._inbuf[body_start:]
+            else:
+                return
+            self._inbuf = self._inbuf[body_end:]
+            status = head[0].split(None, 2)[1] if len(head[0].split()) > 1 else "0"
+            _runtime.callback("onMessage", self, {"Status": status, "Headers": headers, "Data": body})
+
+    def _dechunk(self, data):
+        body = b""
+        position = 0
+        while True:
+            line_end = data.find(b"\r\n", position)
+            if line_end < 0:
+                return None, 0
+            size = int(data[position:line_end].split(b";")[0], 16)
+            position = line_end + 2
+            if size == 0:
+                if len(data) < position + 2:
+                    return None, 0
+                return body, position + 2
+            if len(data) < position + size + 2:
+                return None, 0
+            body += data[position:position + size]
+            position += size + 2
+
+class Runtime:
+    """Loads a plugin module and runs its callbacks like the Domoticz plugin system does."""
+
+    def __init__(self, plugin_path, parameters=None, quiet=False):
+        global _runtime, _quiet
+        _runtime = self
+        _quiet = quiet
+        Devices.clear()
+        Parameters.clear()
+        Parameters.update({"HomeFolder": os.path.dirname(os.path.abspath(plugin_path)) + os.sep,
+                           "StartupFolder": os.getcwd() + os.sep, "HardwareID": 1, "Key": "fake",
+                           "Name": "Plugin", "Author": "", "Version": "", "Address": "", "Port": "",
+                           "Username": "", "Password": "", "SerialPort": "",
+                           "Mode1": "", "Mode2": "", "Mode3": "", "Mode4": "", "Mode5": "", "Mode6": ""})
+        Parameters.update(parameters or {})
+        self.plugin_path = plugin_path
+        self.selector = selectors.DefaultSelector()
+        self.heartbeat = 10
+        self.updates = []
+        self.log = []
+        self.callbacks = collections.Counter()
+        self.callback_time = collections.Counter()
+        self.module = None
+        self._posted = []
+        self._next_heartbeat = 0
+        self._running = False
+
+    def load(self):
+        """Import the plugin module with Domoticz replaced by this module."""
+        sys.modules["Domoticz"] = sys.modules[__name__]
+        plugin_dir = os.path.dirname(os.path.abspath(self.plugin_path))
+        if plugin_dir not in sys.path:
+            sys.path.insert(0, plugin_dir)
+        spec = importlib.util.spec_from_file_location("plugin", self.plugin_path)
+        module = importlib.util.module_from_spec(spec)
+        module.Parameters = Parameters
+        module.Devices = Devices
+        module.Settings = Settings
+        module.Images = Images
+        spec.loader.exec_module(module)
+        self.module = module
+        return module
+
+    def set_heartbeat(self, seconds):
+        self.heartbeat = seconds
+        self._next_heartbeat = time.time() + seconds
+
+    def callback(self, name, *args):
+        function = getattr(self.module, name, None)
+        if function is None:
+            return None
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.callbacks[name] += 1
+            self.callback_time[name] += time.perf_counter() - started
+
+    def post(self, function, *args):
+        """Run a function on the next loop iteration, Domoticz never calls back from inside a plugin call."""
+        self._posted.append((function, args))
+
+    def record_update(self, device):
+        self.updates.append(DeviceUpdate(time.time(), device.Unit, device.nValue, device.sValue))
+
+    def start(self):
+        if self.module is None:
+            self.load()
+        self._next_heartbeat = time.time() + self.heartbeat
+        self.callback("onStart")
+
+    def command(self, unit, command, level=0, hue=""):
+        """Act like a user operating a device in the Domoticz UI."""
+        self.callback("onCommand", unit, command, level, hue)
+
+    def run(self, seconds=None, until=None):
+        """Dispatch socket events and heartbeats for a number of seconds or until until() is true."""
+        end = time.time() + seconds if seconds is not None else None
+        self._running = True
+        while self._running:
+            while self._posted:
+                function, args = self._posted.pop(0)
+                function(*args)
+            now = time.time()
+            if until is not None and until():
+                break
+            if end is not None and now >= end:
+                break
+            if now >= self._next_heartbeat:
+                self._next_heartbeat = now + self.heartbeat
+                self.callback("onHeartbeat")
+                continue
+            timeout = self._next_heartbeat - now
+            if end is not None:
+                timeout = min(timeout, end - now)
+            if self._posted:
+                timeout = 0
+            if self.selector.get_map():
+                for key, events in self.selector.select(max(timeout, 0)):
+                    key.data._on_event(events)
+            else:
+                time.sleep(max(timeout, 0))
+
+    def stop(self):
+        self._running = False
+        self.callback("onStop")
+        for key in list(self.selector.get_map().values()):
+            key.data._close()
+
+    def summary(self, elapsed):
+        lines = ["Device updates: %d (%.1f/s)" % (len(self.updates), len(self.updates) / elapsed if elapsed else 0)]
+        for name in sorted(self.callbacks):
+            count = self.callbacks[name]
+            lines.append("%-16s %7d calls %9.3f ms avg" % (name, count, 1000.0 * self.callback_time[name] / count))
+        return "\n".join(lines)
+
+def main():
+    global _quiet
+    parser = argparse.ArgumentParser(description="Run the plugin headless against real or simulated TVs")
+    parser.add_argument("--plugin", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugin.py"))
+    parser.add_argument("--address", default="127.0.0.1", help="TV address(es), ; separated, host[:port]")
+    parser.add_argument("--psk", default="sony")
+    parser.add_argument("--mac", default="Android")
+    parser.add_argument("--volume", action="store_true", help="create the volume device (Mode3)")
+    parser.add_argument("--options", default="", help="Options field (Mode4)")
+    parser.add_argument("--interval", default="10", help="update interval (Mode5)")
+    parser.add_argument("--debug", action="store_true", help="Debug logging (Mode6)")
+    parser.add_argument("--sim", type=int, default=0, help="start this many simulated TVs and use them")
+    parser.add_argument("--push", action="store_true", help="simulated TVs push changes over Simple IP Control")
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--profile", help="write cProfile statistics to this file")
+    parser.add_argument("--quiet", action="store_true", help="don't print the plugin log")
+    args = parser.parse_args()
+
+    simulator = None
+    address = args.address
+    options = args.options
+    if args.sim:
+        from bravia_sim import SimulatorThread
+        simulator = SimulatorThread(args.sim, psk=args.psk, ip_offset=SIM_IP_OFFSET if args.push else None).start()
+        address = ";".join("127.0.0.1:" + str(tv.port) for tv in simulator.tvs)
+        if args.push:
+            options = (options + " push=+" + str(SIM_IP_OFFSET)).strip()
+
+    runtime = Runtime(args.plugin, {"Address": address, "Mode1": args.psk, "Mode2": args.mac,
+                                    "Mode3": "Volume" if args.volume else "Fixed", "Mode4": options,
+                                    "Mode5": args.interval, "Mode6": "Debug" if args.debug else "Normal"},
+                      quiet=args.quiet)
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    started = time.time()
+    try:
+        runtime.start()
+        runtime.run(args.seconds)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runtime.stop()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if simulator is not None:
+            simulator.stop()
+    print(runtime.summary(time.time() - started))
+
+if __name__ == "__main__":
+    # Run through the imported module, so plugin.py and bravia.py share its Devices and Parameters
+    import fakeDomoticz
+    fakeDomoticz.main()
@@ -0,0 +1,117 @@
+"""Logging of the plugin and its client: lazy formatting, rate-limited warnings and recent exchanges.
+
+Messages are %-format strings followed by their arguments, like the logging
+module of the standard library. They are only formatted when their level is
+enabled, so with debugging off a debug line costs a call and a test:
+
+    log.debug("HTTP Status: %s, Content Type: %s", Data["Status"], contentType)
+
+A warning is logged once per RATE_INTERVAL per format string, the next one
+tells how many were left out. The last EXCHANGES requests and replies are kept
+as they were sent or received and only formatted by dump(), which the plugin
+calls when a reply can't be handled.
+"""
+
+try:
+    import Domoticz
+except ImportError:
+    import fakeDomoticz as Domoticz
+
+import collections
+import time
+
+# Seconds in which a repeated warning is logged only once
+RATE_INTERVAL = 300
+# Requests and replies kept for dump()
+EXCHANGES = 20
+# Characters of a body shown by dump()
+DUMP_BODY = 300
+
+SENT = ">"
+RECEIVED = "<"
+
+class PluginLog:
+    def __init__(self, exchanges=EXCHANGES, rate_interval=RATE_INTERVAL, clock=time.time):
+        self.debugging = False
+        self.rate_interval = rate_interval
+        self.exchanges = collections.deque(maxlen=exchanges)
+        self._clock = clock
+        self._warned = {}           # format string -> (time last logged, repeats left out since)
+
+    def set_debug(self, enabled):
+        self.debugging = bool(enabled)
+        Domoticz.Debugging(1 if enabled else 0)
+
+    def debug_enabled(self):
+        """For debug output that takes work beyond formatting, such as loops or sums."""
+        return self.debugging
+
+    def debug(self, message, *args):
+        if self.debugging:
+            Domoticz.Debug(message % args if args else message)
+
+    def info(self, message, *args):
+        Domoticz.Log(message % args if args else message)
+
+    def error(self, message, *args):
+        Domoticz.Error(message % args if args else message)
+
+    def warning(self, message, *args):
+        """Logged unless the same message was logged less than rate_interval ago. Returns True when logged."""
+        return self._limited(message, message, args)
+
+    def _limited(self, key, message, args):
+        now = self._clock()
+        last = self._warned.get(key)
+        if last is not None and now - last[0] < self.rate_interval:
+            self._warned[key] = (last[0], last[1] + 1)
+            return False
+        self._warned[key] = (now, 0)
+        text = message % args if args else message
+        if last is not None and last[1]:
+            text += " (" + str(last[1]) + " more since " + time.strftime("%H:%M:%S", time.localtime(last[0])) + ")"
+        Domoticz.Log(text)
+        return True
+
+    def exchange(self, connection, direction, data):
+        """Remembers a request (SENT) or reply (RECEIVED) of a connection as it is, for dump()."""
+        self.exchanges.append((self._clock(), connection, direction, data))
+
+    def dump(self, reason, connection=None):
+        """Logs the exchanges kept for a connection (all when None), at most once per rate_interval per reason.
+        The reason should be the same text every time, the exchanges show the details."""
+        exchanges = [entry for entry in self.exchanges if connection is None or entry[1] == connection]
+        if not self._limited(reason, "%s, last %d exchanges:", (reason, len(exchanges))):
+            return
+        for when, name, direction, data in exchanges:
+            Domoticz.Log(time.strftime("%H:%M:%S", time.localtime(when)) + ("%.3f" % (when % 1))[1:] + " " + name + " "
+                         + direction + " " + describe(data))
+
+def describe(data):
+    """One line for an HTTP request or reply dict (without headers) or the bytes of a frame."""
+    if isinstance(data, dict):
+        text = " ".join(str(data[key]) for key in ("Verb", "URL", "Status") if key in data)
+        content_type = data.get("Headers", {}).get("Content-Type")
+        if content_type and "Status" in data:
+            text += " " + content_type
+        body = data.get("Data")
+    else:
+        text = ""
+        body = data
+    if isinstance(body, (bytes, bytearray)):
+        body = bytes(body).decode("utf-8", "replace")
+    if body:
+        body = str(body).replace("\n", " ")
+        text += " " + (body if len(body) <= DUMP_BODY else body[:DUMP_BODY] + "...")
+    return text.strip()
+
+# One log for the plugin and its modules
+LOG = PluginLog()
+set_debug = LOG.set_debug
+debugging = LOG.debug_enabled
+debug = LOG.debug
+info = LOG.info
+error = LOG.error
+warning = LOG.warning
+exchange = LOG.exchange
+dump = LOG.dump
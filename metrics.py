@@ -0,0 +1,105 @@
+import collections
+
+# Latencies kept per method, percentiles are taken over this many most recent replies
+LATENCY_SAMPLES = 200
+
+class MethodStats:
+    """Counters and recent latencies (seconds) of one API method."""
+
+    __slots__ = ("requests", "replies", "timeouts", "errors", "latencies")
+
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.requests = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=samples)
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of a sorted list, None when it is empty."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+class Metrics:
+    """Request counts, latencies, timeouts and error codes per API method of one TV, plus plain event counters.
+
+    Recording is a dictionary lookup and a few additions, so it is always on; the plugin
+    decides whether the figures are published. Methods are the JSON-RPC method names,
+    "IRCC" for SOAP remote commands and "IP <function>" for Simple IP Control frames."""
+
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.samples = samples
+        self.methods = collections.OrderedDict()
+        self.error_codes = collections.Counter()
+        self.counters = collections.Counter()
+
+    def method(self, name):
+        stats = self.methods.get(name)
+        if stats is None:
+            stats = self.methods[name] = MethodStats(self.samples)
+        return stats
+
+    def request(self, name):
+        self.method(name).requests += 1
+
+    def reply(self, name, latency, error=None):
+        """A reply arrived after latency seconds, error is the JSON-RPC error code or None."""
+        stats = self.method(name)
+        stats.replies += 1
+        stats.latencies.append(latency)
+        if error is not None:
+            stats.errors += 1
+            self.error_codes[error] += 1
+
+    def timeout(self, name):
+        self.method(name).timeouts += 1
+
+    def count(self, name, amount=1):
+        """Event counter such as connects, disconnects or device writes."""
+        self.counters[name] += amount
+
+    def totals(self):
+        """(requests, timeouts, errors) over all methods."""
+        requests = timeouts = errors = 0
+        for stats in self.methods.values():
+            requests += stats.requests
+            timeouts += stats.timeouts
+            errors += stats.errors
+        return requests, timeouts, errors
+
+    def latency(self, fraction):
+        """Percentile of the recent latencies of all methods together, in seconds."""
+        return percentile(sorted(latency for stats in self.methods.values() for latency in stats.latencies), fraction)
+
+    def summary(self):
+        """One line for the log and the text device."""
+        requests, timeouts, errors = self.totals()
+        text = str(requests) + " requests"
+        ordered = sorted(latency for stats in self.methods.values() for latency in stats.latencies)
+        if ordered:
+            text += ", latency " + "/".join(format_ms(percentile(ordered, fraction)) for fraction in (0.5, 0.95, 0.99)) + " ms (p50/p95/p99)"
+        text += ", " + str(timeouts) + " timeouts, " + str(errors) + " errors"
+        if self.error_codes:
+            text += " (" + ", ".join(str(code) + ": " + str(count) for code, count in sorted(self.error_codes.items(), key=lambda item: str(item[0]))) + ")"
+        for name in sorted(self.counters):
+            text += ", " + str(self.counters[name]) + " " + name
+        return text
+
+    def method_lines(self):
+        """One line per method for the debug log."""
+        lines = []
+        for name, stats in self.methods.items():
+            line = name + ": " + str(stats.requests) + " requests, " + str(stats.replies) + " replies"
+            ordered = sorted(stats.latencies)
+            if ordered:
+                line += ", " + "/".join(format_ms(percentile(ordered, fraction)) for fraction in (0.5, 0.95, 0.99)) + " ms"
+            if stats.timeouts:
+                line += ", " + str(stats.timeouts) + " timeouts"
+            if stats.errors:
+                line += ", " + str(stats.errors) + " errors"
+            lines.append(line)
+        return lines
+
+def format_ms(seconds):
+    return str(int(round(seconds * 1000)))
@@ -14,18 +14,21 @@ Prerequisites:<br/>
 * Enable pre-shared key on your TV: [Settings] => [Network] => [Home Network Setup] => [IP Control] => [Authentication] => [Normal and Pre-Shared Key]<br/>
 * Set pre-shared key on your TV: [Settings] => [Network] => [Home Network Setup] => [IP Control] => [Pre-Shared Key] => sony<br/>
 * Give your TV a static IP address, or make a DHCP reservation for a specific IP address in your router.<br/>
-* Determine the MAC address of your TV: [Settings] => [Network] => [Network Setup] => [View Network Status]<br/>
+* Determine the MAC address of your TV: [Settings] => [Network] => [Network Setup] => [View Network Status]<br/><br/>
+Several TVs can be controlled from one hardware entry: separate their IP addresses, pre-shared keys and MAC addresses with a semicolon.
+A single pre-shared key or MAC address is used for all TVs.<br/>
     </description>
     <params>
-        <param field="Address" label="IP address" width="200px" required="true" default="192.168.1.191"/>
-        <param field="Mode1" label="Pre-shared key (PSK)" width="200px" required="true" default="sony"/>
-        <param field="Mode2" label="MAC address" width="200px" required="true" default="Android"/>
+        <param field="Address" label="IP address(es)" width="300px" required="true" default="192.168.1.191"/>
+        <param field="Mode1" label="Pre-shared key(s) (PSK)" width="300px" required="true" default="sony"/>
+        <param field="Mode2" label="MAC address(es)" width="300px" required="true" default="Android"/>
         <param field="Mode3" label="Volume bar" width="75px">
             <options>
                 <option label="True" value="Volume"/>
                 <option label="False" value="Fixed" default="true" />
             </options>
         </param>
+        <param field="Mode4" label="Options" width="300px" default="refresh=0"/>
         <param field="Mode5" label="Update interval (sec)" width="30px" required="true" default="30"/>
         <param field="Mode6" label="Debug" width="75px">
             <options>
@@ -38,418 +41,1099 @@ Prerequisites:<br/>
 """
 
 import Domoticz
+import os
 import datetime
 import sys
 import json
+import random
+import time
 
-from bravia import BraviaRC
+import bravia_decode
+import bravia_ip
+import log
+import tvstate
+from capture import CaptureWriter
+from bravia import BraviaRC, SimpleIPTransport, ERROR_ILLEGAL_STATE
+from connection import ConnectionManager, RECONNECT_BASE
+from scheduler import PollScheduler
+from tvstate import TVState
+from volume import VolumeController
 
-class BasePlugin:
-    HttpConn = None
-    nextConnect = 3
-    outstandingPings = 0
-    powerOn = False
-    tvVolume = 0
-    tvSource = 0
-    tvControl = 0
-    tvChannel = 10
-    tvPlaying = {}
-    SourceOptions3 = {}
-    SourceOptions4 = {}
-    SourceOptions5 = {}
-    startTime = ''
-    endTime = ''
-    perc_playingTime = 0
-    _tv = None
-    _getState = None
-  
-    def onStart(self):
-        global _tv
-
-        if Parameters["Mode6"] == "Debug":
-            Domoticz.Debugging(1)
-
-        self.SourceOptions3 =   {   "LevelActions"  : "||||||",
-                                    "LevelNames"    : "Off|TV|HDMI1|HDMI2|HDMI3|HDMI4|Netflix",
-                                    "LevelOffHidden": "true",
-                                    "SelectorStyle" : "0"
-                                }
-        self.SourceOptions4 =   {   "LevelActions"  : "|||||",
-                                    "LevelNames"    : "Off|Play|Stop|Pause|TV Pause|Exit",
-                                    "LevelOffHidden": "true",
-                                    "SelectorStyle" : "0"
-                                }
-        self.SourceOptions5 =   {   "LevelActions"  : "||||||||||",
-                                    "LevelNames"    : "Off|CH1|CH2|CH3|CH4|CH5|CH6|CH7|CH8|CH9|--Choose a channel--",
-                                    "LevelOffHidden": "true",
-                                    "SelectorStyle" : "1"
-                                }
-
-        if Parameters["Mode3"] == "Volume" and 2 not in Devices:
-            Domoticz.Device(Name="Volume", Unit=2, Type=244, Subtype=73, Switchtype=7, Image=8, Used=1).Create()
-            Domoticz.Log("Volume device created")
-        if Parameters["Mode3"] != "Volume" and 2 in Devices:
-            Devices[2].Delete()
-            Domoticz.Log("Volume device deleted")
+# Remote buttons of the Domoticz media remote and the Sony command name they send
+REMOTE_KEYS = {
+    "ChannelUp": "ChannelUp",
+    "ChannelDown": "ChannelDown",
+    "Channels": "Display",          # Shows information on what is playing
+    "VolumeUp": "VolumeUp",
+    "VolumeDown": "VolumeDown",
+    "Mute": "Mute",
+    "Select": "Confirm",
+    "Up": "Up",
+    "Down": "Down",
+    "Left": "Left",
+    "Right": "Right",
+    "Home": "Home",
+    "Info": "EPG",
+    "Back": "Return",
+    "ContextMenu": "Options",
+    "FullScreen": "Exit",
+    "ShowSubtitles": "Input",
+    "Stop": "Stop",
+    "BigStepBack": "Pause",
+    "Rewind": "Rewind",
+    "PlayPause": "TvPause",
+    "FastForward": "Forward",
+    "BigStepForward": "Play",
+}
+
+# Levels of the Source device until the TV reported its inputs: name, Sony command name and content uri
+# Level 10 is the first entry, 20 the second and so on. Inputs loaded from the TV are selected by uri
+TV_SOURCE = ("TV", "Tv", None)
+NETFLIX_SOURCE = ("Netflix", "Netflix", None)
+DEFAULT_SOURCES = [TV_SOURCE, ("HDMI 1", "Hdmi1", None), ("HDMI 2", "Hdmi2", None),
+                   ("HDMI 3", "Hdmi3", None), ("HDMI 4", "Hdmi4", None), NETFLIX_SOURCE]
+
+# Domoticz heartbeat, the poll scheduler decides on every tick whether the TV is due
+HEARTBEAT_TICK = 2
+# Heartbeat while a TV is starting up, so the readiness polls follow each other closely
+WAKE_TICK = 1
+# Power-on durations kept per TV for the statistics
+POWER_ON_SAMPLES = 10
+# Seconds between checks whether the next programme started, once the current one should have ended
+PROGRAMME_RECHECK = 15
+
+# Interval between logging the device write counters
+STATS_INTERVAL = 600
+# Interval between updates of the metrics devices (metrics=on)
+METRICS_INTERVAL = 60
+# Interval between writes of the warm-start snapshot, it is also written on stop
+SNAPSHOT_INTERVAL = 600
+# Seconds the last known TV state of a snapshot is trusted at startup, lists and commands have their own age
+SNAPSHOT_STATE_AGE = 900
+# Seconds between attempts to open the Simple IP Control connection
+IP_RETRY = 60
+
+# Selector levels of the Control device
+CONTROL_KEYS = {10: "Play", 20: "Stop", 30: "Pause", 40: "TvPause", 50: "Exit"}
+
+# Selector levels of the Channel device until the channel list of the TV is loaded, level 100 is --Choose a channel--
+CHANNEL_KEYS = {10: "Num1", 20: "Num2", 30: "Num3", 40: "Num4", 50: "Num5",
+                60: "Num6", 70: "Num7", 80: "Num8", 90: "Num9"}
+
+# Device units are allocated per TV in blocks, unit = index * UNITS_PER_TV + offset
+UNITS_PER_TV = 10
+MAX_TVS = 25
+
+# Unit offsets within the block of a TV
+UNIT_INFO = 1
+UNIT_VOLUME = 2
+UNIT_SOURCE = 3
+UNIT_CONTROL = 4
+UNIT_CHANNEL = 5
+UNIT_APPS = 6
+UNIT_STATUS = 7
+UNIT_LATENCY = 8
+UNIT_METRICS = 9
+
+# Unit offset of each device of tvstate
+DEVICE_UNITS = {tvstate.STATUS: UNIT_STATUS, tvstate.INFO: UNIT_INFO, tvstate.VOLUME: UNIT_VOLUME, tvstate.SOURCE: UNIT_SOURCE,
+                tvstate.CONTROL: UNIT_CONTROL, tvstate.CHANNEL: UNIT_CHANNEL, tvstate.APPS: UNIT_APPS}
+UNIT_DEVICES = dict((unit, device) for device, unit in DEVICE_UNITS.items())
+
+# Apps selector until the application list of the TV is loaded: Netflix by remote key
+DEFAULT_APPS = [{"title": "Netflix", "uri": None, "icon": ""}]
+
+SOURCE_OPTIONS =    {   "LevelActions"  : "||||||",
+                        "LevelNames"    : "Off|TV|HDMI1|HDMI2|HDMI3|HDMI4|Netflix",
+                        "LevelOffHidden": "true",
+                        "SelectorStyle" : "0"
+                    }
+
+def SelectorOptions(names, style="0"):
+    # Selector switch options for a generated list of level names, level 0 is Off
+    names = [name.replace("|", "/") for name in names]
+    return {"LevelActions": "|" * len(names), "LevelNames": "|".join(["Off"] + names),
+            "LevelOffHidden": "true", "SelectorStyle": style}
+CONTROL_OPTIONS =   {   "LevelActions"  : "|||||",
+                        "LevelNames"    : "Off|Play|Stop|Pause|TV Pause|Exit",
+                        "LevelOffHidden": "true",
+                        "SelectorStyle" : "0"
+                    }
+APPS_OPTIONS =      {   "LevelActions"  : "|",
+                        "LevelNames"    : "Off|Netflix",
+                        "LevelOffHidden": "true",
+                        "SelectorStyle" : "1"
+                    }
+CHANNEL_OPTIONS =   {   "LevelActions"  : "||||||||||",
+                        "LevelNames"    : "Off|CH1|CH2|CH3|CH4|CH5|CH6|CH7|CH8|CH9|--Choose a channel--",
+                        "LevelOffHidden": "true",
+                        "SelectorStyle" : "1"
+                    }
+
+class BraviaTV:
+    """One TV of the fleet: its connection, BraviaRC, poll scheduler, state and block of device units."""
+
+    def __init__(self, index, address, port, psk, mac, ipPort=None, push=False, ipCommands=False, metrics=False):
+        self.index = index
+        self.base = index * UNITS_PER_TV
+        self.address = address
+        self.port = port
+        self.mac = mac
+        # The first TV keeps the plain device names of the single TV plugin
+        self.prefix = "" if index == 0 else address + " "
+        # Reconnects with backoff, hung connection detection and the circuit breaker for TVs off at the mains
+        self.link = ConnectionManager(rng=_random)
+        # Power state and what is playing, the devices are written from it. shown holds the values last written
+        self.state = TVState()
+        self.shown = {}
+        self.shownAt = 0
+        self.volume = VolumeController(self.SendVolume)
+        self.powerOnRequested = 0
+        self.powerOnTimes = []
+        self.sources = list(DEFAULT_SOURCES)
+        self.sourceLevelByUri = {}
+        self.channels = []
+        self.channelLevelByNumber = {}
+        self.apps = list(DEFAULT_APPS)
+        self.systemInfo = {}
+        self.savedSnapshot = None
+        self.startTime = ''
+        self.endTime = ''
+        self.perc_playingTime = 0
+        self.programme = None
+        self.programmeRecheck = 0
+        # When playing info was last asked outside a refresh (notification, command, programme end),
+        # when the TV last pushed its volume and when the last refresh was sent
+        self.playingAsked = 0
+        self.volumePushed = 0
+        self.lastRefresh = 0
+        self.scheduler = None
+        self.HttpConn = Domoticz.Connection(Name="HttpConn" + str(index), Transport="TCP/IP", Protocol="HTTP", Address=address, Port=port)
+        self.rc = BraviaRC(self.HttpConn, address, psk, mac)
+        # Request counts, latencies and errors are always recorded, metrics=on publishes them as devices
+        self.metrics = self.rc.metrics
+        self.publishMetrics = metrics
+        # Pro models push their changes over Simple IP Control, polling is then only a consistency check.
+        # The same connection can carry remote commands as 24 byte frames instead of SOAP requests
+        self.IpConn = None
+        self.ip = None
+        self.push = push
+        self.nextIpConnect = 0
+        if ipPort is not None:
+            self.IpConn = Domoticz.Connection(Name="IpConn" + str(index), Transport="TCP/IP", Protocol="None", Address=address, Port=str(ipPort))
+            self.ip = SimpleIPTransport(self.IpConn, self.metrics)
+            if ipCommands:
+                self.rc.set_ip_transport(self.ip)
+
+    def Unit(self, offset):
+        return self.base + offset
+
+    def UpdateDevice(self, offset, nValue, sValue, Options=None):
+        if UpdateDevice(self.base + offset, nValue, sValue, Options=Options):
+            self.metrics.count("device writes")
+
+    def SourceEntry(self, Level):
+        index = Level // 10 - 1
+        if Level % 10 == 0 and 0 <= index < len(self.sources):
+            return self.sources[index]
+        return None
+
+    def LoadSources(self):
+        if self.rc.sources_stale():
+            self.rc.load_source_list(self.onSourceList)
+
+    def ChannelEntry(self, Level):
+        index = Level // 10 - 1
+        if Level % 10 == 0 and 0 <= index < len(self.channels):
+            return self.channels[index]
+        return None
+
+    def ChannelLevel(self, dispNum):
+        # Selector level of a channel number, without a channel list only channels 1-9 have a level
+        number = ChannelNumber(dispNum)
+        if number is None:
+            return None
+        if self.channels:
+            return self.channelLevelByNumber.get(number)
+        return 10 * number if 0 < number < 10 else None
+
+    def CacheFile(self, kind):
+        folder = Parameters.get("HomeFolder")
+        if not folder:
+            return None
+        return os.path.join(folder, kind + "-" + self.address.replace(":", "_") + "-" + str(self.port) + ".json")
+
+    def ReadCache(self, kind):
+        # Lists read from the TV are kept in <kind>-<address>-<port>.json: {"version", "loaded", "items"}
+        filename = self.CacheFile(kind)
+        if filename is None or not os.path.exists(filename):
+            return None
+        try:
+            with open(filename) as cacheFile:
+                cache = json.load(cacheFile)
+            if cache.get("version") != 1:
+                return None
+            if not isinstance(cache["items"], (list, dict)):
+                raise TypeError("items is a " + type(cache["items"]).__name__)
+            log.debug("Cached %s list read from %s", kind, filename)
+            return cache["loaded"], cache["items"]
+        except (IOError, ValueError, KeyError, TypeError, AttributeError) as err:
+            log.error("Cached %s list %s could not be read: %s", kind, filename, err)
+        return None
+
+    def WriteCache(self, kind, loaded, items):
+        filename = self.CacheFile(kind)
+        if filename is None:
+            return
+        try:
+            with open(filename + ".tmp", "w") as cacheFile:
+                json.dump({"version": 1, "loaded": loaded, "items": items}, cacheFile)
+            os.replace(filename + ".tmp", filename)
+        except (IOError, OSError) as err:
+            log.error("Cached %s list %s could not be written: %s", kind, filename, err)
+
+    def LoadCaches(self):
+        cache = self.ReadCache("channels")
+        if cache is not None:
+            self.rc.set_channels(cache[1], cache[0])
+            self.onChannelList(self.rc.channel_list(), save=False)
+        cache = self.ReadCache("apps")
+        if cache is not None:
+            self.rc.set_apps(cache[1], cache[0])
+            self.onAppList(self.rc.app_list(), save=False)
+        cache = self.ReadCache("snapshot")
+        if cache is not None:
+            self.LoadSnapshot(cache[0], cache[1])
+
+    def Snapshot(self):
+        # Everything the plugin otherwise learns from the TV after a restart, channels and apps have their own cache
+        return {"commands": self.rc.command_list(), "system": self.systemInfo,
+                "sources": list(self.rc.source_mapping().items()), "sourcesLoaded": self.rc.sources_loaded(),
+                "state": self.state.to_dict()}
+
+    def SaveSnapshot(self):
+        snapshot = self.Snapshot()
+        if snapshot != self.savedSnapshot:
+            self.WriteCache("snapshot", time.time(), snapshot)
+            self.savedSnapshot = snapshot
+
+    def LoadSnapshot(self, saved, snapshot):
+        try:
+            if snapshot.get("commands"):
+                self.rc.set_commands(snapshot["commands"])
+            if snapshot.get("system"):
+                self.ApplySystemInfo(snapshot["system"])
+            if snapshot.get("sources"):
+                self.rc.set_sources(snapshot["sources"], snapshot.get("sourcesLoaded", 0))
+                self.onSourceList(self.rc.source_mapping())
+            state = snapshot.get("state")
+            if state and time.time() - saved < SNAPSHOT_STATE_AGE:
+                # A plain restart of Domoticz: commands work right away, the refresh after connecting corrects the rest
+                self.state = TVState.from_dict(state)
+                self.volume.volume = self.state.volume
+        except (KeyError, ValueError, TypeError, AttributeError) as err:
+            log.error("Snapshot of %s could not be used: %s", self.address, err)
+
+    def onSystemInfo(self, results, error):
+        if error is not None:
+            return
+        self.ApplySystemInfo({"model": results.model, "name": results.name, "generation": results.generation,
+                              "serial": results.serial, "macAddr": results.macAddr})
+
+    def ApplySystemInfo(self, info):
+        if info.get("model") != self.systemInfo.get("model"):
+            log.info("%sTV model %s, generation %s", self.prefix, info.get("model"), info.get("generation"))
+        self.systemInfo = info
+        # Without a configured MAC address the one the TV reports makes Wake-on-LAN possible
+        if not self.rc.has_wol() and info.get("macAddr"):
+            self.rc.set_mac(info["macAddr"])
+            log.debug("Using MAC address %s reported by the TV for Wake-on-LAN", info["macAddr"])
+
+    def LoadChannels(self):
+        if self.rc.channels_stale():
+            self.rc.load_channel_list(self.onChannelList)
+
+    def onChannelList(self, channels, save=True):
+        # Channel selector: one level per tuner channel, tuned by uri
+        if not channels:
+            return
+        if save:
+            self.WriteCache("channels", self.rc.channels_loaded(), channels)
+        # Channels without a number can't be listed by number, BraviaRC.set_channels leaves them out of its index too
+        channels = [channel for channel in channels if ChannelNumber(channel.get('dispNum')) is not None]
+        if not channels:
+            return
+        names = [str(int(channel['dispNum'])) + " " + channel['title'] for channel in channels]
+        changed = names != [str(int(channel['dispNum'])) + " " + channel['title'] for channel in self.channels]
+        self.channels = channels
+        self.channelLevelByNumber = {}
+        for index, channel in enumerate(channels):
+            self.channelLevelByNumber.setdefault(int(channel['dispNum']), 10 * (index + 1))
+        unit = self.Unit(UNIT_CHANNEL)
+        if changed and unit in Devices:
+            self.UpdateDevice(UNIT_CHANNEL, Devices[unit].nValue, Devices[unit].sValue,
+                              Options=SelectorOptions(names, style="1"))
+            log.info("Channel list updated: %s channels", len(channels))
+
+    def AppEntry(self, Level):
+        index = Level // 10 - 1
+        if Level % 10 == 0 and 0 <= index < len(self.apps):
+            return self.apps[index]
+        return None
+
+    def AppLevel(self):
+        # Selector level of the app in front, 0 (Off) while the tuner or an input is shown
+        for index, app in enumerate(self.apps):
+            if app['title'] == self.state.app:
+                return 10 * (index + 1)
+        return 0
+
+    def AppTitle(self, uri):
+        # The app is identified by the uri in the reply or else by the last launch the TV confirmed
+        app = self.rc.app_by_uri(uri)
+        if app is not None:
+            self.state.app = app['title']
+        return self.state.app or "App"
+
+    def LoadApps(self):
+        if self.rc.apps_stale():
+            self.rc.load_app_list(self.onAppList)
+
+    def onAppList(self, apps, save=True):
+        # Apps selector: one level per installed application, launched by uri
+        if not apps:
+            return
+        if save:
+            self.WriteCache("apps", self.rc.apps_loaded(), apps)
+        changed = [app['title'] for app in apps] != [app['title'] for app in self.apps]
+        self.apps = apps
+        unit = self.Unit(UNIT_APPS)
+        if changed and unit in Devices:
+            self.UpdateDevice(UNIT_APPS, Devices[unit].nValue, Devices[unit].sValue,
+                              Options=SelectorOptions([app['title'] for app in apps], style="1"))
+            log.info("Application list updated: %s", ", ".join(app['title'] for app in apps))
+
+    def LaunchApp(self, title):
+        # One setActiveApp call when the uri of the app is known, else the remote key of the same name
+        uri = self.rc.app_uri(title)
+        if uri is not None:
+            self.rc.set_active_app(uri, lambda result, error: self.onAppLaunched(title, error))
+        elif self.rc.send_command(title):
+            self.onAppLaunched(title, None)
+
+    def onAppLaunched(self, title, error):
+        if error is not None:
+            log.error("Application %s could not be started: %s", title, error)
+            return
+        self.state.app = title
+        self.state.title = title
+        self.Show()
+
+    def onSourceList(self, mapping):
+        # Source selector: the tuner, the inputs reported by the TV and Netflix
+        sources = [TV_SOURCE] + [(title, None, uri) for title, uri in mapping.items()] + [NETFLIX_SOURCE]
+        self.sourceLevelByUri = dict((uri, 10 * (index + 1)) for index, (name, command, uri) in enumerate(sources) if uri)
+        if [entry[0] for entry in sources] != [entry[0] for entry in self.sources]:
+            self.sources = sources
+            unit = self.Unit(UNIT_SOURCE)
+            if unit in Devices:
+                self.UpdateDevice(UNIT_SOURCE, Devices[unit].nValue, Devices[unit].sValue,
+                                  Options=SelectorOptions([entry[0] for entry in sources]))
+                log.info("Source list updated: %s", ", ".join(entry[0] for entry in sources))
+        self.sources = sources
+
+    def CreateDevices(self):
+        volume = self.Unit(UNIT_VOLUME)
+        if Parameters["Mode3"] == "Volume" and volume not in Devices:
+            Domoticz.Device(Name=self.prefix+"Volume", Unit=volume, Type=244, Subtype=73, Switchtype=7, Image=8, Used=1).Create()
+            log.info("Volume device created")
+        if Parameters["Mode3"] != "Volume" and volume in Devices:
+            Devices[volume].Delete()
+            ForgetDevice(volume)
+            log.info("Volume device deleted")
         # TODO : For some reason the first device entry in Devices is fucked and will weirdly toggle states
         #        This device itself, now sitting in Utility tab, is obsolete but prevents useful devices from being bugged
-        if 1 not in Devices:
-            Domoticz.Device(Name="Info", Unit=1, Type=243, Subtype=19, Used=1).Create()
-            Domoticz.Log("TV Status device created")
-        if 3 not in Devices:
-            Domoticz.Device(Name="Source", Unit=3, Type=244, Subtype=62, Switchtype=18, Image=2, Options=self.SourceOptions3, Used=1).Create()
-            Domoticz.Log("Source device created")
-        if 4 not in Devices:
-            Domoticz.Device(Name="Control", Unit=4, Type=244, Subtype=62, Switchtype=18, Image=2, Options=self.SourceOptions4, Used=1).Create()
-            Domoticz.Log("Control device created")
-        if 5 not in Devices:
-            Domoticz.Device(Name="Channel", Unit=5, Type=244, Subtype=62, Switchtype=18, Image=2, Options=self.SourceOptions5, Used=1).Create()
-            Domoticz.Log("Channel device created")
-        if 7 not in Devices:
-            Domoticz.Device(Name="Status", Unit=7, Type=244, Subtype=73, Switchtype=17, Image=2, Used=1).Create()
-        
-        if 2 in Devices: self.tvVolume = Devices[2].nValue   #--> of sValue
-        if 3 in Devices: self.tvSource = Devices[3].sValue
-        if 4 in Devices: self.tvControl = Devices[4].sValue
-        if 5 in Devices: self.tvChannel = Devices[5].sValue
+        if self.Unit(UNIT_INFO) not in Devices:
+            Domoticz.Device(Name=self.prefix+"Info", Unit=self.Unit(UNIT_INFO), Type=243, Subtype=19, Used=1).Create()
+            log.info("TV Status device created")
+        if self.Unit(UNIT_SOURCE) not in Devices:
+            Domoticz.Device(Name=self.prefix+"Source", Unit=self.Unit(UNIT_SOURCE), Type=244, Subtype=62, Switchtype=18, Image=2, Options=SOURCE_OPTIONS, Used=1).Create()
+            log.info("Source device created")
+        if self.Unit(UNIT_CONTROL) not in Devices:
+            Domoticz.Device(Name=self.prefix+"Control", Unit=self.Unit(UNIT_CONTROL), Type=244, Subtype=62, Switchtype=18, Image=2, Options=CONTROL_OPTIONS, Used=1).Create()
+            log.info("Control device created")
+        if self.Unit(UNIT_CHANNEL) not in Devices:
+            Domoticz.Device(Name=self.prefix+"Channel", Unit=self.Unit(UNIT_CHANNEL), Type=244, Subtype=62, Switchtype=18, Image=2, Options=CHANNEL_OPTIONS, Used=1).Create()
+            log.info("Channel device created")
+        if self.Unit(UNIT_APPS) not in Devices:
+            Domoticz.Device(Name=self.prefix+"Apps", Unit=self.Unit(UNIT_APPS), Type=244, Subtype=62, Switchtype=18, Image=2, Options=APPS_OPTIONS, Used=1).Create()
+            log.info("Apps device created")
+        if self.Unit(UNIT_STATUS) not in Devices:
+            Domoticz.Device(Name=self.prefix+"Status", Unit=self.Unit(UNIT_STATUS), Type=244, Subtype=73, Switchtype=17, Image=2, Used=1).Create()
+        if self.publishMetrics:
+            if self.Unit(UNIT_LATENCY) not in Devices:
+                Domoticz.Device(Name=self.prefix+"Latency", Unit=self.Unit(UNIT_LATENCY), Type=243, Subtype=31, Options={"Custom": "1;ms"}, Used=1).Create()
+                log.info("Latency device created")
+            if self.Unit(UNIT_METRICS) not in Devices:
+                Domoticz.Device(Name=self.prefix+"Metrics", Unit=self.Unit(UNIT_METRICS), Type=243, Subtype=19, Used=1).Create()
+                log.info("Metrics device created")
 
-        self.HttpConn = Domoticz.Connection(Name="HttpConn", Transport="TCP/IP", Protocol="HTTP", Address=Parameters["Address"], Port="80")
-        self.HttpConn.Connect()
+        self.state.volume = DeviceLevel(self.Unit(UNIT_VOLUME))
+        self.state.source = DeviceLevel(self.Unit(UNIT_SOURCE))
+        self.state.control = DeviceLevel(self.Unit(UNIT_CONTROL))
+        self.state.channel = DeviceLevel(self.Unit(UNIT_CHANNEL))
 
-        _tv = BraviaRC(self.HttpConn, Parameters["Address"], Parameters["Mode1"])
-        
-        # Set update interval, values below 10 seconds are not allowed due to timeout of 5 seconds in bravia.py script
-        updateInterval = int(Parameters["Mode5"])
-        if updateInterval > 30: updateInterval = 30
-        elif updateInterval < 10: updateInterval = 10
-        Domoticz.Debug("Update interval set to " + str(updateInterval) + " (minimum is 10 seconds)")
-        Domoticz.Heartbeat(updateInterval)
-        
-        return True
+    def onStart(self, updateInterval, offset):
+        self.CreateDevices()
+        self.LoadCaches()
+        self.scheduler = PollScheduler(updateInterval, rng=_random)
+        self.scheduler.start(offset=offset)
+        self.Connect(time.time())
+        if self.IpConn is not None:
+            self.IpConn.Connect()
 
     def onConnect(self, Connection, Status, Description):
+        if self.IpConn is not None and Connection.Name == self.IpConn.Name:
+            return self.onIpConnect(Status, Description)
         if (Status == 0):
-            Domoticz.Debug("Connected successfully to: "+Connection.Address+":"+Connection.Port)
-            _tv.printconf()
+            log.debug("Connected successfully to: %s:%s", Connection.Address, Connection.Port)
+            self.metrics.count("connects")
+            self.rc.printconf()
+            if not self.rc.has_commands():
+                self.rc.refresh_commands()
+            if not self.systemInfo:
+                self.rc.get_system_info(self.onSystemInfo)
+            if self.powerOnRequested:
+                # The connection came up while starting the TV, setPowerStatus couldn't be sent before
+                self.rc.set_power_status(True)
+            # Refresh right away instead of waiting for the poll that is due next
+            self.scheduler.polled(time.time())
+            self.Refresh()
         else:
-            Domoticz.Debug("Failed to connect ("+str(Status)+") to: "+Connection.Address+":"+Connection.Port+" with error: "+Description)
-            for Key in Devices:
-                UpdateDevice(Key, 0, Devices[Key].sValue) # Turn devices off in Domoticz
+            self.metrics.count("connect failures")
+            # First failure since the TV last answered (or since the start), not a retry of the backoff
+            firstFailure = self.link.reachable or self.link.attempts <= 1
+            if self.link.failed():
+                log.info("%sTV not reachable, trying again every %s minutes", self.prefix, self.link.probe_interval // 60)
+            elif not self.link.circuit_open():
+                log.debug("Failed to connect (%s) to: %s:%s with error: %s", Status, Connection.Address, Connection.Port, Description)
+            if firstFailure and not self.Waking(time.time()):
+                # Only the first failure turns the devices off, the retries leave them alone
+                self.scheduler.on_power('off')
+                if self.state.unreachable():
+                    self.ForgetProgramme()
+                    self.Show()
         return True
 
     def onDisconnect(self, Connection):
-        Domoticz.Debug("Device has disconnected")
+        if self.IpConn is not None and Connection.Name == self.IpConn.Name:
+            log.debug("Simple IP Control connection closed, using HTTP only")
+            self.metrics.count("IP disconnects")
+            self.scheduler.set_push(False)
+            self.ip.reset()
+            self.nextIpConnect = time.time() + IP_RETRY
+            return
+        log.debug("Device has disconnected")
+        self.metrics.count("disconnects")
+        self.link.disconnected()
+        self.rc.clear_pending()
         return
 
+    def onIpConnect(self, Status, Description):
+        if (Status == 0):
+            log.debug("Simple IP Control connection open to: %s:%s", self.IpConn.Address, self.IpConn.Port)
+            self.metrics.count("IP connects")
+            if self.push:
+                self.scheduler.set_push(True)
+            # The answers give the current state, changes are notified from then on
+            for function in (bravia_ip.POWER, bravia_ip.INPUT, bravia_ip.VOLUME, bravia_ip.MUTE):
+                self.ip.enquire(function)
+        else:
+            log.debug("No Simple IP Control connection (%s): %s, using HTTP only", Status, Description)
+            self.metrics.count("IP connect failures")
+            self.nextIpConnect = time.time() + IP_RETRY
+        return True
+
+    def onIpMessage(self, Data):
+        for kind, function, parameter in self.ip.feed(Data):
+            if kind in (bravia_ip.ANSWER, bravia_ip.NOTIFY) and parameter not in (bravia_ip.FAILURE, bravia_ip.NOT_FOUND):
+                try:
+                    self.onNotify(function, parameter)
+                except ValueError:
+                    log.debug("Invalid Simple IP frame: %s%s%s", kind, function, parameter)
+
+    def onNotify(self, function, parameter):
+        log.debug("Simple IP %s: %s", function, parameter)
+        if function == bravia_ip.POWER:
+            tvStatus = 'active' if bravia_ip.decode_number(parameter) == 1 else 'standby'
+            self.scheduler.on_power(tvStatus)
+            if (tvStatus == 'active') != self.state.on():
+                self.ApplyPowerStatus(tvStatus)
+        elif not self.state.on():
+            return
+        elif function == bravia_ip.INPUT:
+            uri = bravia_ip.input_uri(parameter)
+            level = 10 if uri is None else self.sourceLevelByUri.get(uri)
+            if level is not None and level != self.state.source:
+                self.state.source = level
+                self.state.app = None
+                self.Show()
+            # Title and programme are only known over JSON
+            self.AskPlayingInfo()
+        elif function == bravia_ip.CHANNEL:
+            level = self.ChannelLevel(bravia_ip.decode_channel(parameter))
+            if level is not None and level != self.state.channel:
+                self.state.channel = level
+                self.Show()
+                self.AskPlayingInfo()
+        elif function == bravia_ip.VOLUME:
+            self.volumePushed = time.time()
+            self.VolumeReported(bravia_ip.decode_number(parameter))
+        elif function == bravia_ip.MUTE:
+            self.state.muted = bravia_ip.decode_number(parameter) == 1
+            self.Show()
+
     def onCommand(self, Unit, Command, Level, Hue):
-        Domoticz.Debug("onCommand called for Unit " + str(Unit) + ": Parameter '" + str(Command) + "', Level: " + str(Level))
         Command = Command.strip()
         action, sep, params = Command.partition(' ')
         action = action.capitalize()
         params = params.capitalize()
+        Unit = Unit - self.base
+
+        # Commands that make no sense in the current state (anything but On while the TV is off) cost no request
+        if not self.state.accepts(UNIT_DEVICES.get(Unit), action):
+            log.debug("%sCommand %s ignored, the TV is %s", self.prefix, Command, self.state.power)
+            return
+
+        # Follow the result of the command quickly
+        self.scheduler.boost()
+        if Unit != UNIT_VOLUME:
+            self.ForgetProgramme()
+
+        if Unit == UNIT_STATUS:     # TV power switch
+            if action == "On":
+                self.PowerOn()
+            elif action == "Off":
+                self.rc.turn_off()
+                self.state.switch_off(time.time())
+                self.Show()
+            # Volume keys are folded into one relative setAudioVolume, the device follows right away
+            elif Command in ("VolumeUp", "VolumeDown"):
+                self.ShowVolume(self.volume.step(1 if Command == "VolumeUp" else -1))
+            # Remote buttons (action is capitalized so chosen for Command)
+            elif Command in REMOTE_KEYS:
+                self.rc.send_command(REMOTE_KEYS[Command])
+
+        if Unit == UNIT_VOLUME:     # TV volume
+            if action == 'Set':
+                # Slider moves are debounced, only the last level of a drag is sent
+                self.ShowVolume(self.volume.set(Level))
+            elif action in ("Off", "On"):
+                self.rc.mute_volume()
+                self.state.muted = action == "Off"
+                self.Show()
 
-        if self.powerOn == False:
-            if Unit == 7:     # TV power switch
-                if action == "On":
-                    # Start TV when WOL is not available, only works on Android
-                    if Parameters["Mode2"] == "Android":
-                        Domoticz.Debug("No MAC address configured, TV will be started with setPowerStatus command (Android only)")
-                        try:
-                            _tv.turn_on_command()
-                            self.tvPlaying = "TV starting" # Show that the TV is starting, as booting the TV takes some time
-                            self.SyncDevices()
-                        except Exception as err:
-                            Domoticz.Debug("Error when starting TV with set PowerStatus, Android only (" +  str(err) + ")")
-                    # Start TV using WOL
+        if Unit == UNIT_SOURCE:   # TV source
+            if Command == 'Set Level':
+                entry = self.SourceEntry(Level)
+                if entry is not None:
+                    self.state.title, command, uri = entry
+                    # Inputs known by uri are selected with one setPlayContent call, the others by remote key
+                    if uri is not None:
+                        self.rc.play_content(uri)
+                    elif entry is NETFLIX_SOURCE:
+                        self.LaunchApp("Netflix")
                     else:
-                        try:
-                            _tv.turn_on()
-                            self.tvPlaying = "TV starting" # Show that the TV is starting, as booting the TV takes some time
-                            self.SyncDevices()
-                        except Exception as err:
-                            Domoticz.Debug("Error when starting TV using WOL (" +  str(err) + ")")
-        else:
-            if Unit == 7:     # TV power switch
-                if action == "Off":
-                    _tv.turn_off()
-                    self.tvPlaying = "Off"
-                    self.SyncDevices()
-                # Remote buttons (action is capitalized so chosen for Command)
-                elif Command == "ChannelUp": _tv.send_req_ircc("AAAAAQAAAAEAAAAQAw==")       # ChannelUp
-                elif Command == "ChannelDown": _tv.send_req_ircc("AAAAAQAAAAEAAAARAw==")     # ChannelDown
-                elif Command == "Channels": _tv.send_req_ircc("AAAAAQAAAAEAAAA6Aw==")        # Display, shows information on what is playing
-                elif Command == "VolumeUp": _tv.send_req_ircc("AAAAAQAAAAEAAAASAw==")        # VolumeUp
-                elif Command == "VolumeDown": _tv.send_req_ircc("AAAAAQAAAAEAAAATAw==")      # VolumeDown
-                elif Command == "Mute": _tv.send_req_ircc("AAAAAQAAAAEAAAAUAw==")            # Mute
-                elif Command == "Select": _tv.send_req_ircc("AAAAAQAAAAEAAABlAw==")          # Confirm
-                elif Command == "Up": _tv.send_req_ircc("AAAAAQAAAAEAAAB0Aw==")              # Up
-                elif Command == "Down": _tv.send_req_ircc("AAAAAQAAAAEAAAB1Aw==")            # Down
-                elif Command == "Left": _tv.send_req_ircc("AAAAAQAAAAEAAAA0Aw==")            # Left
-                elif Command == "Right": _tv.send_req_ircc("AAAAAQAAAAEAAAAzAw==")           # Right
-                elif Command == "Home": _tv.send_req_ircc("AAAAAQAAAAEAAABgAw==")            # Home
-                elif Command == "Info": _tv.send_req_ircc("AAAAAgAAAKQAAABbAw==")            # EPG
-                elif Command == "Back": _tv.send_req_ircc("AAAAAgAAAJcAAAAjAw==")            # Return
-                elif Command == "ContextMenu": _tv.send_req_ircc("AAAAAgAAAJcAAAA2Aw==")     # Options
-                elif Command == "FullScreen": _tv.send_req_ircc("AAAAAQAAAAEAAABjAw==")      # Exit
-                elif Command == "ShowSubtitles": _tv.send_req_ircc("AAAAAQAAAAEAAAAlAw==")   # Input
-                elif Command == "Stop": _tv.send_req_ircc("AAAAAgAAAJcAAAAYAw==")            # Stop
-                elif Command == "BigStepBack": _tv.send_req_ircc("AAAAAgAAAJcAAAAZAw==")     # Pause
-                elif Command == "Rewind": _tv.send_req_ircc("AAAAAgAAAJcAAAAbAw==")          # Rewind
-                elif Command == "PlayPause": _tv.send_req_ircc("AAAAAgAAABoAAABnAw==")       # TV pause
-                elif Command == "FastForward": _tv.send_req_ircc("AAAAAgAAAJcAAAAcAw==")     # Forward
-                elif Command == "BigStepForward": _tv.send_req_ircc("AAAAAgAAAJcAAAAaAw==")  # Play
-
-            if Unit == 2:     # TV volume
-                if action == 'Set':
-                    self.tvVolume = str(Level)
-                    _tv.set_volume_level(self.tvVolume)
-                elif action == "Off":
-                    _tv.mute_volume()
-                    UpdateDevice(2, 0, str(self.tvVolume))
-                elif action == "On":
-                    _tv.mute_volume()
-                    UpdateDevice(2, 1, str(self.tvVolume))
-
-            if Unit == 3:   # TV source
-                if Command == 'Set Level':
-                    if Level == 10: 
-                        _tv.send_req_ircc("AAAAAQAAAAEAAAAkAw==") #TV
-                        self.GetTVInfo()
-                    if Level == 20:
-                        _tv.send_req_ircc("AAAAAgAAABoAAABaAw==") #HDMI1
-                        self.tvPlaying = "HDMI 1"
-                    if Level == 30:
-                        _tv.send_req_ircc("AAAAAgAAABoAAABbAw==") #HDMI2
-                        self.tvPlaying = "HDMI 2"
-                    if Level == 40:
-                        _tv.send_req_ircc("AAAAAgAAABoAAABcAw==") #HDMI3
-                        self.tvPlaying = "HDMI 3"
-                    if Level == 50:
-                        _tv.send_req_ircc("AAAAAgAAABoAAABdAw==") #HDMI4
-                        self.tvPlaying = "HDMI 4"
-                    if Level == 60:
-                        _tv.send_req_ircc("AAAAAgAAABoAAAB8Aw==") #Netflix
-                        self.tvPlaying = "Netflix"
-                    self.tvSource = Level
-                    self.SyncDevices()
-
-            if Unit == 4:   # TV control
-                if Command == 'Set Level':
-                    if Level == 10: _tv.send_req_ircc("AAAAAgAAAJcAAAAaAw==") #Play
-                    if Level == 20: _tv.send_req_ircc("AAAAAgAAAJcAAAAYAw==") #Stop
-                    if Level == 30: _tv.send_req_ircc("AAAAAgAAAJcAAAAZAw==") #Pause
-                    if Level == 40: _tv.send_req_ircc("AAAAAgAAABoAAABnAw==") #Pause TV
-                    if Level == 50: _tv.send_req_ircc("AAAAAQAAAAEAAABjAw==") #Exit
-                    self.tvControl = Level
-                    self.SyncDevices()
-
-            if Unit == 5:   # TV channels
-                if Command == 'Set Level':
-                    if Level == 10: _tv.send_req_ircc("AAAAAQAAAAEAAAAAAw==") #1
-                    if Level == 20: _tv.send_req_ircc("AAAAAQAAAAEAAAABAw==") #2
-                    if Level == 30: _tv.send_req_ircc("AAAAAQAAAAEAAAACAw==") #3
-                    if Level == 40: _tv.send_req_ircc("AAAAAQAAAAEAAAADAw==") #4
-                    if Level == 50: _tv.send_req_ircc("AAAAAQAAAAEAAAAEAw==") #5
-                    if Level == 60: _tv.send_req_ircc("AAAAAQAAAAEAAAAFAw==") #6
-                    if Level == 70: _tv.send_req_ircc("AAAAAQAAAAEAAAAGAw==") #7
-                    if Level == 80: _tv.send_req_ircc("AAAAAQAAAAEAAAAHAw==") #8
-                    if Level == 90: _tv.send_req_ircc("AAAAAQAAAAEAAAAIAw==") #9
-                    # Level 100 = --Choose a channel--
-                    self.tvChannel = Level
-                    self.SyncDevices()
+                        self.rc.send_command(command)
+                    if Level == 10: self.GetTVInfo()
+                self.state.source = Level
+                self.Show()
+
+        if Unit == UNIT_CONTROL:   # TV control
+            if Command == 'Set Level':
+                if Level in CONTROL_KEYS: self.rc.send_command(CONTROL_KEYS[Level])
+                self.state.control = Level
+                self.Show()
+
+        if Unit == UNIT_APPS:   # Applications
+            if Command == 'Set Level':
+                app = self.AppEntry(Level)
+                if app is not None:
+                    self.LaunchApp(app['title'])
+
+        if Unit == UNIT_CHANNEL:   # TV channels
+            if Command == 'Set Level':
+                # Level 100 = --Choose a channel-- until the channel list is loaded
+                channel = self.ChannelEntry(Level)
+                if channel is not None:
+                    self.rc.play_content(channel['uri'])
+                elif not self.channels and Level in CHANNEL_KEYS:
+                    self.rc.send_command(CHANNEL_KEYS[Level])
+                self.state.channel = Level
+                self.Show()
 
         return
 
     def onMessage(self, Connection, Data):        
-        strData = Data["Data"].decode("utf-8", "ignore")
-        Status = str(Data["Status"])
-        Domoticz.Debug("HTTP Status: "+Status+", Content Type: " + Data['Headers']['Content-Type'])
+        log.exchange(Connection.Name, log.RECEIVED, Data)
+        if self.IpConn is not None and Connection.Name == self.IpConn.Name:
+            self.onIpMessage(Data)
+            return True
+        contentType = Data['Headers'].get('Content-Type', "")
+        log.debug("HTTP Status: %s, Content Type: %s", Data["Status"], contentType)
         
         #if (Data['Headers']['Connection'] == "close"): 
             # Reconnect : True
         
-        if (Data['Headers']['Content-Type'] == "application/json"):
-            resp = json.loads(strData)        
-        
-            if ('result' in resp):
-                results = resp.get('result')
-                if ('type' in results[0] and results[0]['type'] == "IR_REMOTE_BUNDLE_TYPE_AEP_N" and results[1] is not None):
-                    _tv.set_commands(results[1])
-                    Domoticz.Debug("Commands set")
-                    
-                elif ('status' in results[0]):
-                    if( self.outstandingPings >= 0):
-                        self.outstandingPings = self.outstandingPings - 1
-                    tvStatus = results[0]['status']
-                    if tvStatus == 'active':                        # TV is on
-                        self.powerOn = True
-                        self.GetTVInfo()
-                    else:                                           # TV is off or standby
-                        self.powerOn = False
-                    
-                    self.SyncDevices()
-
-                elif (self._getState == "TVInfo"):
-                    # TODO : Source information is not updated
-                    if resp is not None and not resp.get('error'):
-                        self._getState = None
-                        playing_content_data = results[0]
-                        self.tvPlaying = {}
-                        self.tvPlaying['programTitle'] = playing_content_data.get('programTitle')
-                        self.tvPlaying['title'] = playing_content_data.get('title')
-                        self.tvPlaying['programMediaType'] = playing_content_data.get('programMediaType')
-                        self.tvPlaying['dispNum'] = playing_content_data.get('dispNum')
-                        self.tvPlaying['source'] = playing_content_data.get('source')
-                        self.tvPlaying['uri'] = playing_content_data.get('uri')
-                        self.tvPlaying['durationSec'] = playing_content_data.get('durationSec')
-                        self.tvPlaying['startDateTime'] = playing_content_data.get('startDateTime')
-
-                        if self.tvPlaying['programTitle'] != None:      # Get information on channel and program title if tuner of TV is used
-                            if self.tvPlaying['startDateTime'] != None: # Show start time and end time of program
-                                self.startTime, self.endTime, self.perc_playingTime = _tv.playing_time(self.tvPlaying['startDateTime'], self.tvPlaying['durationSec'])
-                                if (int(self.tvPlaying['dispNum']) < 10):
-                                    self.tvChannel = 10*int(self.tvPlaying['dispNum'])
-
-                                #str(int(self.tvPlaying['dispNum'])) + ': ' + 
-                                self.tvPlaying = self.tvPlaying['title'] + ' - ' + self.tvPlaying['programTitle'] + ' [' + str(self.startTime) + ' - ' + str(self.endTime) +']'  
-                                Domoticz.Debug("Program information: " + str(self.startTime) + "-" + str(self.endTime) + " [" + str(self.perc_playingTime) + "%]")
-                            else:
-                                self.tvPlaying = str(int(self.tvPlaying['dispNum'])) + ': ' + self.tvPlaying['title'] + ' - ' + self.tvPlaying['programTitle']
-
-                            self.tvSource = 10
-                            UpdateDevice(3, 1, str(self.tvSource))      # Set source device to TV
-                            UpdateDevice(5, 1, str(self.tvChannel))
-                            UpdateDevice(7, 1, self.tvPlaying)
-
-                        else:                                           # No program info found
-                            if self.tvPlaying['title'] != '':
-                                self.tvPlaying = self.tvPlaying['title']
-                            else:
-                                self.tvPlaying = "Netflix"              # When TV plays apps, no title information (in this case '') is available, so assume Netflix is playing
-                            if "/MHL" in self.tvPlaying:                # Source contains /MHL, that can be removed
-                                self.tvPlaying = self.tvPlaying.replace("/MHL", "")
-                            #UpdateDevice(1, 1, self.tvPlaying)
-                            if "HDMI 1" in self.tvPlaying:
-                                self.tvSource = 20
-                                UpdateDevice(3, 1, str(self.tvSource))  # Set source device to HDMI1
-                            elif "HDMI 2" in self.tvPlaying:
-                                self.tvSource = 30
-                                UpdateDevice(3, 1, str(self.tvSource))  # Set source device to HDMI2
-                            elif "HDMI 3" in self.tvPlaying:
-                                self.tvSource = 40
-                                UpdateDevice(3, 1, str(self.tvSource))  # Set source device to HDMI3
-                            elif "HDMI 4" in self.tvPlaying:
-                                self.tvSource = 50
-                                UpdateDevice(3, 1, str(self.tvSource))  # Set source device to HDMI4
-                            elif "Netflix" in self.tvPlaying:
-                                self.tvSource = 60
-                                UpdateDevice(3, 1, str(self.tvSource))  # Set source device to Netflix
-
-                        # Get volume information of TV
-                        if Parameters["Mode3"] == "Volume":
-                            _tv.get_volume_info()
-
-                        # Update control and channel devices
-                        UpdateDevice(4, 1, str(self.tvControl))
-                        UpdateDevice(5, 1, str(self.tvChannel))
+        # Replies of another type are errors pages (wrong PSK, unknown URL), the recent exchanges show what caused them
+        handler = RESPONSE_HANDLERS.get(bravia_decode.media_type(contentType))
+        if handler is not None:
+            handler(self, Data)
+        else:
+            log.dump(self.prefix + "Unexpected HTTP " + str(Data["Status"]) + " reply (" + contentType + ")", Connection.Name)
+        return True
 
-                    else:
-                        Domoticz.Debug("No information from TV received (TV was paused and then continued playing from disk)")
-                elif (isinstance(results[0],list)):
-                    for result in results[0]:
-                        if ('target' in result):
-                            if (result['target'] == 'headphone'):
-                                self.tvVolume = result['volume']
-                                if self.tvVolume != None: UpdateDevice(2, 2, str(self.tvVolume))
-                else:
-                    Domoticz.Debug("Warning: onMessage event but unknown message type!")
-                    DumpHTTPResponseToLog(Data)
-            elif ('error' in resp):
-                Domoticz.Debug("Remote device returned error: ")
-                error = resp.get('error')
-                Domoticz.Debug("Error code "+str(error[0])+": "+str(error[1]))            
+    def onJsonResponse(self, Data):
+        try:
+            resp = json.loads(Data["Data"].decode("utf-8", "ignore"))
+        except ValueError:
+            log.dump(self.prefix + "Invalid JSON reply", self.HttpConn.Name)
+            return
+        self.Answered()
+        # Replies are routed by their JSON-RPC id to the callback of the request that caused them,
+        # which gets a record of bravia_decode for the methods the plugin reads
+        if not self.rc.handle_response(resp):
+            log.dump(self.prefix + "Reply to an unknown request", self.HttpConn.Name)
+
+    def onIrccResponse(self, Data):
+        # TODO : Parse XML to verify IRCC command received correctly
+        if str(Data["Status"]) != "200":
+            log.dump(self.prefix + "Remote command refused with HTTP " + str(Data["Status"]), self.HttpConn.Name)
+        else:
+            log.debug("Remote command received")
+        self.Answered()
+        self.rc.handle_ircc_reply()
+
+    def Answered(self):
+        if self.link.reply():
+            log.info("%sTV reachable again", self.prefix)
+
+    def onPowerStatus(self, results, error):
+        if error is not None:
+            return
+        tvStatus = results.status
+        self.scheduler.on_power(tvStatus)
+        self.ApplyPowerStatus(tvStatus)
+
+    def ApplyPowerStatus(self, tvStatus):
+        now = time.time()
+        if tvStatus == 'active' and self.powerOnRequested:
+            self.PowerOnDone(now)
+        if self.state.reported(tvStatus, now):
+            log.debug("%sTV %s", self.prefix, self.state.power)
+            if self.state.on():
+                # Just switched on, while it stays on Refresh queries playing info and volume with the power status
+                self.GetTVInfo()
             else:
-                Domoticz.Debug("Warning: onMessage event but no known content in data!")
-                DumpHTTPResponseToLog(Data)
-        elif (Data['Headers']['Content-Type'] == 'text/xml; charset="utf-8"'):
-            #DumpHTTPResponseToLog(Data)
-            # TODO : Parse XML to verify IRCC command received correctly
-            Domoticz.Debug("Remote command received")
-            
-        return True
+                self.ForgetProgramme()
+        if self.state.on():
+            self.LoadSources()
+            self.LoadChannels()
+            self.LoadApps()
+        self.Show(now)
 
-    def onNotification(self, Name, Subject, Text, Status, Priority, Sound, ImageFile):
-        Domoticz.Log("Notification: " + Name + "," + Subject + "," + Text + "," + Status + "," + str(Priority) + "," + Sound + "," + ImageFile)
+    def onPlayingContent(self, results, error):
+        # TODO : Source information is not updated
+        if not self.state.on():
+            return                                      # Sent alongside a power status that reported the TV off
+        if error is not None:
+            if error[0] != ERROR_ILLEGAL_STATE:
+                log.debug("No information from TV received (TV was paused and then continued playing from disk)")
+                return
+            results = bravia_decode.NO_CONTENT          # An app or the home screen is shown, there is no content information
+        content = results
+        state = self.state
+        self.ForgetProgramme()
 
-    def onHeartbeat(self):
-        if (self.HttpConn.Connected()):
-            if (self.outstandingPings > 6):
-                self.HttpConn.Disconnect()
-                self.nextConnect = 0
+        if content.programTitle != None:                # Get information on channel and program title if tuner of TV is used
+            level = self.ChannelLevel(content.dispNum)
+            if level is not None:
+                state.channel = level
+            if content.startDateTime != None:
+                # Parsed once per programme, progress is then kept up to date by onHeartbeat without asking the TV
+                try:
+                    self.programme = self.rc.programme(content.uri, content.startDateTime, content.durationSec)
+                except (TypeError, ValueError) as exception:
+                    log.debug("Program times not understood, shown without them: %s", exception)
+            if self.programme is not None:              # Show start time and end time of program
+                self.startTime, self.endTime = self.programme.start_text, self.programme.end_text
+                self.Progress(time.time())
+
+                #str(int(content.dispNum)) + ': ' + 
+                state.title = content.title + ' - ' + content.programTitle + ' [' + str(self.startTime) + ' - ' + str(self.endTime) +']'  
+                log.debug("Program information: %s-%s [%s%%]", self.startTime, self.endTime, self.perc_playingTime)
             else:
-                _tv.get_power_status()
-                self.outstandingPings = self.outstandingPings + 1
+                number = ChannelNumber(content.dispNum)
+                state.title = (str(number) + ': ' if number is not None else '') + content.title + ' - ' + content.programTitle
+
+            state.app = None
+            state.source = 10                           # Set source device to TV
+
+        else:                                           # No program info found
+            if content.title:
+                state.app = None
+                title = content.title
+            else:
+                title = self.AppTitle(content.uri)      # When TV plays apps, no title information is available
+            state.title = title.replace("/MHL", "")     # Source contains /MHL, that can be removed
+            uri = content.uri
+            level = self.sourceLevelByUri.get(uri)
+            if uri and str(uri).startswith("extInput:"):
+                # An input that is missing from the list or got another label: the list is outdated
+                if level is None or self.SourceEntry(level)[0] != state.title:
+                    self.rc.invalidate_sources()
+            if level is None:
+                for index, (name, command, sourceUri) in enumerate(self.sources):
+                    if index > 0 and name in state.title:
+                        level = 10 * (index + 1)
+                        break
+            if level is not None:
+                state.source = level                    # Set source device to the input that is shown
+
+        # Status, source, channel and apps devices follow in one go
+        self.Show()
+
+    def onVolumeInfo(self, results, error):
+        if error is not None or not self.state.on():
+            return
+        # The target set_volume_level changes, so the reply can be compared with what was sent
+        speaker = results.target('speaker')
+        if speaker is None:
+            return
+        if speaker.mute is not None:
+            self.state.muted = bool(speaker.mute)
+        if speaker.volume != None:
+            self.VolumeReported(speaker.volume)
         else:
-            self.outstandingPings = 0
-            self.HttpConn.Connect()
+            self.Show()
+
+    def SendVolume(self, value):
+        self.rc.set_volume_level(str(value), self.onVolumeSet)
+
+    def onVolumeSet(self, results, error):
+        if error is not None:
+            log.debug("Volume change not accepted: %s", error)
+            self.rc.get_volume_info(self.onVolumeInfo)
+
+    def ShowVolume(self, volume):
+        # Optimistic update with the volume the TV will have, the next reply of the TV confirms or corrects it
+        if volume is None:
+            return
+        self.state.volume = volume
+        self.Show()
+
+    def VolumeReported(self, volume):
+        # Ignored while changes are in flight, the TV may still report the volume from before them
+        if self.volume.reported(volume):
+            self.state.volume = self.volume.volume
+        self.Show()
+
+    def ForgetProgramme(self):
+        # The Info device empties with it, a programme that is over or unknown shows no times
+        self.programme = None
+        self.state.info = None
+
+    def Progress(self, now):
+        # Info device text of the programme that is playing
+        self.perc_playingTime = self.programme.progress(now)
+        self.state.info = self.startTime + " - " + self.endTime + " (" + str(self.perc_playingTime) + "%)"
+
+    def ShowProgress(self, now):
+        self.Progress(now)
+        self.Show(now)
+
+    def Show(self, now=None):
+        # Only the devices whose value differs from the one last written are touched. With refresh=<minutes>
+        # all values go to UpdateDevice once per period, it rewrites the devices that are due
+        if now is None:
+            now = time.time()
+        if _deviceRefresh > 0 and now - self.shownAt >= _deviceRefresh:
+            self.shown = {}
+            self.shownAt = now
+        values = self.state.devices(self.AppLevel(), Parameters["Mode3"] == "Volume")
+        for device, value in tvstate.changes(self.shown, values):
+            self.UpdateDevice(DEVICE_UNITS[device], value[0], value[1])
+            self.shown[device] = value
+
+    def PublishMetrics(self):
+        # Latency device shows the p95 of the recent replies, the text device the complete summary
+        latency = self.metrics.latency(0.95)
+        if latency is not None:
+            self.UpdateDevice(UNIT_LATENCY, 0, str(round(latency * 1000, 1)))
+        self.UpdateDevice(UNIT_METRICS, 0, self.metrics.summary())
 
+    def PowerOn(self, now=None):
+        # WOL burst when a MAC address is configured and setPowerStatus alongside it (works on Android),
+        # then poll tightly until the TV is active
+        if now is None:
+            now = time.time()
+        if not self.rc.has_wol():
+            log.debug("No MAC address configured, TV will be started with setPowerStatus command (Android only)")
+        self.rc.turn_on()
+        # The TV may have been unreachable for a long time, it should answer soon now
+        self.link.reset()
+        if not self.HttpConn.Connected() and not self.HttpConn.Connecting():
+            self.Connect(now)
+        self.powerOnRequested = now
+        self.scheduler.wake(now)
+        # Show that the TV is starting, as booting the TV takes some time
+        if self.state.power_on():
+            self.Show(now)
+
+    def Waking(self, now):
+        return self.powerOnRequested and self.scheduler.waking(now)
+
+    def PowerOnDone(self, now):
+        elapsed = now - self.powerOnRequested
+        self.powerOnRequested = 0
+        self.powerOnTimes = (self.powerOnTimes + [elapsed])[-POWER_ON_SAMPLES:]
+        log.info("%sTV active %s seconds after the power-on command", self.prefix, round(elapsed, 1))
+
+    def Connect(self, now):
+        self.link.connecting(now)
+        self.rc.clear_pending()
+        self.HttpConn.Connect()
+
+    def onHeartbeat(self, now):
+        # Requests time out one by one, a few in a row without any reply means the connection is hung
+        expired = self.rc.expire_requests(now)
+        if expired and self.link.timeout(expired) and self.HttpConn.Connected():
+            log.debug("No replies from the TV, dropping the connection")
+            self.HttpConn.Disconnect()
+        if self.ip is not None:
+            self.ip.expire(now)
+        self.volume.flush(now)
+        if self.powerOnRequested and not self.scheduler.waking(now):
+            log.info("%sTV did not become active after the power-on command", self.prefix)
+            self.powerOnRequested = 0
+            if self.state.wake_failed(self.link.reachable):
+                self.Show(now)
+        if self.state.on() and self.programme is not None:
+            self.ShowProgress(now)
+            if self.programme.ended(now) and now >= self.programmeRecheck:
+                # The next programme should have started, the TV may lag behind its guide
+                self.programmeRecheck = now + PROGRAMME_RECHECK
+                self.AskPlayingInfo()
+        if self.scheduler.due(now):
+            self.scheduler.polled(now)
+            if self.Waking(now):
+                # The network interface of a TV in deep standby may miss the first packets
+                self.rc.turn_on_WOL()
+            if (self.HttpConn.Connected()):
+                self.Refresh(now)
+        # While the TV is starting up it is tried at the base interval, even when the circuit was open
+        if (not self.HttpConn.Connected() and not self.HttpConn.Connecting()
+                and self.link.due(now, RECONNECT_BASE if self.Waking(now) else None)):
+            self.Connect(now)
+        if (self.IpConn is not None and now >= self.nextIpConnect
+                and not self.IpConn.Connected() and not self.IpConn.Connecting()):
+            self.nextIpConnect = now + IP_RETRY
+            self.IpConn.Connect()
         return
+
+    def Refresh(self, now=None):
+        # One round trip: while the TV is known to be on, playing info and volume are asked together with the
+        # power status instead of after its reply. Replies that turn out to follow a switch-off are ignored
+        if now is None:
+            now = time.time()
+        self.rc.get_power_status(self.onPowerStatus)
+        if self.state.on():
+            self.GetTVInfo(self.lastRefresh)
+        self.lastRefresh = now
+
+    def GetTVInfo(self, since=None):
+        # Requests carry their own id, so playing info and volume can be in flight together. Skipped are
+        # queries already in flight, playing info that was asked after since (a notification or command
+        # asked for it) and volume the TV pushed after since; without since both are asked. While the TV
+        # pushes channel and input changes a running programme needs no polling, its end is followed by
+        # onHeartbeat and commands forget the programme. Volume isn't asked while changes are in flight,
+        # the reply would be ignored
+        if ((since is None or self.playingAsked <= since) and not self.rc.is_pending("getPlayingContentInfo")
+                and not (self.scheduler.push and self.programme is not None and not self.programme.ended())):
+            self.rc.get_playing_info(self.onPlayingContent)
+        if (Parameters["Mode3"] == "Volume" and (since is None or self.volumePushed <= since) and not self.volume.busy()
+                and not self.rc.is_pending("getVolumeInformation")):
+            self.rc.get_volume_info(self.onVolumeInfo)
+
+    def AskPlayingInfo(self):
+        # Outside the refresh, the next refresh can leave playing info out
+        self.playingAsked = time.time()
+        self.rc.get_playing_info(self.onPlayingContent)
+
+# Handler per media type of the HTTP replies, other replies are ignored
+RESPONSE_HANDLERS = {
+    bravia_decode.JSON: BraviaTV.onJsonResponse,
+    bravia_decode.XML: BraviaTV.onIrccResponse,
+}
+
+class BasePlugin:
+    tvs = []
+    tvsByConnection = {}
+    nextStatsLog = 0
+    nextMetrics = 0
+    nextSnapshot = 0
+    capture = None
+    heartbeat = HEARTBEAT_TICK
+  
+    def onStart(self):
+        log.set_debug(Parameters["Mode6"] == "Debug")
+
+        # Optional forced rewrite of unchanged devices, refresh=<minutes> in the options field
+        options = ParseOptions(Parameters["Mode4"])
+        SetDeviceRefresh(int(options.get("refresh", 0)) * 60)
+        push = options.get("push")
+        transport = options.get("transport", "http")
+        metrics = options.get("metrics")
+
+        # Jitter of polls and reconnects comes from one generator, its seed goes into a capture so a replay
+        # draws the same delays. seed=<n> is set by replay.py
+        seed = int(options["seed"]) if "seed" in options else random.randrange(1 << 32)
+        _random.seed(seed)
+
+        # capture=<file> records the traffic with the TVs for replay.py, relative to the plugin folder
+        self.capture = None
+        if options.get("capture"):
+            path = os.path.join(Parameters.get("HomeFolder", ""), options["capture"])
+            try:
+                self.capture = CaptureWriter(path)
+                self.capture.start(Parameters, seed)
+                log.info("Capturing the traffic with the TVs to %s", path)
+            except (IOError, OSError) as err:
+                log.error("Capture file %s could not be opened: %s", path, err)
+                self.capture = None
+
+        # Set update interval while the TV is on, values below 10 seconds are not allowed due to the request timeout
+        # The heartbeat itself is a short tick, the scheduler polls faster after commands and backs off while the TV is off
+        updateInterval = int(Parameters["Mode5"])
+        if updateInterval > 300: updateInterval = 300
+        elif updateInterval < 10: updateInterval = 10
+        log.debug("Update interval set to %s (minimum is 10 seconds)", updateInterval)
+
+        # Address, PSK and MAC fields take a ; or , separated list, one entry per TV
+        self.tvs = []
+        self.tvsByConnection = {}
+        for index, (address, port, psk, mac) in enumerate(ParseFleet(Parameters["Address"], Parameters["Mode1"], Parameters["Mode2"])):
+            if index >= MAX_TVS:
+                log.error("Only %s TVs per hardware entry are supported, ignoring %s", MAX_TVS, address)
+                continue
+            # push and transport take one value for all TVs or a , separated list in fleet order
+            tvPush = FleetOption(push, index)
+            ipCommands = FleetOption(transport, index).lower() == "ip"
+            pushPort = IpPort(tvPush, port)
+            ipPort = pushPort if pushPort is not None or not ipCommands else bravia_ip.PORT
+            tv = BraviaTV(index, address, port, psk, mac, ipPort, pushPort is not None, ipCommands,
+                          OptionEnabled(FleetOption(metrics, index)))
+            tv.rc.capture = self.capture
+            if tv.ip is not None:
+                tv.ip.capture = self.capture
+            self.tvs.append(tv)
+            self.tvsByConnection[tv.HttpConn.Name] = tv
+            if tv.IpConn is not None:
+                self.tvsByConnection[tv.IpConn.Name] = tv
+
+        # Spread the first polls over the interval so the TVs don't poll at the same moment
+        for tv in self.tvs:
+            tv.onStart(updateInterval, updateInterval * tv.index / len(self.tvs))
+        Domoticz.Heartbeat(HEARTBEAT_TICK)
+        self.nextSnapshot = time.time() + SNAPSHOT_INTERVAL
         
-    def onStop(self):
-        Domoticz.Debug("onStop called")
         return True
 
-    def TurnOn(self):
+    def onConnect(self, Connection, Status, Description):
+        if self.capture is not None:
+            self.capture.connect(Connection.Name, Status, Description)
+        tv = self.tvsByConnection.get(Connection.Name)
+        if tv is not None:
+            tv.onConnect(Connection, Status, Description)
+        return True
 
+    def onDisconnect(self, Connection):
+        if self.capture is not None:
+            self.capture.disconnect(Connection.Name)
+        tv = self.tvsByConnection.get(Connection.Name)
+        if tv is not None:
+            tv.onDisconnect(Connection)
         return
 
-    def TurnOff(self):
-
+    def onCommand(self, Unit, Command, Level, Hue):
+        log.debug("onCommand called for Unit %s: Parameter '%s', Level: %s", Unit, Command, Level)
+        if self.capture is not None:
+            self.capture.command(Unit, Command, Level, Hue)
+        index = (Unit - 1) // UNITS_PER_TV
+        if index < len(self.tvs):
+            self.tvs[index].onCommand(Unit, Command, Level, Hue)
         return
-    def GetTVInfo(self):
-        self._getState = "TVInfo"
-        _tv.get_playing_info()
-
-    def SyncDevices(self):
-        # TV is off
-        if self.powerOn == False:
-            if self.tvPlaying == "TV starting":         # TV is booting and not yet responding to get_power_status
-                UpdateDevice(7, 1, self.tvPlaying)
-                UpdateDevice(3, 1, self.tvSource)
-            else:                                       # TV is off so set devices to off
-                self.tvPlaying = "Off"
-                self.ClearDevices()
-        # TV is on
-        else:
-            if self.tvPlaying == "Off":                 # TV is set to off in Domoticz, but self.powerOn is still true
-                self.ClearDevices()
-            else:                                       # TV is on so set devices to on
-                if not self.tvPlaying:
-                    Domoticz.Debug("No information from TV received (TV was paused and then continued playing from disk) - SyncDevices")
-                else:
-                    UpdateDevice(7, 1, self.tvPlaying)
-                    UpdateDevice(3, 1, str(self.tvSource))
-                if Parameters["Mode3"] == "Volume": 
-                    UpdateDevice(2, 2, str(self.tvVolume))
-                
-                UpdateDevice(4, 1, str(self.tvControl))
-                UpdateDevice(5, 1, str(self.tvChannel))
 
+    def onMessage(self, Connection, Data):
+        if self.capture is not None:
+            self.capture.message(Connection.Name, Data)
+        tv = self.tvsByConnection.get(Connection.Name)
+        if tv is not None:
+            tv.onMessage(Connection, Data)
+        return True
+
+    def onNotification(self, Name, Subject, Text, Status, Priority, Sound, ImageFile):
+        log.info("Notification: %s,%s,%s,%s,%s,%s,%s", Name, Subject, Text, Status, Priority, Sound, ImageFile)
+
+    def onHeartbeat(self):
+        if self.capture is not None:
+            self.capture.heartbeat()
+        now = time.time()
+        for tv in self.tvs:
+            tv.onHeartbeat(now)
+
+        # Short heartbeat while a TV is starting, so readiness polls aren't held back by the tick
+        heartbeat = WAKE_TICK if any(tv.Waking(now) for tv in self.tvs) else HEARTBEAT_TICK
+        if heartbeat != self.heartbeat:
+            self.heartbeat = heartbeat
+            Domoticz.Heartbeat(heartbeat)
+
+        if now >= self.nextSnapshot:
+            self.nextSnapshot = now + SNAPSHOT_INTERVAL
+            for tv in self.tvs:
+                tv.SaveSnapshot()
+
+        if now >= self.nextMetrics:
+            self.nextMetrics = now + METRICS_INTERVAL
+            for tv in self.tvs:
+                if tv.publishMetrics:
+                    tv.PublishMetrics()
+
+        if now >= self.nextStatsLog:
+            self.nextStatsLog = now + STATS_INTERVAL
+            for tv in self.tvs:
+                # The summary line is logged for TVs with metrics=on, the per-method figures only with debug logging
+                if tv.publishMetrics:
+                    log.info("%sMetrics: %s", tv.prefix, tv.metrics.summary())
+                if log.debugging():
+                    for line in tv.metrics.method_lines():
+                        log.debug("%sMetrics %s", tv.prefix, line)
+            if log.debugging():
+                log.debug("Device writes: %s performed, %s suppressed", deviceWrites["performed"], deviceWrites["suppressed"])
+                log.debug("Volume requests: %s sent, %s changes coalesced", sum(tv.volume.requests for tv in self.tvs), sum(tv.volume.coalesced for tv in self.tvs))
+                powerOnTimes = [elapsed for tv in self.tvs for elapsed in tv.powerOnTimes]
+                if powerOnTimes:
+                    log.debug("Power-on: %s seconds average over %s starts", round(sum(powerOnTimes) / len(powerOnTimes), 1), len(powerOnTimes))
         return
-    
-    def ClearDevices(self):
-        self.tvPlaying = "Off"
-        UpdateDevice(7, 0, self.tvPlaying)
-        UpdateDevice(1, 0, self.tvPlaying)          #Status
-        if Parameters["Mode3"] == "Volume": UpdateDevice(2, 0, str(self.tvVolume))  #Volume
-        self.tvSource = 0
-        self.tvControl = 0
-        self.tvChannel = 0
-        UpdateDevice(3, 0, str(self.tvSource))      #Source
-        UpdateDevice(4, 0, str(self.tvControl))     #Control
-        UpdateDevice(5, 0, str(self.tvChannel))     #Channel
         
-        return
+    def onStop(self):
+        log.debug("onStop called")
+        for tv in self.tvs:
+            tv.SaveSnapshot()
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+        return True
 
 global _plugin
 _plugin = BasePlugin()
@@ -490,40 +1174,120 @@ def onHeartbeat():
 def DumpConfigToLog():
     for x in Parameters:
         if Parameters[x] != "":
-            Domoticz.Debug( "'" + x + "':'" + str(Parameters[x]) + "'")
-    Domoticz.Debug("Settings count: " + str(len(Settings)))
+            log.debug("'%s':'%s'", x, Parameters[x])
+    log.debug("Settings count: %s", len(Settings))
     for x in Settings:
-        Domoticz.Debug( "'" + x + "':'" + str(Settings[x]) + "'")
-    Domoticz.Debug("Image count: " + str(len(Images)))
+        log.debug("'%s':'%s'", x, Settings[x])
+    log.debug("Image count: %s", len(Images))
     for x in Images:
-        Domoticz.Debug( "'" + x + "':'" + str(Images[x]) + "'")
-    Domoticz.Debug("Device count: " + str(len(Devices)))
+        log.debug("'%s':'%s'", x, Images[x])
+    log.debug("Device count: %s", len(Devices))
     for x in Devices:
-        Domoticz.Debug("Device:           " + str(x) + " - " + str(Devices[x]))
-        Domoticz.Debug("Device ID:       '" + str(Devices[x].ID) + "'")
-        Domoticz.Debug("Device Name:     '" + Devices[x].Name + "'")
-        Domoticz.Debug("Device nValue:    " + str(Devices[x].nValue))
-        Domoticz.Debug("Device sValue:   '" + Devices[x].sValue + "'")
-        Domoticz.Debug("Device LastLevel: " + str(Devices[x].LastLevel))
-        Domoticz.Debug("Device Image:     " + str(Devices[x].Image))
+        log.debug("Device:           %s - %s", x, Devices[x])
+        log.debug("Device ID:       '%s'", Devices[x].ID)
+        log.debug("Device Name:     '%s'", Devices[x].Name)
+        log.debug("Device nValue:    %s", Devices[x].nValue)
+        log.debug("Device sValue:   '%s'", Devices[x].sValue)
+        log.debug("Device LastLevel: %s", Devices[x].LastLevel)
+        log.debug("Device Image:     %s", Devices[x].Image)
     return
  
-def UpdateDevice(Unit, nValue, sValue):
+def ParseFleet(addresses, psks, macs):
+    # One entry per TV, a single PSK or MAC applies to every TV. Address may carry a port, e.g. 192.168.1.20:8080
+    def split(text):
+        return [item.strip() for item in text.replace(",", ";").split(";") if item.strip()]
+    addresses = split(addresses)
+    psks = split(psks) or [""]
+    macs = split(macs) or ["Android"]
+    fleet = []
+    for index, address in enumerate(addresses):
+        host, sep, port = address.partition(":")
+        psk = psks[index] if index < len(psks) else psks[-1]
+        mac = macs[index] if index < len(macs) else macs[-1]
+        fleet.append((host, port if sep else "80", psk, mac))
+    return fleet
+
+def ChannelNumber(dispNum):
+    # Number of a channel ("012" -> 12), None when the TV reported something else
+    try:
+        return int(dispNum)
+    except (TypeError, ValueError):
+        return None
+
+def ParseOptions(text):
+    # Options field holds space or semicolon separated key=value pairs, a key without value is a flag
+    options = {}
+    for item in text.replace(";", " ").split():
+        key, sep, value = item.partition("=")
+        options[key.strip().lower()] = value.strip() if sep else "true"
+    return options
+
+def FleetOption(value, index):
+    # Option value of the TV at index: the only value, the value at its position or the last one
+    if value is None:
+        return None
+    values = value.split(",")
+    return values[min(index, len(values) - 1)].strip()
+
+def OptionEnabled(value):
+    # on/true/1/yes switch an option on, anything else (or no value) leaves it off
+    return value is not None and value.lower() in ("on", "true", "1", "yes")
+
+def IpPort(push, httpPort):
+    # push=on uses the Simple IP Control port, push=<port> another port and push=+<n> the HTTP port + n
+    if push is None or push.lower() in ("off", "false", "0", "no"):
+        return None
+    if push.lower() in ("on", "true", "1", "yes"):
+        return bravia_ip.PORT
+    if push.startswith("+"):
+        return int(httpPort) + int(push[1:])
+    return int(push)
+
+# Last nValue/sValue written per unit, so unchanged values don't cost a database write and event run
+_deviceCache = {}
+_deviceRefresh = 0
+# Random source of the poll and reconnect jitter, seeded in onStart
+_random = random.Random()
+deviceWrites = {"performed": 0, "suppressed": 0}
+
+def SetDeviceRefresh(seconds):
+    # Rewrite a device even when its value didn't change once this many seconds passed, 0 disables it
+    global _deviceRefresh
+    _deviceRefresh = seconds
+
+def DeviceLevel(Unit):
+    # Level (sValue) of a selector or dimmer device, 0 when the device is missing or has no level
+    try:
+        return int(Devices[Unit].sValue)
+    except (KeyError, ValueError):
+        return 0
+
+def ForgetDevice(Unit):
+    _deviceCache.pop(Unit, None)
+
+def UpdateDevice(Unit, nValue, sValue, Force=False, Options=None):
     # Make sure that the Domoticz device still exists (they can be deleted) before updating it 
+    # Returns True when the device was written, False when the value was unchanged or the device is gone
     if (Unit in Devices):
-        #if (Devices[Unit].nValue != nValue) or (Devices[Unit].sValue != sValue):
-        Devices[Unit].Update(nValue=nValue, sValue=str(sValue))
+        sValue = str(sValue)
+        now = time.time()
+        if Options is not None:
+            Devices[Unit].Update(nValue=nValue, sValue=sValue, Options=Options)
+            _deviceCache[Unit] = (nValue, sValue, now)
+            deviceWrites["performed"] += 1
+            return True
+        cached = _deviceCache.get(Unit)
+        if cached is None:
+            cached = (Devices[Unit].nValue, Devices[Unit].sValue, now)
+            _deviceCache[Unit] = cached
+        if not Force and cached[0] == nValue and cached[1] == sValue and \
+                (_deviceRefresh <= 0 or now - cached[2] < _deviceRefresh):
+            deviceWrites["suppressed"] += 1
+            return False
+        Devices[Unit].Update(nValue=nValue, sValue=sValue)
+        _deviceCache[Unit] = (nValue, sValue, now)
+        deviceWrites["performed"] += 1
+        return True
     else:
-        Domoticz.Debug("### Warning: "+str(Unit)+" not found in devices")
-    return
-
-def DumpHTTPResponseToLog(httpDict):
-    if isinstance(httpDict, dict):
-        Domoticz.Debug("HTTP Details ("+str(len(httpDict))+"):")
-        for x in httpDict:
-            if isinstance(httpDict[x], dict):
-                Domoticz.Debug("--->'"+x+" ("+str(len(httpDict[x]))+"):")
-                for y in httpDict[x]:
-                    Domoticz.Debug("------->'" + y + "':'" + str(httpDict[x][y]) + "'")
-            else:
-                Domoticz.Debug("--->'" + x + "':'" + str(httpDict[x]) + "'")
\ No newline at end of file
+        log.warning("Device %s not found, it may have been deleted", Unit)
+    return False
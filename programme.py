@@ -0,0 +1,76 @@
+import calendar
+import collections
+import time
+
+# Programmes kept per TV, a few per channel that was watched
+CACHE_SIZE = 64
+
+def parse_datetime(text):
+    """Seconds since the epoch of a startDateTime like 2017-03-24T00:00:00+0100.
+    The offset may also be written +01:00 or Z, without one the time is taken as local time."""
+    if len(text) < 19 or text[4] != "-" or text[10] != "T":
+        raise ValueError("Invalid date and time: " + text)
+    fields = (int(text[0:4]), int(text[5:7]), int(text[8:10]), int(text[11:13]), int(text[14:16]), int(text[17:19]))
+    offset = text[19:]
+    if not offset:
+        return time.mktime(fields + (0, 0, -1))
+    if offset == "Z":
+        seconds = 0
+    else:
+        digits = offset[1:].replace(":", "")
+        seconds = int(digits[0:2]) * 3600 + int(digits[2:4] or "0") * 60
+        if offset[0] == "-":
+            seconds = -seconds
+        elif offset[0] != "+":
+            raise ValueError("Invalid time zone offset: " + text)
+    return calendar.timegm(fields + (0, 0, 0)) - seconds
+
+class Programme:
+    """Start and end of a programme, parsed once, progress is computed from the clock."""
+
+    __slots__ = ("uri", "start", "end", "duration", "start_text", "end_text")
+
+    def __init__(self, uri, start, duration):
+        self.uri = uri
+        self.start = start
+        self.duration = duration
+        self.end = start + duration
+        # Shown in the local time of the Domoticz host
+        self.start_text = time.strftime("%H:%M", time.localtime(self.start))
+        self.end_text = time.strftime("%H:%M", time.localtime(self.end))
+
+    def progress(self, now=None):
+        """Percentage played, 0..100."""
+        if now is None:
+            now = time.time()
+        if self.duration <= 0:
+            return 0
+        return max(0, min(100, int(round((now - self.start) * 100.0 / self.duration))))
+
+    def ended(self, now=None):
+        if now is None:
+            now = time.time()
+        return now >= self.end
+
+class ProgrammeCache:
+    """Programmes by (uri, startDateTime, durationSec), so a poll of the same programme parses nothing."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._programmes = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, uri, startDateTime, durationSec):
+        key = (uri, startDateTime, durationSec)
+        programme = self._programmes.get(key)
+        if programme is not None:
+            self.hits += 1
+            self._programmes.move_to_end(key)
+            return programme
+        self.misses += 1
+        programme = Programme(uri, parse_datetime(startDateTime), int(durationSec))
+        self._programmes[key] = programme
+        if len(self._programmes) > self.size:
+            self._programmes.popitem(last=False)
+        return programme
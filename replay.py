@@ -0,0 +1,224 @@
+"""Replays a capture (capture=<file> option) into the plugin without TVs.
+
+The plugin is loaded through fakeDomoticz with its connections replaced by stubs
+and a clock that follows the capture, so timeouts, polls and programme progress
+happen at the captured moments whatever the replay speed. The jitter of polls and
+reconnects is drawn with the seed of the capture. Replies are matched to the
+requests the plugin sends during the replay by method, so their JSON-RPC ids
+needn't be the same as in the field. Requests that differ from the captured ones
+are reported, the replies that follow them no longer fit:
+
+    python replay.py capture.bin                 # as fast as possible
+    python replay.py capture.bin.gz --speed 1    # at the original pace
+    python replay.py capture.bin --repeat 20     # benchmark the callbacks
+"""
+
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+
+import capture
+import fakeDomoticz
+
+class ReplayConnection:
+    """Takes the place of Domoticz.Connection, the capture decides when it is connected."""
+
+    replayer = None
+
+    def __init__(self, Name="", Transport="TCP/IP", Protocol="None", Address="", Port=""):
+        self.Name = Name
+        self.Transport = Transport
+        self.Protocol = Protocol
+        self.Address = Address
+        self.Port = Port
+        self.state = "disconnected"
+        self.replayer.connections[Name] = self
+
+    def Connect(self):
+        self.state = "connecting"
+
+    def Connecting(self):
+        return self.state == "connecting"
+
+    def Connected(self):
+        return self.state == "connected"
+
+    def Disconnect(self):
+        self.state = "disconnected"
+
+    def Send(self, Message, Delay=0):
+        self.replayer.sent(self, Message)
+
+def request_method(data):
+    """(method, id) of a JSON-RPC request body, None for other requests."""
+    try:
+        request = json.loads(data)
+        return request["method"], request["id"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def request_key(connection, url, data):
+    """What a sent request is compared by: the method of a JSON-RPC request, the URL of another
+    HTTP request or the bytes of a Simple IP frame."""
+    request = request_method(data)
+    if request is not None:
+        return connection, request[0]
+    if url:
+        return connection, url
+    return connection, data if isinstance(data, bytes) else str(data).encode("utf-8")
+
+class Replayer:
+    def __init__(self, path, plugin_path, quiet=True):
+        self.path = path
+        self.plugin_path = plugin_path
+        self.quiet = quiet
+        self.connections = {}
+        self.now = 0
+        self.sends = 0
+        self.captured_sends = 0
+        self.unmatched = 0
+        self.seeded = False
+        self.mismatch = None                        # (index, captured, replayed) of the first request that differs
+        self._captured_keys = []
+        self._replayed_keys = []
+        self._captured_methods = {}                 # (connection, captured id) -> method
+        self._live_ids = collections.defaultdict(collections.deque)    # (connection, method) -> ids sent in the replay
+
+    def clock(self):
+        return self.now
+
+    def sent(self, connection, message):
+        self.sends += 1
+        if isinstance(message, dict):
+            self._replayed_keys.append(request_key(connection.Name, message.get("URL"), message.get("Data", "")))
+            request = request_method(message.get("Data"))
+            if request is not None:
+                self._live_ids[(connection.Name, request[0])].append(request[1])
+        else:
+            self._replayed_keys.append(request_key(connection.Name, None, message))
+
+    def compare(self):
+        """Finds the first request of the replay that isn't the one sent at that point of the capture."""
+        for index in range(max(len(self._captured_keys), len(self._replayed_keys))):
+            captured = self._captured_keys[index] if index < len(self._captured_keys) else None
+            replayed = self._replayed_keys[index] if index < len(self._replayed_keys) else None
+            if captured != replayed:
+                self.mismatch = (index + 1, captured, replayed)
+                return
+
+    def reply(self, name, data):
+        # The id of the captured reply is replaced by the id the plugin used for the same method
+        try:
+            resp = json.loads(data.decode("utf-8"))
+        except ValueError:
+            return data
+        method = self._captured_methods.pop((name, resp.get("id")), None)
+        live = self._live_ids.get((name, method))
+        if not live:
+            self.unmatched += 1
+            return data
+        resp["id"] = live.popleft()
+        return json.dumps(resp).encode("utf-8")
+
+    def run(self, speed=0.0):
+        records = capture.read_records(self.path)
+        start = next(records, None)
+        if start is None or start.get("k") != "start":
+            raise ValueError(self.path + " is not a capture")
+        parameters = dict(start["parameters"], HomeFolder="")
+        # The replay must not capture itself or use the caches of the plugin folder
+        options = [item for item in parameters.get("Mode4", "").replace(";", " ").split()
+                   if not item.lower().startswith(("capture=", "seed="))]
+        # Captures made before the seed was recorded replay with other jitter, their polls may come at other moments
+        if start.get("seed") is not None:
+            options.append("seed=" + str(start["seed"]))
+            self.seeded = True
+        parameters["Mode4"] = " ".join(options)
+        runtime = fakeDomoticz.Runtime(self.plugin_path, parameters, quiet=self.quiet)
+        runtime.load()
+        # Every module reads the time through time.time, the replay clock takes its place
+        saved_time, saved_connection = time.time, fakeDomoticz.Connection
+        ReplayConnection.replayer = self
+        time.time = self.clock
+        fakeDomoticz.Connection = ReplayConnection
+        began = saved_time()
+        try:
+            self.now = start["t"]
+            runtime.callback("onStart")
+            for record in records:
+                if speed > 0:
+                    delay = (record["t"] - self.now) / speed - (saved_time() - began)
+                    if delay > 0:
+                        time.sleep(delay)
+                    began = saved_time()
+                self.now = record["t"]
+                if not self.dispatch(runtime, record):
+                    break
+        finally:
+            time.time = saved_time
+            fakeDomoticz.Connection = saved_connection
+        self.compare()
+        return runtime
+
+    def dispatch(self, runtime, record):
+        kind = record["k"]
+        connection = self.connections.get(record.get("conn"))
+        if kind == "sent":
+            self.captured_sends += 1
+            data = capture.decode_data(record)
+            self._captured_keys.append(request_key(record["conn"], record.get("url"), data))
+            request = request_method(data)
+            if request is not None:
+                self._captured_methods[(record["conn"], request[1])] = request[0]
+        elif kind == "connect" and connection is not None:
+            connection.state = "connected" if record["status"] == 0 else "disconnected"
+            runtime.callback("onConnect", connection, record["status"], record["description"])
+        elif kind == "disconnect" and connection is not None:
+            connection.state = "disconnected"
+            runtime.callback("onDisconnect", connection)
+        elif kind == "message" and connection is not None:
+            data = capture.decode_data(record)
+            if record.get("raw"):
+                runtime.callback("onMessage", connection, data)
+            else:
+                if "json" in record["headers"].get("Content-Type", ""):
+                    data = self.reply(record["conn"], data)
+                runtime.callback("onMessage", connection, {"Status": record["status"], "Headers": record["headers"], "Data": data})
+        elif kind == "command":
+            runtime.callback("onCommand", record["unit"], record["command"], record["level"], record["hue"])
+        elif kind == "heartbeat":
+            runtime.callback("onHeartbeat")
+        elif kind == "stop":
+            runtime.callback("onStop")
+            return False
+        return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a capture into the plugin")
+    parser.add_argument("capture")
+    parser.add_argument("--plugin", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugin.py"))
+    parser.add_argument("--speed", type=float, default=0.0, help="1 replays at the original pace, 10 ten times faster, 0 without waiting")
+    parser.add_argument("--repeat", type=int, default=1, help="replay this many times, for benchmarking")
+    parser.add_argument("--verbose", action="store_true", help="print the plugin log")
+    args = parser.parse_args()
+
+    for run in range(args.repeat):
+        replayer = Replayer(args.capture, args.plugin, quiet=not args.verbose)
+        started = time.perf_counter()
+        runtime = replayer.run(args.speed)
+        elapsed = time.perf_counter() - started
+        print("Replay %d: %.3f s, %d requests sent (%d captured), %d replies without request, %d device updates"
+              % (run + 1, elapsed, replayer.sends, replayer.captured_sends, replayer.unmatched, len(runtime.updates)))
+        if not replayer.seeded:
+            print("The capture has no seed, polls and reconnects may come at other moments than in the field")
+        if replayer.mismatch is not None:
+            index, captured, replayed = replayer.mismatch
+            print("Replay differs from the capture at request %d: captured %s, replayed %s" % (index, captured, replayed))
+    print(runtime.summary(elapsed))
+    return 0 if replayer.mismatch is None else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
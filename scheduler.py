@@ -0,0 +1,121 @@
+import random
+import time
+
+# Poll interval right after a user command or power-on, so the devices follow the TV quickly
+FAST_INTERVAL = 2
+# Seconds the fast interval is used after a command or power-on
+FAST_WINDOW = 20
+# Poll interval while waiting for the TV to come up after a power-on command
+WAKE_INTERVAL = 1
+# Seconds a power-on command is followed before giving up
+WAKE_WINDOW = 60
+# Upper limit of the backed off interval while the TV is off or in standby
+IDLE_MAX_INTERVAL = 300
+# Interval of the consistency check while the TV pushes its changes (Simple IP Control)
+PUSH_INTERVAL = 300
+# Random spread on every interval (fraction), keeps several TVs from polling in lockstep
+JITTER = 0.1
+
+class PollScheduler:
+    """Decides when the next getPowerStatus poll is due.
+
+    The plugin heartbeat is only a tick, the scheduler picks the real interval:
+    fast for a short window after a command or power-on, the configured interval
+    while the TV is active and an exponentially growing one while it is off.
+    While the TV pushes its changes polling is only a slow consistency check.
+    After a power-on command it polls every WAKE_INTERVAL until the TV is active."""
+
+    def __init__(self, interval, fast_interval=FAST_INTERVAL, fast_window=FAST_WINDOW,
+                 idle_max=IDLE_MAX_INTERVAL, jitter=JITTER, rng=None, push_interval=PUSH_INTERVAL):
+        self.interval = interval
+        self.push_interval = max(push_interval, interval)
+        self.push = False
+        self.fast_interval = fast_interval
+        self.fast_window = fast_window
+        self.idle_max = max(idle_max, interval)
+        self.jitter = jitter
+        self._rng = rng or random.Random()
+        self._status = None
+        self._idle_interval = interval
+        self._fast_until = 0
+        self._wake_until = 0
+        self._next_poll = 0
+
+    def start(self, now=None, offset=0):
+        """Schedule the first poll, offset spreads the first polls of several TVs."""
+        if now is None:
+            now = time.time()
+        self._next_poll = now + offset
+
+    def due(self, now=None):
+        if now is None:
+            now = time.time()
+        return now >= self._next_poll
+
+    def polled(self, now=None):
+        """A poll was sent, plan the next one."""
+        if now is None:
+            now = time.time()
+        if now < self._wake_until:
+            delay = WAKE_INTERVAL
+        elif now < self._fast_until:
+            delay = self.fast_interval
+        elif self.push:
+            delay = self.push_interval
+        elif self._status == 'active':
+            delay = self.interval
+        else:
+            delay = self._idle_interval
+            self._idle_interval = min(self._idle_interval * 2, self.idle_max)
+        self._next_poll = now + self._spread(delay)
+        return self._next_poll
+
+    def boost(self, now=None):
+        """Poll fast for a while, used after a user command or when the TV powers on."""
+        if now is None:
+            now = time.time()
+        self._fast_until = now + self.fast_window
+        self._next_poll = min(self._next_poll, now + self.fast_interval)
+
+    def wake(self, now=None, window=WAKE_WINDOW):
+        """A power-on command was sent, poll tightly until the TV reports active or the window passed."""
+        if now is None:
+            now = time.time()
+        self._wake_until = now + window
+        self._next_poll = now
+
+    def waking(self, now=None):
+        if now is None:
+            now = time.time()
+        return now < self._wake_until
+
+    def on_power(self, status, now=None):
+        """Feed the power status reported by the TV ('active', 'standby', 'off')."""
+        if now is None:
+            now = time.time()
+        if status == 'active':
+            if self._wake_until:
+                self._wake_until = 0
+                self.boost(now)
+            elif self._status is not None and self._status != 'active':
+                self.boost(now)
+            self._idle_interval = self.interval
+        elif self._status == 'active':
+            # Just switched off, start backing off from the normal interval
+            self._idle_interval = self.interval
+        self._status = status
+
+    def set_push(self, active, now=None):
+        """The TV pushes its changes (active) or the notification connection was lost."""
+        if now is None:
+            now = time.time()
+        if self.push and not active:
+            # Nothing was polled for a while, catch up soon
+            self._next_poll = min(self._next_poll, now + self.fast_interval)
+        self.push = active
+
+    def next_poll(self):
+        return self._next_poll
+
+    def _spread(self, delay):
+        return delay * (1 + self._rng.uniform(-self.jitter, self.jitter))
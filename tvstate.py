@@ -0,0 +1,164 @@
+"""Power state and playing state of one TV, and the device values that follow from them.
+
+The power state only changes through the events below, along these transitions:
+
+    off -----> waking -----> active <----> standby
+     ^           |             |              |
+     +-----------+-------------+--------------+
+
+off is a TV that doesn't answer, standby one that answers with its screen off.
+A TV that is starting up may still report standby, and one that was just
+switched off may still report active; neither is taken as a state change.
+Leaving active forgets what was playing. No Domoticz dependency.
+"""
+
+# Power states
+OFF = "off"
+WAKING = "waking"
+ACTIVE = "active"
+STANDBY = "standby"
+
+# States each state can move to
+TRANSITIONS = {
+    OFF: (WAKING, ACTIVE, STANDBY),
+    WAKING: (ACTIVE, STANDBY, OFF),
+    ACTIVE: (STANDBY, OFF),
+    STANDBY: (WAKING, ACTIVE, OFF),
+}
+
+# Seconds after a switch-off in which an active power status is taken to be from before it
+SWITCH_OFF_GRACE = 10
+
+# Devices of a TV
+STATUS = "status"
+INFO = "info"
+VOLUME = "volume"
+SOURCE = "source"
+CONTROL = "control"
+CHANNEL = "channel"
+APPS = "apps"
+
+class TVState:
+    """What the plugin knows of a TV. Levels are the selector levels of the devices, 0 when nothing is selected."""
+
+    __slots__ = ("power", "title", "info", "source", "control", "channel", "app", "volume", "muted", "_switched_off")
+
+    def __init__(self, power=OFF, title=None, source=0, control=0, channel=0, app=None, volume=0, muted=False):
+        self.power = power
+        self.title = title          # what is playing as shown by the Status device, None until the TV told
+        self.info = None            # programme times and progress shown by the Info device
+        self.source = source
+        self.control = control
+        self.channel = channel
+        self.app = app              # title of the app in front
+        self.volume = volume
+        self.muted = muted
+        self._switched_off = 0
+
+    def on(self):
+        return self.power == ACTIVE
+
+    def _move(self, power):
+        """Changes the power state, returns False when it is unchanged."""
+        if power == self.power:
+            return False
+        if power not in TRANSITIONS[self.power]:
+            raise ValueError("TV can't go from " + self.power + " to " + power)
+        if self.power == ACTIVE:
+            self.title = self.info = self.app = None
+            self.source = self.control = self.channel = 0
+        self.power = power
+        return True
+
+    def power_on(self):
+        """The power-on command was sent."""
+        if self.power in (OFF, STANDBY):
+            return self._move(WAKING)
+        return False
+
+    def switch_off(self, now):
+        """The power-off command was sent."""
+        self._switched_off = now
+        return self._move(STANDBY) if self.power == ACTIVE else False
+
+    def reported(self, status, now):
+        """The TV reported its power status ('active', 'standby'), returns True when the state changed."""
+        if status == "active":
+            if self.power == STANDBY and now - self._switched_off < SWITCH_OFF_GRACE:
+                return False
+            return self._move(ACTIVE)
+        self._switched_off = 0
+        if self.power == WAKING:
+            return False
+        return self._move(STANDBY)
+
+    def wake_failed(self, reachable):
+        """The TV didn't become active in time after the power-on command."""
+        if self.power == WAKING:
+            return self._move(STANDBY if reachable else OFF)
+        return False
+
+    def unreachable(self):
+        """Connecting to the TV failed. A TV that is starting up is given its time."""
+        if self.power == WAKING:
+            return False
+        return self._move(OFF)
+
+    def accepts(self, device, action):
+        """Whether a command makes sense in this state, others are dropped before they cost a request."""
+        if self.power != ACTIVE:
+            return device == STATUS and action == "On"
+        if device == STATUS:
+            return action != "On"
+        if device == VOLUME:
+            # Mute is a toggling remote key, sent twice it would undo itself
+            if action == "Off":
+                return not self.muted
+            if action == "On":
+                return self.muted
+        return True
+
+    def devices(self, app_level=0, volume=True):
+        """(nValue, sValue) per device, devices left out keep their value."""
+        if self.power == WAKING:
+            return {STATUS: (1, "TV starting"), SOURCE: (1, str(self.source))}
+        if self.power != ACTIVE:
+            values = {STATUS: (0, "Off"), INFO: (0, "Off"), SOURCE: (0, "0"), CONTROL: (0, "0"), CHANNEL: (0, "0"), APPS: (0, "0")}
+            if volume:
+                values[VOLUME] = (0, str(self.volume))
+            return values
+        values = {CONTROL: (1, str(self.control)), CHANNEL: (1, str(self.channel)),
+                  APPS: (1 if app_level else 0, str(app_level))}
+        if self.title:
+            values[STATUS] = (1, self.title)
+            values[SOURCE] = (1, str(self.source))
+        # Emptied when there is no programme, the times of the last one would stay otherwise
+        values[INFO] = (1, self.info or "")
+        if volume:
+            values[VOLUME] = (0 if self.muted else 2, str(self.volume))
+        return values
+
+    def to_dict(self):
+        return {"power": self.power, "title": self.title, "source": self.source, "control": self.control,
+                "channel": self.channel, "app": self.app, "volume": self.volume, "muted": self.muted}
+
+    @classmethod
+    def from_dict(cls, data):
+        """State saved by to_dict. A TV that was starting up is taken to be off, its wake-up isn't followed anymore."""
+        power = data.get("power", OFF)
+        if power not in TRANSITIONS or power == WAKING:
+            power = OFF
+        state = cls(power)
+        if power == ACTIVE:
+            state.title = data.get("title")
+            state.source = int(data.get("source", 0))
+            state.control = int(data.get("control", 0))
+            state.channel = int(data.get("channel", 0))
+            state.app = data.get("app")
+        state.volume = int(data.get("volume", 0))
+        state.muted = bool(data.get("muted", False))
+        return state
+
+def changes(shown, values):
+    """(device, value) of the values that differ from those last shown."""
+    return [(device, value) for device, value in values.items() if shown.get(device) != value]
@@ -0,0 +1,98 @@
+import time
+
+# Seconds in which further volume changes are folded into one request
+COALESCE_WINDOW = 0.5
+# Seconds after the last request in which volume reported by the TV may still be the old value
+SETTLE_TIME = 3
+MIN_VOLUME = 0
+MAX_VOLUME = 100
+
+class VolumeController:
+    """Turns slider moves and VolumeUp/VolumeDown presses into as few setAudioVolume requests as possible.
+
+    The first change is sent right away, changes within COALESCE_WINDOW of the
+    previous request are collected: absolute levels replace each other and
+    relative steps add up to one "+N"/"-N". flush() sends what was collected
+    once the window has passed. expected() is the volume the TV will have, for
+    an optimistic device update, and reported() decides whether a volume read
+    from the TV can be trusted or is older than the requests in flight."""
+
+    def __init__(self, send, window=COALESCE_WINDOW, settle=SETTLE_TIME):
+        self._send = send           # send(value): value is an int level or a "+N"/"-N" string
+        self.window = window
+        self.settle = settle
+        self.volume = None          # last volume known from the TV
+        self._absolute = None       # collected absolute level
+        self._relative = 0          # collected relative steps
+        self._expected = None
+        self._last_send = 0
+        self.requests = 0
+        self.coalesced = 0
+
+    def set(self, level, now=None):
+        """Slider moved to an absolute level."""
+        level = max(MIN_VOLUME, min(MAX_VOLUME, int(level)))
+        if self._absolute is not None or self._relative:
+            self.coalesced += 1
+        self._absolute = level
+        self._relative = 0
+        self._expected = level
+        return self._changed(now)
+
+    def step(self, delta, now=None):
+        """VolumeUp (+1) or VolumeDown (-1) pressed."""
+        if self._absolute is not None:
+            self._absolute = max(MIN_VOLUME, min(MAX_VOLUME, self._absolute + delta))
+            self.coalesced += 1
+        else:
+            if self._relative:
+                self.coalesced += 1
+            self._relative += delta
+        base = self._expected if self._expected is not None else self.volume
+        if base is not None:
+            self._expected = max(MIN_VOLUME, min(MAX_VOLUME, base + delta))
+        return self._changed(now)
+
+    def _changed(self, now):
+        if now is None:
+            now = time.time()
+        if now - self._last_send >= self.window:
+            self.flush(now)
+        return self._expected
+
+    def pending(self):
+        return self._absolute is not None or self._relative != 0
+
+    def flush(self, now=None, force=False):
+        """Send the collected change when the window since the previous request has passed."""
+        if now is None:
+            now = time.time()
+        if not self.pending() or (not force and now - self._last_send < self.window):
+            return False
+        if self._absolute is not None:
+            value = self._absolute
+        else:
+            value = "%+d" % self._relative
+        self._absolute = None
+        self._relative = 0
+        self._last_send = now
+        self.requests += 1
+        self._send(value)
+        return True
+
+    def expected(self):
+        """Volume the TV should have once the requests are done, None when unknown."""
+        return self._expected if self._expected is not None else self.volume
+
+    def busy(self, now=None):
+        if now is None:
+            now = time.time()
+        return self.pending() or now - self._last_send < self.settle
+
+    def reported(self, volume, now=None):
+        """Volume read from the TV, returns True when it is taken over (no change in flight)."""
+        if self.busy(now):
+            return False
+        self.volume = int(volume)
+        self._expected = None
+        return True